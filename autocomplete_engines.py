@@ -15,10 +15,47 @@ top-level functions to this file.
 """
 from __future__ import annotations
 import csv
-from typing import Any, Dict, List, Optional, Tuple
+import io
+import itertools
+import operator
+import os
+import pickle
+import re
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, \
+    Optional, Sequence, Tuple
 
 from melody import Melody
-from prefix_tree import SimplePrefixTree, CompressedPrefixTree
+from prefix_tree import SimplePrefixTree, CompressedPrefixTree, PrefixCursor
+
+# Every engine snapshot file starts with _SNAPSHOT_MAGIC, followed by the
+# version of the snapshot format as a little-endian unsigned short. Bump
+# _SNAPSHOT_VERSION whenever the format changes, so that old snapshots are
+# rejected instead of loaded wrongly.
+_SNAPSHOT_MAGIC = b'CSC148A2'
+_SNAPSHOT_VERSION = 3
+
+# Match every character that sanitizing removes from lowercased text: those
+# that are not a space and not alphanumeric by _filter_conditions. For str
+# patterns, \w matches exactly the characters for which str.isalpha or
+# str.isnumeric is true, and '_'. _UNSANITARY_TEXT also keeps line breaks,
+# so that a whole buffer of lines can be sanitized at once.
+_UNSANITARY = re.compile(r'[^\w ]|_')
+_UNSANITARY_TEXT = re.compile(r'[^\w \n]|_')
+
+# The strings of a batch of CSV rows are sanitized at once, joined by
+# _ROW_SEPARATOR. _UNSANITARY_ROWS keeps all whitespace, where str.split
+# splits the words of a string, and the separator; _SPACELESS_WHITESPACE then
+# matches the rest of the characters that sanitizing removes.
+_ROW_SEPARATOR = '\x00'
+_UNSANITARY_ROWS = re.compile(r'[^\w\s\x00]|_')
+_SPACELESS_WHITESPACE = re.compile(r'[^\S ]')
+_CSV_BATCH_SIZE = 2 ** 14
 
 
 ################################################################################
@@ -36,8 +73,12 @@ class LetterAutocompleteEngine:
 
     === Attributes ===
     autocompleter: An Autocompleter used by this engine.
+
+    === Private Attributes ===
+    _cache: The cache of autocomplete results, or None if there isn't one.
     """
     autocompleter: Autocompleter
+    _cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -48,6 +89,24 @@ class LetterAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+        and optionally:
+            - 'cache_size': the number of autocomplete results that are
+              kept, so that asking for the same prefix and limit again
+              doesn't search the Autocompleter (default 0, no cache).
+            - 'top_k': the number of top matches kept at every prefix in
+              the Autocompleter, so that autocomplete with a limit of at
+              most 'top_k' doesn't search below the prefix (default 0, none
+              are kept).
+            - 'chunk_size': the number of characters read from the file at
+              a time (default 2 ** 20).
+            - 'progress': a function that is called with the IngestionStats
+              of the file after the lines of each chunk have been
+              inserted.
+            - 'processes': the number of processes that build the
+              Autocompleter (default 1). If it is more than 1 and
+              'autocompleter' is 'compressed', each process builds a tree
+              from part of the file, and the trees are merged. 'chunk_size'
+              and 'progress' are then not used.
 
         Each line of the specified file counts as one input string.
         Note that the line may or may not contain spaces.
@@ -62,17 +121,33 @@ class LetterAutocompleteEngine:
         one line of the input file; this would result in that string getting
         a larger weight (because of how Autocompleter.insert works).
         """
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        elif config['autocompleter'] == 'compressed':
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
+        self._cache = _make_cache(config)
+        if config.get('processes', 1) > 1 \
+                and config['autocompleter'] == 'compressed':
+            self.autocompleter = _build_in_parallel(config, _letter_shard)
+            return
 
+        stats = IngestionStats()
         with open(config['file'], encoding='utf8') as f:
-            for dirty_line in f:
-                line = _sanitize(dirty_line)
-                if line != '':
-                    # list return a list of the chars in a sting
-                    self.autocompleter.insert(line, 1.0, list(line))
+            chunks = _read_chunks(f, config.get('chunk_size', 2 ** 20), stats)
+            lines = _split_lines(chunks, stats)
+            lines = _sanitize_lines(lines, stats)
+            lines = _filter_lines(lines, stats)
+            # Each distinct line of a chunk is only inserted once, with the
+            # number of times it appears in the chunk as its weight.
+            weighted_lines = _aggregate_lines(lines, stats)
+            # list return a list of the chars in a sting
+            batches = ([(line, weight, list(line)) for line, weight in batch]
+                       for batch in weighted_lines)
+            entries = _insert_batches(batches, stats, config.get('progress'))
+
+            start = time.perf_counter()
+            self.autocompleter = _build_autocompleter(config, entries)
+            # Every stage runs while the Autocompleter is built, and building
+            # a compressed prefix tree only finishes once every batch has
+            # been read, so the rest of the time is spent inserting.
+            stats.add('insert', 0, time.perf_counter() - start
+                      - sum(stats.seconds.values()))
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -90,7 +165,44 @@ class LetterAutocompleteEngine:
             limit is None or limit > 0
             <prefix> contains only lowercase alphanumeric characters and spaces
         """
-        return self.autocompleter.autocomplete(list(prefix), limit)
+        return _autocomplete(self, list(prefix), limit)
+
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[str, float]]]:
+        """Return the result of autocomplete with <limit> for each of the
+        given prefix strings, in the same order as <prefixes>.
+
+        The paths shared by the prefixes are only walked once.
+
+        Preconditions:
+            limit is None or limit > 0
+            Each prefix contains only lowercase alphanumeric characters and
+            spaces
+        """
+        return _autocomplete_many(self, [list(prefix) for prefix in prefixes],
+                                  limit)
+
+    def fuzzy_autocomplete(self, prefix: str, max_edits: int,
+                           limit: Optional[int] = None) \
+            -> List[Tuple[str, float, int]]:
+        """Return up to <limit> strings that start with a string at most
+        <max_edits> edits away from the given prefix string, where an edit
+        inserts, deletes or replaces one letter.
+
+        The return value is a list of tuples (string, weight, edits), ordered
+        by the fewest edits needed, and then by non-increasing weight. The
+        results are not cached.
+
+        If limit is None, return *every* match.
+
+        Preconditions:
+            max_edits >= 0
+            limit is None or limit > 0
+            <prefix> contains only lowercase alphanumeric characters and spaces
+        """
+        return self.autocompleter.fuzzy_autocomplete(list(prefix), max_edits,
+                                                     limit)
 
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix string.
@@ -101,7 +213,45 @@ class LetterAutocompleteEngine:
         Precondition: <prefix> contains only lowercase alphanumeric characters
                       and spaces.
         """
-        self.autocompleter.remove(prefix)
+        _remove(self, list(prefix))
+
+    def cursor(self) -> PrefixCursor:
+        """Return a cursor at the empty prefix of this engine, which finds
+        the matches for a prefix as it is typed one letter at a time.
+
+        Each letter passed to the cursor's advance must be a lowercase
+        alphanumeric character or a space. The cursor doesn't use this
+        engine's cache.
+        """
+        return PrefixCursor(self.autocompleter)
+
+    def cache_info(self) -> Dict[str, int]:
+        """Return the hits, misses, size and maximum size of this engine's
+        cache of autocomplete results, which are all 0 if it has no cache.
+        """
+        return _cache_info(self)
+
+    def save(self, path: str) -> None:
+        """Write a snapshot of this engine to the file <path>.
+
+        LetterAutocompleteEngine.load turns the snapshot back into an
+        engine with the same strings and weights.
+        """
+        _save_engine(self, path)
+
+    @classmethod
+    def load(cls, path: str,
+             cache_size: int = 0) -> LetterAutocompleteEngine:
+        """Return the engine whose snapshot was written to the file <path>
+        by save, without reading its original data file again. The engine
+        keeps up to <cache_size> autocomplete results, like the 'cache_size'
+        of its configuration.
+
+        Raise a ValueError if <path> is not a snapshot of a
+        LetterAutocompleteEngine in the current snapshot format. Snapshots
+        are unpickled, so only load files you trust.
+        """
+        return _load_engine(cls, path, cache_size)
 
 
 class SentenceAutocompleteEngine:
@@ -117,8 +267,12 @@ class SentenceAutocompleteEngine:
 
     === Attributes ===
     autocompleter: An Autocompleter used by this engine.
+
+    === Private Attributes ===
+    _cache: The cache of autocomplete results, or None if there isn't one.
     """
     autocompleter: Autocompleter
+    _cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -129,6 +283,19 @@ class SentenceAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+        and optionally:
+            - 'cache_size': the number of autocomplete results that are
+              kept, so that asking for the same prefix and limit again
+              doesn't search the Autocompleter (default 0, no cache).
+            - 'top_k': the number of top matches kept at every prefix in
+              the Autocompleter, so that autocomplete with a limit of at
+              most 'top_k' doesn't search below the prefix (default 0, none
+              are kept).
+            - 'processes': the number of processes that build the
+              Autocompleter (default 1). If it is more than 1 and
+              'autocompleter' is 'compressed', each process builds a tree
+              from part of the file, and the trees are merged. The entries
+              of the file must not contain line breaks in this case.
 
         Precondition:
         The given file is a *CSV file* where each line has two entries:
@@ -150,25 +317,19 @@ class SentenceAutocompleteEngine:
         """
         # We haven't given you any starter code here! You should review how
         # you processed CSV files on Assignment 1.
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        elif config['autocompleter'] == 'compressed':
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
+        self._cache = _make_cache(config)
+        if config.get('processes', 1) > 1 \
+                and config['autocompleter'] == 'compressed':
+            self.autocompleter = _build_in_parallel(config, _sentence_shard,
+                                                    intern_labels=True)
+            return
 
         with open(config['file'], encoding='utf8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                dirty_line = row[0]
-                # we split the unsanitized words just in case a word is
-                # separated by a non space, white space char.
-                dirty_words = dirty_line.split()
-                words = [_sanitize(dirty_word) for dirty_word in dirty_words]
-                words = [word for word in words if word != '']
-                weight = float(row[1])
-
-                if words != []:
-                    self.autocompleter.insert(_sanitize(dirty_line), weight,
-                                              words)
+            # Equal words are interned to one string, so the prefixes don't
+            # each hold their own copies of them.
+            entries = [(value, weight, list(map(sys.intern, prefix)))
+                       for value, weight, prefix in _sentence_entries(f)]
+        self.autocompleter = _build_autocompleter(config, entries)
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -186,7 +347,23 @@ class SentenceAutocompleteEngine:
             limit is None or limit > 0
             <prefix> contains only lowercase alphanumeric characters and spaces
         """
-        return self.autocompleter.autocomplete(prefix.split(), limit)
+        return _autocomplete(self, prefix.split(), limit)
+
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[str, float]]]:
+        """Return the result of autocomplete with <limit> for each of the
+        given prefix strings, in the same order as <prefixes>.
+
+        The paths shared by the prefixes are only walked once.
+
+        Preconditions:
+            limit is None or limit > 0
+            Each prefix contains only lowercase alphanumeric characters and
+            spaces
+        """
+        return _autocomplete_many(
+            self, [prefix.split() for prefix in prefixes], limit)
 
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix.
@@ -197,7 +374,167 @@ class SentenceAutocompleteEngine:
         Precondition: <prefix> contains only lowercase alphanumeric characters
                       and spaces.
         """
-        self.autocompleter.remove(prefix.split())
+        _remove(self, prefix.split())
+
+    def cache_info(self) -> Dict[str, int]:
+        """Return the hits, misses, size and maximum size of this engine's
+        cache of autocomplete results, which are all 0 if it has no cache.
+        """
+        return _cache_info(self)
+
+    def save(self, path: str) -> None:
+        """Write a snapshot of this engine to the file <path>.
+
+        SentenceAutocompleteEngine.load turns the snapshot back into an
+        engine with the same strings and weights.
+        """
+        _save_engine(self, path)
+
+    @classmethod
+    def load(cls, path: str,
+             cache_size: int = 0) -> SentenceAutocompleteEngine:
+        """Return the engine whose snapshot was written to the file <path>
+        by save, without reading its original data file again. The engine
+        keeps up to <cache_size> autocomplete results, like the 'cache_size'
+        of its configuration.
+
+        Raise a ValueError if <path> is not a snapshot of a
+        SentenceAutocompleteEngine in the current snapshot format. Snapshots
+        are unpickled, so only load files you trust.
+        """
+        return _load_engine(cls, path, cache_size)
+
+
+class IngestionStats:
+    """Counters for each stage of the pipeline that reads a text file into a
+    LetterAutocompleteEngine.
+
+    The stages are, in order:
+        - 'read': reads chunks of the file; counts characters.
+        - 'split': cuts the chunks into blocks of whole lines; counts lines.
+        - 'sanitize': sanitizes each block and splits it into lines; counts
+          lines.
+        - 'filter': drops empty lines; counts the lines that are kept.
+        - 'aggregate': totals the weight of each distinct line; counts
+          lines.
+        - 'insert': inserts each distinct line into the Autocompleter once;
+          counts distinct lines.
+
+    === Attributes ===
+    counts:
+        The number of items each stage has produced so far, by stage name.
+    seconds:
+        The time each stage has spent on its own work so far, not counting
+        the time spent waiting for the stages before or after it.
+    """
+    counts: Dict[str, int]
+    seconds: Dict[str, float]
+
+    def __init__(self) -> None:
+        """Initialize counters for a pipeline that hasn't started."""
+        stages = ['read', 'split', 'sanitize', 'filter', 'aggregate',
+                  'insert']
+        self.counts = {stage: 0 for stage in stages}
+        self.seconds = {stage: 0.0 for stage in stages}
+
+    def add(self, stage: str, count: int, seconds: float) -> None:
+        """Record that <stage> produced <count> more items in <seconds>."""
+        self.counts[stage] += count
+        self.seconds[stage] += seconds
+
+    def throughput(self, stage: str) -> float:
+        """Return the number of items per second <stage> has produced, or
+        0.0 if it hasn't spent any time yet.
+        """
+        if self.seconds[stage] == 0:
+            return 0.0
+        return self.counts[stage] / self.seconds[stage]
+
+    def __str__(self) -> str:
+        """Return one line for each stage, with its count, time and
+        throughput.
+        """
+        return '\n'.join(f'{stage}: {self.counts[stage]} in '
+                         f'{self.seconds[stage]:.3f} s '
+                         f'({self.throughput(stage):.0f}/s)'
+                         for stage in self.counts)
+
+
+class QueryCache:
+    """A cache of the results of autocompleting prefixes, which forgets the
+    least recently used result once it is full.
+
+    Results are keyed by the prefix sequence given to the Autocompleter, as
+    a tuple, and the limit.
+
+    === Attributes ===
+    maxsize:
+        The most results this cache keeps.
+    hits:
+        The number of times get found a result.
+    misses:
+        The number of times get didn't find a result.
+
+    === Private Attributes ===
+    _results:
+        The results kept, from the least to the most recently used.
+
+    === Representation Invariants ===
+    - maxsize > 0
+    - len(self._results) <= maxsize
+    """
+    maxsize: int
+    hits: int
+    misses: int
+    _results: OrderedDict
+
+    def __init__(self, maxsize: int) -> None:
+        """Initialize an empty cache that keeps up to <maxsize> results.
+
+        Precondition: maxsize > 0
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of results in this cache."""
+        return len(self._results)
+
+    def get(self, key: Tuple[Tuple, Optional[int]]) -> Optional[List]:
+        """Return the result kept for <key>, or None if there isn't one."""
+        results = self._results.get(key)
+        if results is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._results.move_to_end(key)
+        return results
+
+    def put(self, key: Tuple[Tuple, Optional[int]], results: List) -> None:
+        """Keep <results> as the result for <key>, forgetting the least
+        recently used result if this cache is full.
+        """
+        self._results[key] = results
+        self._results.move_to_end(key)
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def invalidate(self, prefix: Sequence[Hashable]) -> None:
+        """Forget the results that may change when values are inserted or
+        removed under <prefix>.
+
+        These are the results for <prefix> itself, for the prefixes it
+        starts with, whose subtrees contain it, and for the prefixes that
+        start with it, which are in its subtree.
+        """
+        prefix = tuple(prefix)
+        for key in list(self._results):
+            cached = key[0]
+            if cached == prefix[:len(cached)] \
+                    or prefix == cached[:len(prefix)]:
+                del self._results[key]
 
 
 ################################################################################
@@ -215,8 +552,10 @@ class MelodyAutocompleteEngine:
 
     # === Private Attributes ===
     autocompleter: An Autocompleter used by this engine.
+    _cache: The cache of autocomplete results, or None if there isn't one.
     """
     autocompleter: Autocompleter
+    _cache: Optional[QueryCache]
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize this engine with the given configuration.
@@ -227,6 +566,14 @@ class MelodyAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+        and optionally:
+            - 'cache_size': the number of autocomplete results that are
+              kept, so that asking for the same prefix and limit again
+              doesn't search the Autocompleter (default 0, no cache).
+            - 'top_k': the number of top matches kept at every prefix in
+              the Autocompleter, so that autocomplete with a limit of at
+              most 'top_k' doesn't search below the prefix (default 0, none
+              are kept).
 
         Precondition:
         The given file is a *CSV file* where each line has the following format:
@@ -241,31 +588,10 @@ class MelodyAutocompleteEngine:
 
         Each melody is be inserted into the Autocompleter with a weight of 1.
         """
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        elif config['autocompleter'] == 'compressed':
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
+        self._cache = _make_cache(config)
         with open(config['file'], encoding='utf8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-
-                name = row[0]
-                pitch_and_duration = row[1:]
-                n = len(pitch_and_duration)
-
-                notes = []
-                _make_notes(notes, pitch_and_duration, n)
-
-                intervals = []
-                for i in range(len(notes) - 1):
-                    # Subtracting pitches of adjacent notes
-                    interval = notes[i + 1][0] - notes[i][0]
-                    intervals.append(interval)
-
-                melody = Melody(name, notes)
-
-                self.autocompleter.insert(melody, 1, intervals)
+            entries = _melody_entries(f)
+        self.autocompleter = _build_autocompleter(config, entries)
 
     def autocomplete(self, prefix: List[int],
                      limit: Optional[int] = None) -> List[Tuple[Melody, float]]:
@@ -279,24 +605,568 @@ class MelodyAutocompleteEngine:
         Precondition:
             limit is None or limit > 0
         """
-        return self.autocompleter.autocomplete(prefix, limit)
+        return _autocomplete(self, prefix, limit)
+
+    def autocomplete_many(self, prefixes: List[List[int]],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Melody, float]]]:
+        """Return the result of autocomplete with <limit> for each of the
+        given interval sequences, in the same order as <prefixes>.
+
+        The paths shared by the interval sequences are only walked once.
+
+        Precondition:
+            limit is None or limit > 0
+        """
+        return _autocomplete_many(self, prefixes, limit)
 
     def remove(self, prefix: List[int]) -> None:
         """Remove all melodies that match the given interval sequence.
         """
-        self.autocompleter.remove(prefix)
+        _remove(self, prefix)
 
+    def cache_info(self) -> Dict[str, int]:
+        """Return the hits, misses, size and maximum size of this engine's
+        cache of autocomplete results, which are all 0 if it has no cache.
+        """
+        return _cache_info(self)
+
+    def save(self, path: str) -> None:
+        """Write a snapshot of this engine to the file <path>.
+
+        MelodyAutocompleteEngine.load turns the snapshot back into an
+        engine with the same melodies and weights.
+        """
+        _save_engine(self, path)
+
+    @classmethod
+    def load(cls, path: str,
+             cache_size: int = 0) -> MelodyAutocompleteEngine:
+        """Return the engine whose snapshot was written to the file <path>
+        by save, without reading its original data file again. The engine
+        keeps up to <cache_size> autocomplete results, like the 'cache_size'
+        of its configuration.
+
+        Raise a ValueError if <path> is not a snapshot of a
+        MelodyAutocompleteEngine in the current snapshot format. Snapshots
+        are unpickled, so only load files you trust.
+        """
+        return _load_engine(cls, path, cache_size)
 
-def _make_notes(notes: List, pitch_and_duration: Tuple[int, int], n: int) \
-        -> None:
-    # p is the even indexes and  d is the odd indexes
-    for p, d in zip(range(0, n, 2), range(1, n, 2)):
-        str_note = pitch_and_duration[p], pitch_and_duration[d]
-        # Stop looking for new notes if we have reached empty stings
-        if str_note[0] == '' or str_note[1] == '':
-            break
-        note = int(str_note[0]), int(str_note[1])
-        notes.append(note)
+
+class _PackedMelody(Melody):
+    """A Melody whose notes are stored as two compact typed arrays, instead
+    of a list of tuples.
+
+    notes is a list of (pitch, duration) tuples made from the arrays each
+    time it is read; a list of notes assigned to it is packed into new
+    arrays.
+
+    === Private Attributes ===
+    _pitches:
+        The pitch of each note.
+    _durations:
+        The duration of each note, in milliseconds.
+
+    === Representation Invariants ===
+    - len(self._pitches) == len(self._durations)
+    """
+    # There are no __slots__: Melody has none, so every instance would keep
+    # a __dict__ anyway.
+    _pitches: array
+    _durations: array
+
+    def __init__(self, name: str, pitches: array, durations: array) -> None:
+        """Initialize a new melody with the given name, and the notes with the
+        given <pitches> and <durations>.
+
+        Precondition: len(pitches) == len(durations)
+        """
+        self.name = name
+        self._pitches = pitches
+        self._durations = durations
+
+    @property
+    def notes(self) -> List[Tuple[int, int]]:
+        """Return the (pitch, duration) tuple of each note of this melody."""
+        return list(zip(self._pitches, self._durations))
+
+    @notes.setter
+    def notes(self, notes: List[Tuple[int, int]]) -> None:
+        """Set the notes of this melody to the (pitch, duration) tuples in
+        <notes>.
+        """
+        self._pitches = _compact_array([pitch for pitch, _ in notes])
+        self._durations = _compact_array([duration for _, duration in notes])
+
+
+def _read_chunks(f: Any, chunk_size: int, stats: IngestionStats) \
+        -> Iterator[str]:
+    """Yield the text of the open file <f>, <chunk_size> characters at a
+    time.
+    """
+    while True:
+        start = time.perf_counter()
+        chunk = f.read(chunk_size)
+        stats.add('read', len(chunk), time.perf_counter() - start)
+        if chunk == '':
+            return
+        yield chunk
+
+
+def _split_lines(chunks: Iterable[str], stats: IngestionStats) \
+        -> Iterator[str]:
+    """Yield the lines that end in each of the <chunks> of a text as one
+    block, without the newline after the last of them.
+
+    A line that continues into the next chunk is kept for the next block, so
+    every line is yielded whole. The pieces of a line that spans many chunks
+    are only joined once its end is read, so each chunk is copied a bounded
+    number of times.
+    """
+    # The pieces of the line that the chunks read so far end in.
+    rest = []
+    for chunk in chunks:
+        start = time.perf_counter()
+        end = chunk.rfind('\n')
+        if end == -1:
+            rest.append(chunk)
+            continue
+        rest.append(chunk[:end])
+        block = ''.join(rest)
+        rest = [chunk[end + 1:]]
+        stats.add('split', block.count('\n') + 1,
+                  time.perf_counter() - start)
+        yield block
+    rest = ''.join(rest)
+    if rest != '':
+        stats.add('split', 1, 0.0)
+        yield rest
+
+
+def _sanitize_lines(blocks: Iterable[str], stats: IngestionStats) \
+        -> Iterator[List[str]]:
+    """Yield a list of the sanitized lines in each of the <blocks> of
+    lines.
+    """
+    for block in blocks:
+        start = time.perf_counter()
+        sanitized = _sanitize_text(block)
+        stats.add('sanitize', len(sanitized), time.perf_counter() - start)
+        yield sanitized
+
+
+def _filter_lines(batches: Iterable[List[str]], stats: IngestionStats) \
+        -> Iterator[List[str]]:
+    """Yield a list of the lines in each list of <batches> that aren't
+    empty.
+    """
+    for batch in batches:
+        start = time.perf_counter()
+        kept = [line for line in batch if line != '']
+        stats.add('filter', len(kept), time.perf_counter() - start)
+        yield kept
+
+
+def _aggregate_lines(batches: Iterable[List[str]], stats: IngestionStats) \
+        -> Iterator[List[Tuple[str, float]]]:
+    """Yield a list of (line, weight) tuples for each list of <batches> as
+    soon as it is read, with each distinct line of the list once, in the
+    order they first appear, and the number of times it appears in the list
+    as its weight.
+
+    A line in more than one list is yielded for each of them, and inserting
+    it each time adds up to the same weight as inserting every copy of it.
+    """
+    for batch in batches:
+        start = time.perf_counter()
+        totals = {}
+        for line in batch:
+            totals[line] = totals.get(line, 0.0) + 1.0
+        stats.add('aggregate', len(batch), time.perf_counter() - start)
+        yield list(totals.items())
+
+
+def _aggregate_entries(entries: Iterable[Tuple[Any, float, List]]) \
+        -> List[Tuple[Any, float, List]]:
+    """Return the distinct (value, weight, prefix) tuples of <entries>, in
+    the order they first appear, where the weight of each is the total
+    weight of the tuples with its value and prefix.
+
+    Inserting the returned tuples into an Autocompleter stores the same
+    values and weights as inserting each tuple of <entries>, with one
+    insertion for each distinct value. Every value must be hashable.
+
+    >>> _aggregate_entries([('a b', 2.0, ['a', 'b']), ('ab', 1.0, ['ab']),
+    ...                     ('a b', 0.5, ['a', 'b'])])
+    [('a b', 2.5, ['a', 'b']), ('ab', 1.0, ['ab'])]
+    """
+    totals = {}
+    for value, weight, prefix in entries:
+        key = (value, tuple(prefix))
+        if key in totals:
+            totals[key][1] += weight
+        else:
+            totals[key] = [value, weight, prefix]
+    return [(value, weight, prefix)
+            for value, weight, prefix in totals.values()]
+
+
+def _insert_batches(batches: Iterable[List[Tuple[Any, float, List]]],
+                    stats: IngestionStats,
+                    progress: Optional[Callable[[IngestionStats], Any]]) \
+        -> Iterator[Tuple[Any, float, List]]:
+    """Yield every (value, weight, prefix) tuple in <batches> to be inserted,
+    and call <progress> with <stats>, if it isn't None, after each batch.
+
+    The time until the next batch is asked for is the time spent inserting
+    the batch.
+    """
+    for batch in batches:
+        start = time.perf_counter()
+        yield from batch
+        stats.add('insert', len(batch), time.perf_counter() - start)
+        if progress is not None:
+            progress(stats)
+
+
+def _sentence_entries(f: Any) -> List[Tuple[str, float, List[str]]]:
+    """Return a (string, weight, words) tuple for each distinct string and
+    words of the rows of the open CSV file <f> of a
+    SentenceAutocompleteEngine whose string has a word.
+
+    The weight of each tuple is the total weight of the rows with its string
+    and words, so that each is only inserted once.
+    """
+    return _aggregate_entries(
+        entry for strings, weights in _csv_batches(f, _CSV_BATCH_SIZE)
+        for entry in _sentence_batch(strings, weights))
+
+
+def _melody_entries(f: Any) -> List[Tuple[Melody, int, List[int]]]:
+    """Return a (melody, 1, intervals) tuple for each row of the open CSV
+    file <f> of a MelodyAutocompleteEngine.
+
+    The notes of every row are parsed into one pair of arrays, and the
+    intervals between all of them are found in one pass, before they are
+    sliced into the melody and the intervals of each row.
+    """
+    names = []
+    ends = []
+    values = []
+    for row in csv.reader(f):
+        names.append(row[0])
+        pitch_and_duration = row[1:]
+        # Stop at the first blank entry, and drop a pitch without a
+        # duration.
+        if '' in pitch_and_duration:
+            pitch_and_duration = \
+                pitch_and_duration[:pitch_and_duration.index('')]
+        values.extend(pitch_and_duration[:len(pitch_and_duration) // 2 * 2])
+        ends.append(len(values) // 2)
+
+    numbers = list(map(int, values))
+    pitches = _compact_array(numbers[0::2])
+    durations = _compact_array(numbers[1::2])
+    # Subtracting pitches of adjacent notes. The intervals across the end of
+    # a melody are never used.
+    intervals = list(map(operator.sub, pitches[1:], pitches[:-1]))
+
+    entries = []
+    start = 0
+    for name, end in zip(names, ends):
+        melody = _PackedMelody(name, pitches[start:end], durations[start:end])
+        entries.append((melody, 1, intervals[start:max(start, end - 1)]))
+        start = end
+    return entries
+
+
+def _compact_array(numbers: List[int]) -> array:
+    """Return an array of <numbers> with the smallest unsigned item type
+    that holds all of them, or a signed 64-bit array if none does.
+
+    >>> _compact_array([60, 255]).typecode
+    'B'
+    >>> _compact_array([60, 400]).typecode
+    'H'
+    >>> _compact_array([-1]).typecode
+    'q'
+    """
+    for typecode in 'BHI':
+        try:
+            return array(typecode, numbers)
+        except OverflowError:
+            pass
+    return array('q', numbers)
+
+
+def _csv_batches(f: Any, batch_size: int) \
+        -> Iterator[Tuple[List[str], List[float]]]:
+    """Yield the strings and the weights of the rows of the open CSV file
+    <f>, <batch_size> rows at a time.
+    """
+    reader = csv.reader(f)
+    while True:
+        rows = list(itertools.islice(reader, batch_size))
+        if rows == []:
+            return
+        strings = [row[0] for row in rows]
+        weights = list(map(float, [row[1] for row in rows]))
+        yield strings, weights
+
+
+def _sentence_batch(dirty_strings: List[str], weights: List[float]) \
+        -> Iterator[Tuple[str, float, List[str]]]:
+    """Yield a (string, weight, words) tuple for each of the <dirty_strings>
+    that has a word once it is sanitized, with its weight from <weights>.
+
+    The string is the dirty string sanitized, and the words are its
+    whitespace separated words sanitized one at a time. All of
+    <dirty_strings> are sanitized at once, while keeping the whitespace
+    between their words.
+
+    >>> list(_sentence_batch(['Hello, World!', '?!', 'a\\tb'], [2.0, 1.0, 3.0]))
+    [('hello world', 2.0, ['hello', 'world']), ('ab', 3.0, ['a', 'b'])]
+    """
+    text = _ROW_SEPARATOR.join(dirty_strings)
+    if text.count(_ROW_SEPARATOR) != len(dirty_strings) - 1:
+        # Some string contains the separator, so sanitize them one by one.
+        for dirty_string, weight in zip(dirty_strings, weights):
+            words = [_sanitize(word) for word in dirty_string.split()]
+            words = [word for word in words if word != '']
+            if words != []:
+                yield _sanitize(dirty_string), weight, words
+        return
+
+    # Lowercasing a character depends on the characters around it, but not
+    # across whitespace or the separator, so the whole text is lowercased
+    # the same way as each word of each string on its own.
+    spaced = _UNSANITARY_ROWS.sub('', text.lower())
+    strings = _SPACELESS_WHITESPACE.sub('', spaced).split(_ROW_SEPARATOR)
+    for string, spaced_string, weight in zip(
+            strings, spaced.split(_ROW_SEPARATOR), weights):
+        # we split the unsanitized words just in case a word is
+        # separated by a non space, white space char.
+        words = spaced_string.split()
+        if words != []:
+            yield string, weight, words
+
+
+def _shard_ranges(path: str, count: int) -> List[Tuple[int, int]]:
+    """Return up to <count> (start, end) byte ranges that split the file at
+    <path> into parts of about the same size, each made of whole lines.
+    """
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, count):
+            f.seek(max(size * i // count, starts[-1]))
+            # Move to the start of the next line.
+            f.readline()
+            if starts[-1] < f.tell() < size:
+                starts.append(f.tell())
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _open_shard(shard: Tuple[str, str, int, int]) -> io.TextIOWrapper:
+    """Return the lines in the byte range of a file given by <shard>, a
+    (path, weight type, start, end) tuple, as an open text file.
+    """
+    path, _, start, end = shard
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # This reads lines the same way as opening the whole file in text mode.
+    return io.TextIOWrapper(io.BytesIO(data), encoding='utf8')
+
+
+def _letter_shard(shard: Tuple[str, str, int, int]) -> Dict[str, Any]:
+    """Return a snapshot of a compressed prefix tree of the lines in the
+    part of a LetterAutocompleteEngine file given by <shard>, a
+    (path, weight type, start, end) tuple.
+    """
+    with _open_shard(shard) as f:
+        lines = [_sanitize(dirty_line) for dirty_line in f]
+    entries = [(line, 1.0, list(line)) for line in lines if line != '']
+    return CompressedPrefixTree.bulk_build(shard[1], entries).snapshot()
+
+
+def _sentence_shard(shard: Tuple[str, str, int, int]) -> Dict[str, Any]:
+    """Return a snapshot of a compressed prefix tree of the rows in the
+    part of a SentenceAutocompleteEngine file given by <shard>, a
+    (path, weight type, start, end) tuple.
+    """
+    with _open_shard(shard) as f:
+        entries = _sentence_entries(f)
+    return CompressedPrefixTree.bulk_build(shard[1], entries).snapshot()
+
+
+def _build_in_parallel(config: Dict[str, Any],
+                       build_shard: Callable[[Tuple[str, str, int, int]],
+                                             Dict[str, Any]],
+                       intern_labels: bool = False) \
+        -> CompressedPrefixTree:
+    """Return a compressed prefix tree of config['file'], built by
+    config['processes'] processes that each call <build_shard> on a part
+    of the file.
+
+    The trees of the parts are merged in the order of the parts, so ties
+    between equal weights are broken the same way as when the whole file is
+    read by one process. If <intern_labels> is True, the labels of each part
+    are interned before they are merged: strings sent back from another
+    process are new copies, even if that process interned them.
+    """
+    shards = [(config['file'], config['weight_type'], start, end)
+              for start, end in _shard_ranges(config['file'],
+                                              config['processes'])]
+    tree = CompressedPrefixTree(config['weight_type'])
+    with ProcessPoolExecutor(config['processes']) as executor:
+        for snapshot in executor.map(build_shard, shards):
+            if intern_labels:
+                snapshot['labels'] = list(map(sys.intern, snapshot['labels']))
+            tree.merge(CompressedPrefixTree.from_snapshot(snapshot))
+    tree.keep_top(config.get('top_k', 0))
+    return tree
+
+
+def _make_cache(config: Dict[str, Any]) -> Optional[QueryCache]:
+    """Return the cache of autocomplete results for an engine with the
+    configuration <config>, or None if it has no cache.
+    """
+    if config.get('cache_size', 0) > 0:
+        return QueryCache(config['cache_size'])
+    return None
+
+
+def _autocomplete(engine: Any, prefix: List,
+                  limit: Optional[int]) -> List[Tuple[Any, float]]:
+    """Return up to <limit> matches for the prefix sequence <prefix> in the
+    autocompleter of <engine>, using the engine's cache if it has one.
+    """
+    if engine._cache is None:
+        return engine.autocompleter.autocomplete(prefix, limit)
+    key = (tuple(prefix), limit)
+    results = engine._cache.get(key)
+    if results is None:
+        results = engine.autocompleter.autocomplete(prefix, limit)
+        engine._cache.put(key, results)
+    # A copy is returned so that callers can't change the cached result.
+    return list(results)
+
+
+def _autocomplete_many(engine: Any, prefixes: List[List],
+                       limit: Optional[int]) -> List[List[Tuple[Any, float]]]:
+    """Return the matches of up to <limit> values for each prefix sequence in
+    <prefixes> in the autocompleter of <engine>, in the same order as
+    <prefixes>, using the engine's cache if it has one.
+
+    The prefixes whose results aren't cached are autocompleted together.
+    """
+    if engine._cache is None:
+        return engine.autocompleter.autocomplete_many(prefixes, limit)
+
+    results = [engine._cache.get((tuple(prefix), limit))
+               for prefix in prefixes]
+    missing = [i for i in range(len(prefixes)) if results[i] is None]
+    found = engine.autocompleter.autocomplete_many(
+        [prefixes[i] for i in missing], limit)
+    for i, result in zip(missing, found):
+        engine._cache.put((tuple(prefixes[i]), limit), result)
+        results[i] = result
+    # Copies are returned so that callers can't change the cached results.
+    return [list(result) for result in results]
+
+
+def _remove(engine: Any, prefix: List) -> None:
+    """Remove all values that match the prefix sequence <prefix> from the
+    autocompleter of <engine>, and forget the cached results this changes.
+    """
+    num_values = len(engine.autocompleter)
+    engine.autocompleter.remove(prefix)
+    if engine._cache is not None and len(engine.autocompleter) != num_values:
+        engine._cache.invalidate(prefix)
+
+
+def _cache_info(engine: Any) -> Dict[str, int]:
+    """Return the hits, misses, size and maximum size of the cache of
+    <engine>, which are all 0 if it has no cache.
+    """
+    cache = engine._cache
+    if cache is None:
+        return {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 0}
+    return {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache),
+            'maxsize': cache.maxsize}
+
+
+def _build_autocompleter(config: Dict[str, Any],
+                         entries: Iterable[Tuple[Any, float, List]]) \
+        -> Autocompleter:
+    """Return a new Autocompleter of the kind given by config['autocompleter'],
+    with weight type config['weight_type'], that stores every
+    (value, weight, prefix) tuple in <entries>.
+
+    A compressed prefix tree is built all at once with bulk_build, while each
+    tuple is inserted into a simple prefix tree in order. The top matches
+    asked for by config['top_k'] are found once the tree is built.
+    """
+    if config['autocompleter'] == 'simple':
+        autocompleter = SimplePrefixTree(config['weight_type'])
+        for value, weight, prefix in entries:
+            autocompleter.insert(value, weight, prefix)
+    else:  # config['autocompleter'] == 'compressed'
+        autocompleter = CompressedPrefixTree.bulk_build(config['weight_type'],
+                                                        entries)
+    autocompleter.keep_top(config.get('top_k', 0))
+    return autocompleter
+
+
+def _save_engine(engine: Any, path: str) -> None:
+    """Write a snapshot of <engine> and its autocompleter to the file <path>.
+
+    The snapshot is the magic bytes and format version, followed by a pickle
+    of the engine's class name and the snapshot of its prefix tree.
+    """
+    snapshot = {
+        'engine': type(engine).__name__,
+        'tree': engine.autocompleter.snapshot()
+    }
+    with open(path, 'wb') as f:
+        f.write(_SNAPSHOT_MAGIC)
+        f.write(struct.pack('<H', _SNAPSHOT_VERSION))
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_engine(engine_class: type, path: str, cache_size: int) -> Any:
+    """Return a new <engine_class> engine made from the snapshot written to
+    the file <path> by _save_engine, which keeps up to <cache_size>
+    autocomplete results.
+
+    Raise a ValueError if <path> is not a snapshot of an <engine_class>
+    engine in the current snapshot format.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC:
+            raise ValueError(f'{path} is not an autocomplete engine snapshot')
+        version = struct.unpack('<H', f.read(2))[0]
+        if version != _SNAPSHOT_VERSION:
+            raise ValueError(f'{path} has snapshot format version {version},'
+                             f' but only version {_SNAPSHOT_VERSION} can be'
+                             f' loaded')
+        snapshot = pickle.load(f)
+    if snapshot['engine'] != engine_class.__name__:
+        raise ValueError(f'{path} is a snapshot of a {snapshot["engine"]},'
+                         f' not a {engine_class.__name__}')
+
+    # The engine is made without __init__, which would read its data file.
+    engine = engine_class.__new__(engine_class)
+    engine._cache = _make_cache({'cache_size': cache_size})
+    if snapshot['tree']['kind'] == 'simple':
+        engine.autocompleter = SimplePrefixTree.from_snapshot(
+            snapshot['tree'])
+    else:  # snapshot['tree']['kind'] == 'compressed'
+        engine.autocompleter = CompressedPrefixTree.from_snapshot(
+            snapshot['tree'])
+    return engine
 
 
 def _sanitize(line: str) -> str:
@@ -308,11 +1178,21 @@ def _sanitize(line: str) -> str:
     >>> print(_sanitize("Or '///!sout23hwa32rd to strike the Entwash?'"))
     or sout23hwa32rd to strike the entwash
     """
-    line = line.lower()
-    chars = list(line)
-    filtered_chars = filter(_filter_conditions, chars)
-    line = ''.join(filtered_chars)
-    return line
+    # This removes the same characters as filtering the lowercased line with
+    # _filter_conditions, but in one pass that doesn't call Python code.
+    return _UNSANITARY.sub('', line.lower())
+
+
+def _sanitize_text(text: str) -> List[str]:
+    """Return the result of calling _sanitize on each line of <text>, where
+    the lines are separated by newlines.
+
+    The whole of <text> is sanitized at once.
+
+    >>> _sanitize_text("Hello, World!\\nOr '///!sout23hwa32rd\\n\\n?")
+    ['hello world', 'or sout23hwa32rd', '', '']
+    """
+    return _UNSANITARY_TEXT.sub('', text.lower()).split('\n')
 
 
 def _filter_conditions(a: str) -> bool:
@@ -382,11 +1262,7 @@ if __name__ == '__main__':
     #     'extra-imports': ['csv', 'prefix_tree', 'melody']
     # })
 
-    # This is used to increase the recursion limit so that your sample runs
-    # work even for fairly tall simple prefix trees.
-    import sys
-    sys.setrecursionlimit(5000)
-
     # print(sample_letter_autocomplete())
     # print(sample_sentence_autocomplete())
     # sample_melody_autocomplete()
+    pass
@@ -0,0 +1,362 @@
+"""CSC148 Assignment 2: Autocomplete server
+
+=== Module Description ===
+This file contains an asyncio TCP server that answers autocomplete requests
+from one autocomplete engine, and a load generator to benchmark it with.
+
+Each request and response is one line of JSON. A request is either
+    {"prefix": <prefix>, "limit": <limit>}
+where <prefix> is a string for letter and sentence engines, or a list of
+intervals for melody engines, and <limit> is optional; or
+    {"stats": true}
+The response to an autocomplete request is {"results": [[value, weight],
+...]}, where each melody value is its name, and the response to a stats
+request is the server's LatencyStats as a dict.
+
+Requests for the same prefix and limit that arrive while one of them is
+waiting to be answered share one lookup, and all the lookups waiting at once
+are answered by one call to the engine's autocomplete_many.
+
+Run it directly to start a server, or to generate load against one, e.g.
+    python autocomplete_server.py serve --file data/google_no_swears.txt
+    python autocomplete_server.py load --file data/google_no_swears.txt
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from autocomplete_engines import LetterAutocompleteEngine, \
+    SentenceAutocompleteEngine, MelodyAutocompleteEngine, _sanitize
+from melody import Melody
+
+_ENGINES = {
+    'letter': LetterAutocompleteEngine,
+    'sentence': SentenceAutocompleteEngine,
+    'melody': MelodyAutocompleteEngine
+}
+
+
+class LatencyStats:
+    """The latencies of the most recent requests answered by a server or
+    sent by a load generator.
+
+    === Attributes ===
+    requests:
+        The number of requests answered so far.
+    coalesced:
+        The number of requests that shared the lookup of an earlier request
+        for the same prefix and limit.
+
+    === Private Attributes ===
+    _latencies:
+        The time taken to answer each of the most recent requests, in
+        seconds.
+    """
+    requests: int
+    coalesced: int
+    _latencies: Deque[float]
+
+    def __init__(self, window: int = 100000) -> None:
+        """Initialize stats that keep the latencies of the last <window>
+        requests.
+
+        Precondition: window > 0
+        """
+        self.requests = 0
+        self.coalesced = 0
+        self._latencies = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        """Record that a request was answered in <seconds>."""
+        self.requests += 1
+        self._latencies.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        """Return the latency in seconds that <p> percent of the recent
+        requests were answered within, or 0.0 if there are none.
+
+        Precondition: 0 <= p <= 100
+
+        >>> stats = LatencyStats()
+        >>> for ms in range(1, 101):
+        ...     stats.add(ms / 1000)
+        >>> stats.percentile(50), stats.percentile(99)
+        (0.05, 0.099)
+        """
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(self._latencies)
+        index = max(0, math.ceil(p / 100 * len(latencies)) - 1)
+        return latencies[index]
+
+    def to_dict(self) -> Dict[str, float]:
+        """Return the number of requests, coalesced requests, and the p50 and
+        p99 latencies in milliseconds.
+        """
+        return {
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000
+        }
+
+
+class AutocompleteServer:
+    """A server that answers autocomplete requests from one engine.
+
+    === Attributes ===
+    engine:
+        The autocomplete engine requests are answered from.
+    stats:
+        The latencies of the requests answered so far.
+
+    === Private Attributes ===
+    _pending:
+        The lookups waiting to be answered, each keyed by its prefix and
+        limit, with the prefix as given to the engine and the future its
+        requests wait on.
+    """
+    engine: Any
+    stats: LatencyStats
+    _pending: Dict[Tuple[Any, Optional[int]], Tuple[Any, asyncio.Future]]
+
+    def __init__(self, engine: Any) -> None:
+        """Initialize a server for <engine>, which has been built already."""
+        self.engine = engine
+        self.stats = LatencyStats()
+        self._pending = {}
+
+    async def start(self, host: str = '127.0.0.1',
+                    port: int = 8148) -> asyncio.AbstractServer:
+        """Start accepting connections on <host> and <port>, and return the
+        asyncio server doing so. If <port> is 0, a free port is used.
+        """
+        return await asyncio.start_server(self._serve_client, host, port)
+
+    def lookup(self, prefix: Any, limit: Optional[int]) -> asyncio.Future:
+        """Return a future for the matches of up to <limit> values for
+        <prefix> in the engine.
+
+        The same future is returned for the same prefix and limit until it
+        is answered, and every future waiting at once is answered together
+        once the event loop is next idle.
+        """
+        key = (prefix if isinstance(prefix, str) else tuple(prefix), limit)
+        if key in self._pending:
+            self.stats.coalesced += 1
+            return self._pending[key][1]
+
+        loop = asyncio.get_running_loop()
+        if not self._pending:
+            loop.call_soon(self._answer_pending)
+        future = loop.create_future()
+        self._pending[key] = (prefix, future)
+        return future
+
+    def _answer_pending(self) -> None:
+        """Answer every lookup waiting to be answered, with one call to
+        autocomplete_many for each limit.
+
+        If autocomplete_many raises an error, the lookups with that limit
+        are answered one at a time instead, so only the lookups that raise
+        the error get it. Lookups whose futures were cancelled are skipped.
+        """
+        pending = self._pending
+        self._pending = {}
+        by_limit = {}
+        for (_, limit), lookup in pending.items():
+            # A cancelled future can't be given a result, and nothing can
+            # cancel the others while the engine answers them.
+            if not lookup[1].done():
+                by_limit.setdefault(limit, []).append(lookup)
+        for limit, lookups in by_limit.items():
+            try:
+                results = self.engine.autocomplete_many(
+                    [prefix for prefix, _ in lookups], limit)
+            except Exception:
+                for prefix, future in lookups:
+                    try:
+                        future.set_result(
+                            self.engine.autocomplete(prefix, limit))
+                    except Exception as error:
+                        future.set_exception(error)
+                continue
+            for (_, future), result in zip(lookups, results):
+                future.set_result(result)
+
+    async def _serve_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of one client until it disconnects."""
+        try:
+            while True:
+                line = await reader.readline()
+                if line == b'':
+                    break
+                start = time.perf_counter()
+                response = await self._respond(line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+                if 'results' in response:
+                    self.stats.add(time.perf_counter() - start)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, line: bytes) -> Dict[str, Any]:
+        """Return the response to the request on <line>."""
+        try:
+            request = json.loads(line)
+            if request.get('stats'):
+                return self.stats.to_dict()
+            prefix = request['prefix']
+            limit = request.get('limit')
+            if isinstance(self.engine, MelodyAutocompleteEngine):
+                if not isinstance(prefix, list) or \
+                        not all(_is_int(interval) for interval in prefix):
+                    raise ValueError('prefix must be a list of integers')
+            elif not isinstance(prefix, str):
+                raise ValueError('prefix must be a string')
+            if not (limit is None or _is_int(limit) and limit > 0):
+                raise ValueError('limit must be a positive integer')
+            # Other requests may be waiting on the same future, so cancelling
+            # this one must not cancel it.
+            results = await asyncio.shield(self.lookup(prefix, limit))
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return {'error': str(error)}
+        return {'results': [[_jsonable(value), weight]
+                            for value, weight in results]}
+
+
+def _is_int(value: Any) -> bool:
+    """Return whether <value> is an int read from JSON, and not a bool.
+
+    >>> _is_int(3), _is_int(3.0), _is_int(True)
+    (True, False, False)
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _jsonable(value: Any) -> Any:
+    """Return <value> as something that can be written as JSON."""
+    if isinstance(value, Melody):
+        return value.name
+    return value
+
+
+async def generate_load(host: str, port: int, prefixes: List[Any],
+                        clients: int = 16, requests: int = 10000,
+                        limit: Optional[int] = 10) -> Dict[str, float]:
+    """Send <requests> autocomplete requests for prefixes drawn from
+    <prefixes> to the server at <host> and <port>, from <clients> clients
+    that each wait for the response to one request before sending the next.
+
+    Return the requests per second answered, and the p50 and p99 latencies
+    seen by the clients, in milliseconds.
+    """
+    stats = LatencyStats(requests)
+    rng = random.Random(148)
+    counts = [requests // clients + (i < requests % clients)
+              for i in range(clients)]
+
+    async def client(count: int) -> None:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for _ in range(count):
+                request = {'prefix': rng.choice(prefixes), 'limit': limit}
+                start = time.perf_counter()
+                writer.write(json.dumps(request).encode() + b'\n')
+                await writer.drain()
+                await reader.readline()
+                stats.add(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(count) for count in counts))
+    seconds = time.perf_counter() - start
+    return {
+        'requests': stats.requests,
+        'requests_per_second': stats.requests / seconds,
+        'p50_ms': stats.percentile(50) * 1000,
+        'p99_ms': stats.percentile(99) * 1000
+    }
+
+
+def _typed_prefixes(file: str) -> List[str]:
+    """Return the first one to three letters typed of each line in the text
+    file <file>, as a client of a letter engine would ask for them.
+    """
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    return [line[:end] for line in lines if line != ''
+            for end in range(1, min(len(line), 3) + 1)]
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    """Build the engine described by <args> and serve it until cancelled."""
+    engine_class = _ENGINES[args.engine]
+    if args.snapshot is not None:
+        engine = engine_class.load(args.snapshot, args.cache_size)
+        if args.top_k > 0:
+            engine.autocompleter.keep_top(args.top_k)
+    else:
+        engine = engine_class({
+            'file': args.file,
+            'autocompleter': args.autocompleter,
+            'weight_type': args.weight_type,
+            'cache_size': args.cache_size,
+            'top_k': args.top_k
+        })
+    server = AutocompleteServer(engine)
+    async with await server.start(args.host, args.port) as listener:
+        print(f'serving {args.engine} engine on {args.host}:{args.port}',
+              flush=True)
+        try:
+            await listener.serve_forever()
+        finally:
+            print(server.stats.to_dict())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve an autocomplete engine, or generate load against '
+                    'a server.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='start a server')
+    serve.add_argument('--engine', choices=sorted(_ENGINES), default='letter')
+    serve.add_argument('--file', default='data/google_no_swears.txt')
+    serve.add_argument('--snapshot',
+                       help='load the engine saved to this file instead')
+    serve.add_argument('--autocompleter', choices=['simple', 'compressed'],
+                       default='compressed')
+    serve.add_argument('--weight-type', choices=['sum', 'average'],
+                       default='sum')
+    serve.add_argument('--cache-size', type=int, default=0)
+    serve.add_argument('--top-k', type=int, default=0)
+    load = commands.add_parser('load', help='send requests to a server')
+    load.add_argument('--file', default='data/google_no_swears.txt',
+                      help='the text file whose lines prefixes are typed of')
+    load.add_argument('--clients', type=int, default=16)
+    load.add_argument('--requests', type=int, default=10000)
+    load.add_argument('--limit', type=int, default=10)
+    for command in [serve, load]:
+        command.add_argument('--host', default='127.0.0.1')
+        command.add_argument('--port', type=int, default=8148)
+    arguments = parser.parse_args()
+
+    if arguments.command == 'serve':
+        try:
+            asyncio.run(_serve(arguments))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(asyncio.run(generate_load(
+            arguments.host, arguments.port, _typed_prefixes(arguments.file),
+            arguments.clients, arguments.requests, arguments.limit)))
@@ -0,0 +1,1053 @@
+"""CSC148 Assignment 2: Benchmarks
+
+=== Module Description ===
+This file contains benchmarks for the prefix trees and autocomplete engines.
+Run it directly to print the results of every benchmark; each benchmark can
+also be called on its own with a different data file.
+"""
+from __future__ import annotations
+import asyncio
+import csv
+import heapq
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+from autocomplete_engines import IngestionStats, LetterAutocompleteEngine, \
+    SentenceAutocompleteEngine, _filter_conditions, \
+    _melody_entries, _sanitize, _sanitize_text, _sentence_entries
+from autocomplete_server import AutocompleteServer, generate_load, \
+    _typed_prefixes
+from melody import Melody
+from prefix_tree import SimplePrefixTree, CompressedPrefixTree, \
+    ConcurrentAutocompleter
+
+
+def _all_trees(tree: Any) -> List[Any]:
+    """Return every tree in <tree>, including <tree> itself and its leaves."""
+    trees = []
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        trees.append(tree)
+        stack.extend(tree.subtrees)
+    return trees
+
+
+def benchmark_simple_tree_memory(file: str = 'data/lotr.txt') \
+        -> Dict[str, float]:
+    """Build a letter engine over <file> using a simple prefix tree and
+    report how much memory it holds.
+
+    'prefix_bytes' is the memory the non-leaf trees would need on top of this
+    if each of them stored its prefix as a list, which is what the tree did
+    before non-leaf values were built on demand.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    engine = LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': 'simple',
+        'weight_type': 'sum'
+    })
+    seconds = time.perf_counter() - start
+    traced_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    trees = _all_trees(engine.autocompleter)
+    # A slice of length d allocates a list with exactly d slots, just like
+    # [None] * d, so we only measure each depth once.
+    list_sizes = {}
+    prefix_bytes = 0
+    depths = [(engine.autocompleter, 0)]
+    while depths:
+        tree, depth = depths.pop()
+        if depth > 0:
+            if depth not in list_sizes:
+                list_sizes[depth] = sys.getsizeof([None] * depth)
+            prefix_bytes += list_sizes[depth]
+        for subtree in tree.subtrees:
+            if not subtree.is_leaf():
+                depths.append((subtree, depth + 1))
+
+    return {
+        'seconds': seconds,
+        'trees': len(trees),
+        'traced_bytes': traced_bytes,
+        'prefix_bytes': prefix_bytes
+    }
+
+
+def benchmark_tree_memory(file: str = 'data/lotr.txt',
+                          autocompleter: str = 'compressed') \
+        -> Dict[str, float]:
+    """Build a letter engine over <file> using the <autocompleter> prefix
+    tree, and report how many trees it holds and the memory per tree.
+
+    'tree_bytes' only counts the tree objects themselves, while
+    'traced_bytes' is everything allocated by the build that is still alive,
+    including the lists, dicts and values the trees refer to.
+    """
+    tracemalloc.start()
+    engine = LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': autocompleter,
+        'weight_type': 'sum'
+    })
+    traced_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    trees = _all_trees(engine.autocompleter)
+    tree_bytes = 0
+    for tree in trees:
+        tree_bytes += sys.getsizeof(tree)
+        if hasattr(tree, '__dict__'):
+            tree_bytes += sys.getsizeof(tree.__dict__)
+
+    return {
+        'trees': len(trees),
+        'tree_bytes': tree_bytes,
+        'bytes_per_tree': tree_bytes // len(trees),
+        'traced_bytes': traced_bytes,
+        'traced_bytes_per_tree': traced_bytes // len(trees)
+    }
+
+
+def benchmark_ingestion(file: str = 'data/lotr.txt',
+                        autocompleter: str = 'compressed',
+                        chunk_size: int = 2 ** 20) -> Dict[str, float]:
+    """Build a letter engine over <file> using the <autocompleter> prefix
+    tree, reading <chunk_size> characters at a time, and report the count,
+    time and throughput of each stage of its ingestion pipeline.
+    """
+    progress = []
+    LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': autocompleter,
+        'weight_type': 'sum',
+        'chunk_size': chunk_size,
+        'progress': progress.append
+    })
+    stats = progress[-1] if progress else IngestionStats()
+
+    results = {}
+    for stage in stats.counts:
+        results[f'{stage}_count'] = stats.counts[stage]
+        results[f'{stage}_seconds'] = stats.seconds[stage]
+        results[f'{stage}_per_second'] = stats.throughput(stage)
+    return results
+
+
+def benchmark_sanitize(file: str = 'data/lotr.txt') -> Dict[str, float]:
+    """Compare how many characters of <file> per second are sanitized by
+    filtering each line with _filter_conditions, which is how _sanitize used
+    to work, by _sanitize, and by _sanitize_text over the whole file.
+    """
+    with open(file, encoding='utf8') as f:
+        text = f.read()
+    lines = text.split('\n')
+
+    start = time.perf_counter()
+    filtered = [''.join(filter(_filter_conditions, line.lower()))
+                for line in lines]
+    filter_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sanitized = [_sanitize(line) for line in lines]
+    sanitize_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sanitized_text = _sanitize_text(text)
+    sanitize_text_seconds = time.perf_counter() - start
+    assert filtered == sanitized == sanitized_text
+
+    return {
+        'characters': len(text),
+        'filter_per_second': len(text) / filter_seconds,
+        'sanitize_per_second': len(text) / sanitize_seconds,
+        'sanitize_text_per_second': len(text) / sanitize_text_seconds
+    }
+
+
+def benchmark_duplicates(file: str = 'data/google_no_swears.txt',
+                         copies: int = 10) -> Dict[str, float]:
+    """Time building a letter engine using a simple prefix tree over a file
+    with every line of <file> <copies> times, and inserting each of its
+    sanitized lines into a simple prefix tree one at a time, as the engine
+    did before it totalled the weight of each distinct line first.
+    """
+    with open(file, encoding='utf8') as f:
+        text = f.read() * copies
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'duplicates.txt')
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(text)
+
+        start = time.perf_counter()
+        tree = SimplePrefixTree('sum')
+        for line in _sanitize_text(text):
+            if line != '':
+                tree.insert(line, 1.0, list(line))
+        insert_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        engine = LetterAutocompleteEngine({
+            'file': path,
+            'autocompleter': 'simple',
+            'weight_type': 'sum'
+        })
+        engine_seconds = time.perf_counter() - start
+
+    return {
+        'values': len(engine.autocompleter),
+        'insert_seconds': insert_seconds,
+        'engine_seconds': engine_seconds
+    }
+
+
+def benchmark_sentence_loading(file: str = 'data/google_searches.csv',
+                               copies: int = 100) -> Dict[str, float]:
+    """Compare the rows per second of a CSV file with every row of <file>
+    <copies> times that are turned into sentence engine entries by
+    _sentence_entries, and by reading each row with csv.reader and
+    sanitizing each of its words and then the whole string, as the sentence
+    engine used to.
+    """
+    with open(file, encoding='utf8') as f:
+        text = f.read() * copies
+    rows = text.count('\n')
+
+    start = time.perf_counter()
+    for row in csv.reader(io.StringIO(text)):
+        words = [_sanitize(word) for word in row[0].split()]
+        words = [word for word in words if word != '']
+        if words != []:
+            _sanitize(row[0])
+            float(row[1])
+    row_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _sentence_entries(io.StringIO(text))
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        'rows': rows,
+        'row_per_second': rows / row_seconds,
+        'batch_per_second': rows / batch_seconds
+    }
+
+
+def benchmark_interned_words(file: str = 'data/lotr.txt') \
+        -> Dict[str, float]:
+    """Turn each line of the text file <file> into a sentence engine entry,
+    and compare the memory held by compressed prefix trees of the entries
+    whose prefixes are lists of separate words, and lists of interned words,
+    with the time each takes to autocomplete the first two words of every
+    line.
+    """
+    text = io.StringIO()
+    writer = csv.writer(text)
+    with open(file, encoding='utf8') as f:
+        for line in f:
+            writer.writerow([line.strip(), 1])
+    text = text.getvalue()
+
+    tracemalloc.start()
+    entries = _sentence_entries(io.StringIO(text))
+    words_tree = CompressedPrefixTree.bulk_build('sum', entries)
+    del entries
+    words_bytes = tracemalloc.get_traced_memory()[0]
+    entries = [(value, weight, list(map(sys.intern, prefix))) for value,
+               weight, prefix in _sentence_entries(io.StringIO(text))]
+    interned_tree = CompressedPrefixTree.bulk_build('sum', entries)
+    del entries
+    interned_bytes = tracemalloc.get_traced_memory()[0] - words_bytes
+    tracemalloc.stop()
+
+    prefixes = [line.split()[:2] for line in text.lower().splitlines()]
+    results = {'words_bytes': words_bytes, 'interned_bytes': interned_bytes}
+    for name, tree in [('words', words_tree), ('interned', interned_tree)]:
+        start = time.perf_counter()
+        for prefix in prefixes:
+            tree.autocomplete(prefix, 10)
+        results[f'{name}_autocomplete_seconds'] = time.perf_counter() - start
+    return results
+
+
+def _tuple_melody_entries(f: Any) -> List[Any]:
+    """Return a (melody, 1, intervals) tuple for each row of the open CSV
+    file <f> of a MelodyAutocompleteEngine, where the notes of each melody
+    are a list of tuples and its intervals are found one note at a time, as
+    the melody engine used to.
+    """
+    entries = []
+    for row in csv.reader(f):
+        notes = []
+        for p in range(1, len(row) - 1, 2):
+            if row[p] == '' or row[p + 1] == '':
+                break
+            notes.append((int(row[p]), int(row[p + 1])))
+        intervals = [notes[i + 1][0] - notes[i][0]
+                     for i in range(len(notes) - 1)]
+        entries.append((Melody(row[0], notes), 1, intervals))
+    return entries
+
+
+def benchmark_melody_loading(file: str = 'data/random_melodies_c_scale.csv',
+                             copies: int = 100) -> Dict[str, float]:
+    """Compare the time and memory taken to read the melodies of a CSV file
+    with every row of <file> <copies> times into packed melodies by
+    _melody_entries, and into melodies whose notes are lists of tuples.
+    """
+    with open(file, encoding='utf8') as f:
+        text = f.read() * copies
+
+    results = {}
+    for name, read in [('tuple', _tuple_melody_entries),
+                       ('packed', _melody_entries)]:
+        start = time.perf_counter()
+        entries = read(io.StringIO(text))
+        results[f'{name}_seconds'] = time.perf_counter() - start
+        results['melodies'] = len(entries)
+        del entries
+
+        tracemalloc.start()
+        entries = read(io.StringIO(text))
+        results[f'{name}_bytes'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del entries
+    return results
+
+
+def benchmark_query_cache(file: str = 'data/google_no_swears.txt',
+                          queries: int = 100000,
+                          cache_size: int = 1000) -> Dict[str, float]:
+    """Time autocompleting <queries> prefixes of the lines of <file>, drawn
+    so that the nth most common prefix is asked for about 1 / n as often as
+    the most common one, by letter engines without a cache and with a cache
+    of <cache_size> results.
+    """
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    prefixes = sorted({line[:i] for line in lines for i in range(1, 5)
+                       if len(line) >= i})
+    rng = random.Random(148)
+    rng.shuffle(prefixes)
+    asked = rng.choices(prefixes,
+                        weights=[1 / n for n in range(1, len(prefixes) + 1)],
+                        k=queries)
+
+    results = {'queries': queries}
+    for name, size in [('uncached', 0), ('cached', cache_size)]:
+        engine = LetterAutocompleteEngine({
+            'file': file,
+            'autocompleter': 'compressed',
+            'weight_type': 'sum',
+            'cache_size': size
+        })
+        start = time.perf_counter()
+        for prefix in asked:
+            engine.autocomplete(prefix, 10)
+        results[f'{name}_seconds'] = time.perf_counter() - start
+    results['hit_rate'] = engine.cache_info()['hits'] / queries
+    return results
+
+
+def benchmark_typing(file: str = 'data/lotr.txt',
+                     autocompleter: str = 'compressed', count: int = 1500,
+                     limit: int = 10) -> Dict[str, float]:
+    """Time finding the top <limit> matches after each letter of the first
+    <count> lines of <file> is typed, in a letter engine over <file> using
+    the <autocompleter> prefix tree, by autocompleting the whole prefix
+    typed so far and by moving a cursor one letter at a time.
+    """
+    engine = LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': autocompleter,
+        'weight_type': 'sum'
+    })
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    lines = [line for line in lines if line != ''][:count]
+
+    start = time.perf_counter()
+    for line in lines:
+        for end in range(1, len(line) + 1):
+            engine.autocomplete(line[:end], limit)
+    autocomplete_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for line in lines:
+        cursor = engine.cursor()
+        for letter in line:
+            cursor.advance(letter)
+            cursor.top(limit)
+    cursor_seconds = time.perf_counter() - start
+
+    return {
+        'keystrokes': sum(len(line) for line in lines),
+        'autocomplete_seconds': autocomplete_seconds,
+        'cursor_seconds': cursor_seconds
+    }
+
+
+def benchmark_fuzzy_autocomplete(file: str = 'data/google_no_swears.txt',
+                                 max_edits: int = 2, queries: int = 1000,
+                                 limit: int = 10) -> Dict[str, float]:
+    """Build a letter engine over <file> using a compressed prefix tree, and
+    time fuzzy autocomplete with <max_edits> and <limit> for <queries>
+    prefixes of its lines that have one letter mistyped.
+    """
+    engine = LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': 'compressed',
+        'weight_type': 'sum'
+    })
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    lines = [line for line in lines if line != '']
+    rng = random.Random(148)
+    prefixes = []
+    for _ in range(queries):
+        prefix = list(rng.choice(lines)[:rng.randint(1, 12)])
+        prefix[rng.randrange(len(prefix))] = rng.choice('abcdefghijklmnop')
+        prefixes.append(''.join(prefix))
+
+    latencies = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        engine.fuzzy_autocomplete(prefix, max_edits, limit)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        'queries': queries,
+        'seconds': sum(latencies),
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(0.99 * len(latencies))] * 1000
+    }
+
+
+def benchmark_autocomplete_many(file: str = 'data/google_searches.csv',
+                                limit: int = 10) -> Dict[str, float]:
+    """Time finding the top <limit> matches for every prefix of every query
+    in the CSV file <file>, in shuffled order, by calling autocomplete for
+    each prefix and by one call to autocomplete_many.
+
+    The letter prefixes are searched in a compressed prefix tree of the
+    letters of the queries, and the word prefixes in a sentence engine over
+    <file> using a compressed prefix tree.
+    """
+    with open(file, encoding='utf8') as f:
+        entries = _sentence_entries(f)
+    rng = random.Random(148)
+    letter_prefixes = [list(string[:end]) for string, _, _ in entries
+                       for end in range(len(string) + 1)]
+    rng.shuffle(letter_prefixes)
+    word_prefixes = [' '.join(words[:end]) for _, _, words in entries
+                     for end in range(len(words) + 1)]
+    rng.shuffle(word_prefixes)
+
+    tree = CompressedPrefixTree.bulk_build(
+        'sum', [(string, weight, list(string))
+                for string, weight, _ in entries])
+    engine = SentenceAutocompleteEngine({
+        'file': file,
+        'autocompleter': 'compressed',
+        'weight_type': 'sum'
+    })
+
+    results = {'letter_prefixes': len(letter_prefixes),
+               'word_prefixes': len(word_prefixes)}
+    for name, completer, prefixes in [('letter', tree, letter_prefixes),
+                                      ('word', engine, word_prefixes)]:
+        start = time.perf_counter()
+        for prefix in prefixes:
+            completer.autocomplete(prefix, limit)
+        results[f'{name}_loop_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        completer.autocomplete_many(prefixes, limit)
+        results[f'{name}_many_seconds'] = time.perf_counter() - start
+    return results
+
+
+def benchmark_server(file: str = 'data/google_no_swears.txt',
+                     clients: int = 32, requests: int = 20000) \
+        -> Dict[str, float]:
+    """Serve a letter engine over <file> using a compressed prefix tree, and
+    send it <requests> requests for the first few letters of its lines from
+    <clients> clients.
+
+    The server and the clients run in one event loop, so the throughput is
+    that of one process doing both.
+    """
+    engine = LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': 'compressed',
+        'weight_type': 'sum'
+    })
+
+    async def run() -> Dict[str, float]:
+        server = AutocompleteServer(engine)
+        listener = await server.start(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        results = await generate_load('127.0.0.1', port,
+                                      _typed_prefixes(file), clients,
+                                      requests)
+        for key, result in server.stats.to_dict().items():
+            results[f'server_{key}'] = result
+        listener.close()
+        await listener.wait_closed()
+        return results
+
+    return asyncio.run(run())
+
+
+def benchmark_parallel_build(file: str = 'data/lotr.txt',
+                             processes: int = 4) -> Dict[str, float]:
+    """Time building a letter engine over <file> using a compressed prefix
+    tree in one process, and in <processes> processes.
+    """
+    config = {
+        'file': file,
+        'autocompleter': 'compressed',
+        'weight_type': 'sum'
+    }
+    start = time.perf_counter()
+    LetterAutocompleteEngine(config)
+    serial_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    LetterAutocompleteEngine(dict(config, processes=processes))
+    parallel_seconds = time.perf_counter() - start
+
+    return {
+        'cpus': os.cpu_count(),
+        'processes': processes,
+        'serial_seconds': serial_seconds,
+        'parallel_seconds': parallel_seconds
+    }
+
+
+def benchmark_frozen_tree(file: str = 'data/lotr.txt') -> Dict[str, float]:
+    """Build a letter engine over <file> using a compressed prefix tree, freeze
+    the tree, and compare the memory each form holds and the time each takes
+    to autocomplete every one and two letter prefix of the lines in <file>.
+    """
+    tracemalloc.start()
+    engine = LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': 'compressed',
+        'weight_type': 'sum'
+    })
+    tree_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    frozen = engine.autocompleter.freeze()
+    frozen_bytes = tracemalloc.get_traced_memory()[0] - tree_bytes
+    tracemalloc.stop()
+
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    prefixes = [list(line[:i]) for line in lines for i in [1, 2]
+                if len(line) >= i]
+
+    results = {'tree_bytes': tree_bytes, 'frozen_bytes': frozen_bytes}
+    for name, tree in [('tree', engine.autocompleter), ('frozen', frozen)]:
+        start = time.perf_counter()
+        for prefix in prefixes:
+            tree.autocomplete(prefix, 10)
+        results[f'{name}_autocomplete_seconds'] = \
+            time.perf_counter() - start
+    return results
+
+
+def benchmark_top_k(file: str = 'data/lotr.txt',
+                    autocompleter: str = 'compressed',
+                    k: int = 10) -> Dict[str, float]:
+    """Build a letter engine over <file> using the <autocompleter> prefix
+    tree, and compare the time taken to autocomplete the top <k> matches of
+    every one and two letter prefix of the lines in <file> before and after
+    the tree keeps its top <k> matches, with the memory those take.
+    """
+    tracemalloc.start()
+    engine = LetterAutocompleteEngine({
+        'file': file,
+        'autocompleter': autocompleter,
+        'weight_type': 'sum'
+    })
+    tree_bytes = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    engine.autocompleter.keep_top(k)
+    keep_top_seconds = time.perf_counter() - start
+    top_bytes = tracemalloc.get_traced_memory()[0] - tree_bytes
+    tracemalloc.stop()
+
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    prefixes = [list(line[:i]) for line in lines for i in [1, 2]
+                if len(line) >= i]
+
+    results = {'tree_bytes': tree_bytes, 'top_bytes': top_bytes,
+               'keep_top_seconds': keep_top_seconds}
+    for name, top_k in [('search', 0), ('top_k', k)]:
+        engine.autocompleter.keep_top(top_k)
+        start = time.perf_counter()
+        for prefix in prefixes:
+            engine.autocompleter.autocomplete(prefix, k)
+        results[f'{name}_autocomplete_seconds'] = \
+            time.perf_counter() - start
+    return results
+
+
+def benchmark_snapshot(file: str = 'data/lotr.txt',
+                       autocompleter: str = 'compressed') -> Dict[str, float]:
+    """Time building a letter engine over <file> using the <autocompleter>
+    prefix tree, saving a snapshot of it, and loading the snapshot again.
+    """
+    config = {
+        'file': file,
+        'autocompleter': autocompleter,
+        'weight_type': 'sum'
+    }
+    start = time.perf_counter()
+    engine = LetterAutocompleteEngine(config)
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'engine.snapshot')
+        start = time.perf_counter()
+        engine.save(path)
+        save_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        LetterAutocompleteEngine.load(path)
+        load_seconds = time.perf_counter() - start
+        snapshot_bytes = os.path.getsize(path)
+
+    return {
+        'build_seconds': build_seconds,
+        'save_seconds': save_seconds,
+        'load_seconds': load_seconds,
+        'snapshot_bytes': snapshot_bytes
+    }
+
+
+class _RecursivePrefixTree:
+    """A simple prefix tree whose insert, remove and autocomplete recurse once
+    for each symbol of the prefix, like SimplePrefixTree did before they were
+    made iterative.
+
+    It is the baseline that benchmark_tree_operations and
+    benchmark_long_prefix time the prefix trees against, and only has their
+    public interface. Ties between equal weights may be broken differently,
+    and only leaves store their value, since building the prefix of every
+    tree would take time quadratic in the length of long prefixes.
+    """
+    value: Any
+    weight: float
+    subtrees: List[_RecursivePrefixTree]
+    _weight_type: str
+    _len: int
+    _summed_weight: float
+    _max_weight: float
+    _children: Dict[Any, _RecursivePrefixTree]
+    _leaves: Dict[Any, _RecursivePrefixTree]
+
+    def __init__(self, weight_type: str, value: Any = None) -> None:
+        """Initialize an empty tree with the given <weight_type> and <value>,
+        which is [] if it is None.
+        """
+        self.value = [] if value is None else value
+        self.weight = 0.0
+        self.subtrees = []
+        self._weight_type = weight_type
+        self._len = 0
+        self._summed_weight = 0.0
+        self._max_weight = 0.0
+        self._children = {}
+        self._leaves = {}
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this tree."""
+        return self._len
+
+    def is_leaf(self) -> bool:
+        """Return whether this tree is a leaf."""
+        return self.weight > 0 and self.subtrees == []
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert <value> with <weight> at <prefix>, adding <weight> to its
+        weight if it is already in this tree.
+        """
+        self._insert(value, weight, prefix, 0)
+
+    def _insert(self, value: Any, weight: float, prefix: List,
+                depth: int) -> None:
+        """Insert <value> into this tree, whose value is prefix[:depth]."""
+        if depth == len(prefix):
+            leaf = self._leaves.get(value)
+            if leaf is None:
+                leaf = _RecursivePrefixTree(self._weight_type, value)
+                self._leaves[value] = leaf
+                self.subtrees.append(leaf)
+                self._len += 1
+            leaf.weight += weight
+            leaf._summed_weight += weight
+            leaf._max_weight += weight
+        else:
+            child = self._children.get(prefix[depth])
+            if child is None:
+                child = _RecursivePrefixTree(self._weight_type)
+                self._children[prefix[depth]] = child
+                self.subtrees.append(child)
+            self._len -= len(child)
+            child._insert(value, weight, prefix, depth + 1)
+            self._len += len(child)
+        self._summed_weight += weight
+        self._update()
+
+    def _update(self) -> None:
+        """Recalculate the weights of this tree from its subtrees, and sort
+        them by non-increasing weight.
+        """
+        self.subtrees.sort(key=_by_weight)
+        self._max_weight = max([subtree._max_weight
+                                for subtree in self.subtrees], default=0.0)
+        if self._weight_type == 'sum' or self._len == 0:
+            self.weight = self._summed_weight
+        else:  # self._weight_type == 'average'
+            self.weight = self._summed_weight / self._len
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match <prefix>."""
+        self._remove(prefix, 0)
+
+    def _remove(self, prefix: List, depth: int) -> float:
+        """Remove all values that match <prefix> from this tree, whose value
+        is prefix[:depth], and return the sum of their weights.
+        """
+        if depth == len(prefix):
+            removed = self._summed_weight
+            self.subtrees = []
+            self._children = {}
+            self._leaves = {}
+            self._len = 0
+            self._summed_weight = 0.0
+            self._update()
+            return removed
+        child = self._children.get(prefix[depth])
+        if child is None:
+            return 0.0
+        self._len -= len(child)
+        removed = child._remove(prefix, depth + 1)
+        self._len += len(child)
+        if len(child) == 0:
+            del self._children[prefix[depth]]
+            self.subtrees.remove(child)
+        self._summed_weight -= removed
+        self._update()
+        return removed
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> (value, weight) matches for <prefix>, in
+        non-increasing order of weight.
+        """
+        return self._autocomplete(prefix, limit, 0)
+
+    def _autocomplete(self, prefix: List, limit: Optional[int],
+                      depth: int) -> List[Tuple[Any, float]]:
+        """Return autocomplete(<prefix>, <limit>) for this tree, whose value
+        is prefix[:depth].
+        """
+        if depth < len(prefix):
+            child = self._children.get(prefix[depth])
+            if child is None:
+                return []
+            return child._autocomplete(prefix, limit, depth + 1)
+
+        # The trees are searched in order of the heaviest leaf in them, so the
+        # search stops as soon as there are <limit> leaves.
+        leaves = []
+        heap = [(-self._max_weight, 0, self)]
+        count = 1
+        while heap and (limit is None or len(leaves) < limit):
+            tree = heapq.heappop(heap)[2]
+            if tree.is_leaf():
+                leaves.append((tree.value, tree.weight))
+            for subtree in tree.subtrees:
+                heapq.heappush(heap, (-subtree._max_weight, count, subtree))
+                count += 1
+        return leaves
+
+
+def _by_weight(tree: _RecursivePrefixTree) -> float:
+    """Return the key that sorts trees by non-increasing weight."""
+    return -tree.weight
+
+
+def benchmark_tree_operations(tree_class: type,
+                              file: str = 'data/google_no_swears.txt') \
+        -> Dict[str, float]:
+    """Time inserting every line of <file> into an empty tree of
+    <tree_class>, autocompleting the first two letters of every line, and
+    then removing them. The same operations are timed on a
+    _RecursivePrefixTree as the baseline.
+
+    <tree_class> only needs the public interface of an Autocompleter, so
+    different implementations of the prefix trees can be compared.
+    """
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    lines = [line for line in lines if line != '']
+    prefixes = [list(line[:2]) for line in lines]
+
+    results = {'lines': len(lines)}
+    for name, cls in [('', tree_class), ('recursive_', _RecursivePrefixTree)]:
+        tree = cls('sum')
+        start = time.perf_counter()
+        for line in lines:
+            tree.insert(line, 1.0, list(line))
+        results[f'{name}insert_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for prefix in prefixes:
+            tree.autocomplete(prefix, 20)
+        results[f'{name}autocomplete_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for prefix in prefixes:
+            tree.remove(prefix)
+        results[f'{name}remove_seconds'] = time.perf_counter() - start
+    return results
+
+
+def benchmark_bulk_build(file: str = 'data/lotr.txt') -> Dict[str, float]:
+    """Time building a compressed prefix tree of the sanitized lines of <file>
+    by inserting them one at a time, and by CompressedPrefixTree.bulk_build.
+    """
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    entries = [(line, 1.0, list(line)) for line in lines if line != '']
+
+    start = time.perf_counter()
+    tree = CompressedPrefixTree('sum')
+    for value, weight, prefix in entries:
+        tree.insert(value, weight, prefix)
+    insert_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    CompressedPrefixTree.bulk_build('sum', entries)
+    bulk_build_seconds = time.perf_counter() - start
+
+    return {
+        'lines': len(entries),
+        'insert_seconds': insert_seconds,
+        'bulk_build_seconds': bulk_build_seconds
+    }
+
+
+def benchmark_shared_prefixes(file: str = 'data/lotr.txt') \
+        -> Dict[str, float]:
+    """Bulk build a compressed prefix tree of the sanitized lines of <file>,
+    and compare the memory held by the prefixes of its non-leaf trees, which
+    share the prefixes inserted below them, with the memory a copy of each
+    tree's prefix would hold.
+
+    'traced_bytes' and 'peak_bytes' are the memory the build still holds and
+    the most it held at once, including the prefixes of the entries.
+    """
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    tracemalloc.start()
+    entries = [(line, 1.0, list(line)) for line in lines if line != '']
+    tree = CompressedPrefixTree.bulk_build('sum', entries)
+    del entries
+    traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # The size of each distinct prefix list held by a non-leaf tree, by id.
+    labels = {}
+    copied_bytes = 0
+    non_leaves = [subtree for subtree in _all_trees(tree) if subtree.subtrees]
+    for subtree in non_leaves:
+        labels[id(subtree._value)] = sys.getsizeof(subtree._value)
+        copied_bytes += sys.getsizeof(subtree.value)
+
+    return {
+        'non_leaf_trees': len(non_leaves),
+        'label_objects': len(labels),
+        'label_bytes': sum(labels.values()),
+        'copied_label_bytes': copied_bytes,
+        'traced_bytes': traced_bytes,
+        'peak_bytes': peak_bytes
+    }
+
+
+def benchmark_long_prefix(tree_class: type, length: int = 100000) \
+        -> Dict[str, float]:
+    """Time inserting, autocompleting and removing a value whose prefix has
+    <length> symbols in an empty tree of <tree_class>, and in a
+    _RecursivePrefixTree as the baseline.
+
+    The baseline recurses once for each symbol, so it is run with the
+    recursion limit raised above <length>. 'recursive_fails' is whether it
+    raises a RecursionError under the usual limit.
+    """
+    prefix = [i % 10 for i in range(length)]
+    results = {'length': length}
+    try:
+        _RecursivePrefixTree('sum').insert('long', 1.0, prefix)
+        results['recursive_fails'] = False
+    except RecursionError:
+        results['recursive_fails'] = True
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, length + 1000))
+    try:
+        for name, cls in [('', tree_class),
+                          ('recursive_', _RecursivePrefixTree)]:
+            tree = cls('sum')
+            start = time.perf_counter()
+            tree.insert('long', 1.0, prefix)
+            tree.insert('longer', 2.0, prefix + [0])
+            results[f'{name}insert_seconds'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            assert tree.autocomplete(prefix) == [('longer', 2.0),
+                                                 ('long', 1.0)]
+            results[f'{name}autocomplete_seconds'] = \
+                time.perf_counter() - start
+
+            start = time.perf_counter()
+            tree.remove(prefix)
+            results[f'{name}remove_seconds'] = time.perf_counter() - start
+            assert len(tree) == 0
+    finally:
+        sys.setrecursionlimit(limit)
+    return results
+
+
+def benchmark_concurrent_reads(tree_class: type,
+                               file: str = 'data/google_no_swears.txt',
+                               reads: int = 20000) -> Dict[str, float]:
+    """Compare the time taken to insert every line of <file> into an empty
+    tree of <tree_class> in place, and by publishing a copy of the tree for
+    each insert with a ConcurrentAutocompleter.
+
+    Then time <reads> autocompletes of the first two letters of the lines
+    from one thread, while another thread removes and inserts the lines
+    again, and give the p99 time taken by a read.
+    """
+    with open(file, encoding='utf8') as f:
+        lines = [_sanitize(line) for line in f]
+    lines = [line for line in lines if line != '']
+    prefixes = [list(line[:2]) for line in lines]
+
+    tree = tree_class('sum')
+    start = time.perf_counter()
+    for line in lines:
+        tree.insert(line, 1.0, list(line))
+    insert_seconds = time.perf_counter() - start
+
+    autocompleter = ConcurrentAutocompleter(tree_class('sum'))
+    start = time.perf_counter()
+    for line in lines:
+        autocompleter.insert(line, 1.0, list(line))
+    copy_on_write_insert_seconds = time.perf_counter() - start
+
+    done = threading.Event()
+    writes = 0
+
+    def write() -> None:
+        nonlocal writes
+        while not done.is_set():
+            for line in lines:
+                if done.is_set():
+                    break
+                autocompleter.remove(list(line))
+                autocompleter.insert(line, 1.0, list(line))
+                writes += 2
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    latencies = []
+    start = time.perf_counter()
+    for i in range(reads):
+        read_start = time.perf_counter()
+        autocompleter.autocomplete(prefixes[i % len(prefixes)], 10)
+        latencies.append(time.perf_counter() - read_start)
+    read_seconds = time.perf_counter() - start
+    done.set()
+    writer.join()
+    latencies.sort()
+
+    return {
+        'lines': len(lines),
+        'insert_seconds': insert_seconds,
+        'copy_on_write_insert_seconds': copy_on_write_insert_seconds,
+        'reads_per_second': reads / read_seconds,
+        'p99_read_ms': latencies[int(0.99 * len(latencies))] * 1000,
+        'writes_during_reads': writes
+    }
+
+
+def _print_results(name: str, results: Dict[str, float]) -> None:
+    """Print the <results> of the benchmark called <name>."""
+    print(name)
+    for key, result in results.items():
+        if key.endswith('_bytes') or key == 'bytes':
+            print(f'  {key}: {result / 2 ** 20:.1f} MiB')
+        elif isinstance(result, float):
+            print(f'  {key}: {result:.3f}')
+        else:
+            print(f'  {key}: {result}')
+
+
+if __name__ == '__main__':
+    _print_results('simple tree memory (lotr.txt)',
+                   benchmark_simple_tree_memory())
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        _print_results(f'{tree_class.__name__} operations '
+                       f'(google_no_swears.txt)',
+                       benchmark_tree_operations(tree_class))
+        _print_results(f'{tree_class.__name__} long prefix',
+                       benchmark_long_prefix(tree_class))
+        _print_results(f'{tree_class.__name__} concurrent reads '
+                       f'(google_no_swears.txt)',
+                       benchmark_concurrent_reads(tree_class))
+    _print_results('sentence loading (google_searches.csv)',
+                   benchmark_sentence_loading())
+    _print_results('interned words (lotr.txt)', benchmark_interned_words())
+    _print_results('autocomplete many (google_searches.csv)',
+                   benchmark_autocomplete_many())
+    _print_results('fuzzy autocomplete (google_no_swears.txt)',
+                   benchmark_fuzzy_autocomplete())
+    _print_results('melody loading (random_melodies_c_scale.csv)',
+                   benchmark_melody_loading())
+    for file in ['data/lotr.txt', 'data/google_no_swears.txt']:
+        _print_results(f'bulk build ({file})', benchmark_bulk_build(file))
+        _print_results(f'shared prefixes ({file})',
+                       benchmark_shared_prefixes(file))
+        _print_results(f'sanitize ({file})', benchmark_sanitize(file))
+        _print_results(f'ingestion ({file})', benchmark_ingestion(file))
+        _print_results(f'duplicates ({file})', benchmark_duplicates(file))
+        _print_results(f'query cache ({file})', benchmark_query_cache(file))
+        _print_results(f'typing ({file})', benchmark_typing(file))
+        _print_results(f'server ({file})', benchmark_server(file))
+        _print_results(f'parallel build ({file})',
+                       benchmark_parallel_build(file))
+        _print_results(f'frozen tree ({file})', benchmark_frozen_tree(file))
+        _print_results(f'snapshot ({file})', benchmark_snapshot(file))
+        for autocompleter in ['simple', 'compressed']:
+            _print_results(f'{autocompleter} tree top k ({file})',
+                           benchmark_top_k(file, autocompleter))
+            _print_results(f'{autocompleter} tree memory ({file})',
+                           benchmark_tree_memory(file, autocompleter))
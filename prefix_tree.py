@@ -9,13 +9,33 @@ This file contains the design of a public interface (Autocompleter) and two
 implementation of this interface, SimplePrefixTree and CompressedPrefixTree.
 You'll complete both of these subclasses over the course of this assignment.
 
+A CompressedPrefixTree that will only be queried can also be frozen into a
+FrozenPrefixTree, a read-only Autocompleter stored in flat arrays.
+
+A PrefixCursor autocompletes a prefix of either prefix tree as it is typed,
+moving down the tree one symbol at a time instead of from its root.
+
+A ConcurrentAutocompleter lets threads read either prefix tree while another
+thread changes it, by publishing a changed copy of the tree for each write.
+
 As usual, be sure not to change any parts of the given *public interface* in the
 starter code---and this includes the instance attributes, which we will be
 testing directly! You may, however, add new private attributes, methods, and
 top-level functions to this file.
 """
 from __future__ import annotations
-from typing import Any, List, Optional, Tuple
+import bisect
+import gc
+import heapq
+import itertools
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# The _order given to the next leaf created in any prefix tree.
+_insertion_order = itertools.count()
 
 
 ################################################################################
@@ -26,6 +46,8 @@ from typing import Any, List, Optional, Tuple
 class Autocompleter:
     """An abstract class representing the Autocompleter Abstract Data Type.
     """
+    __slots__ = ()
+
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter."""
         raise NotImplementedError
@@ -61,6 +83,16 @@ class Autocompleter:
         """
         raise NotImplementedError
 
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete with <limit> for each of the
+        given prefixes, in the same order as <prefixes>.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return [self.autocomplete(prefix, limit) for prefix in prefixes]
+
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
         """
@@ -71,85 +103,107 @@ class Autocompleter:
 ################################################################################
 
 
-class SimplePrefixTree(Autocompleter):
-    """A simple prefix tree.
-
-    This class follows the implementation described on the assignment handout.
-    Note that we've made the attributes public because we will be accessing them
-    directly for testing purposes.
-
-    === Attributes ===
-    value:
-        The value stored at the root of this prefix tree, or [] if this
-        prefix tree is empty.
-    weight:
-        The weight of this prefix tree. If this tree is a leaf, this attribute
-        stores the weight of the value stored in the leaf. If this tree is
-        not a leaf and non-empty, this attribute stores the *aggregate weight*
-        of the leaf weights in this tree.
-    subtrees:
-        A list of subtrees of this prefix tree.
-
-    === Representation invariants ===
-    - self.weight >= 0
-
-    - (EMPTY TREE):
-        If self.weight == 0, then self.value == [] and self.subtrees == [].
-        This represents an empty simple prefix tree.
-    - (LEAF):
-        If self.subtrees == [] and self.weight > 0, this tree is a leaf.
-        (self.value is a value that was inserted into this tree.)
-    - (NON-EMPTY, NON-LEAF):
-        If len(self.subtrees) > 0, then self.value is a list (*common prefix*),
-        and self.weight > 0 (*aggregate weight*).
-
-    - ("prefixes grow by 1")
-      If len(self.subtrees) > 0, and subtree in self.subtrees, and subtree
-      is non-empty and not a leaf, then
-
-          subtree.value == self.value + [x], for some element x
+class _SimpleNode:
+    """A tree in a SimplePrefixTree.
 
-    - self.subtrees does not contain any empty prefix trees.
-    - self.subtrees is *sorted* in non-increasing order of their weights.
-      (You can break ties any way you like.)
-      Note that this applies to both leaves and non-leaf subtrees:
-      both can appear in the same self.subtrees list, and both have a `weight`
-      attribute.
+    The root of a SimplePrefixTree is the SimplePrefixTree itself, and every
+    other tree in it is a _SimpleNode. They have the same public attributes
+    and representation invariants as SimplePrefixTree, but only the root can
+    be inserted into or removed from.
     """
     value: Any
     weight: float
-    subtrees: List[SimplePrefixTree]
+    subtrees: List[_SimpleNode]
 
     # === Private Instance Attributes ===
-    # _weight_type: A string that specifies whether the weight of the
-    # tree will be calculated as the 'sum' or the 'average' of the weights of
-    # each leaf value in the tree.
-    _weight_type: str
     # _len: is the number of values currently stored in the tree
     _len: int
     # _summed_weight: this is the sum of the weights inserted into self
-    # regardless of the value of _weight_type.
+    # regardless of the weight type of the tree.
     _summed_weight: float
+    # _max_weight: the largest weight of a leaf in self, or 0.0 if self is
+    # empty. Autocomplete uses it to visit the trees that can hold the
+    # heaviest values first.
+    _max_weight: float
+    # _order: when self is a leaf, the position of its value in the order
+    # values were first inserted into any prefix tree. Otherwise, the smallest
+    # _order of a leaf in self with weight _max_weight. Autocomplete breaks
+    # ties between equal weights with it.
+    _order: int
+    # _children: maps the next symbol of a prefix to the non-leaf subtree
+    # whose value ends with that symbol, or None if self is a leaf.
+    _children: Optional[Dict[Any, _SimpleNode]]
+    # _leaves: maps each hashable value stored directly below self to its
+    # leaf subtree, or None if no such value has been stored. Unhashable
+    # values are only found in self.subtrees.
+    _leaves: Optional[Dict[Any, _SimpleNode]]
+    # _symbol: the last element of self.value if self has a parent.
+    _symbol: Any
+    # _parent: the tree whose subtrees held self when it was last put in
+    # place, or None if self is a root or a leaf. Internal trees do not store
+    # their prefix; self.value is built from the _symbol of each tree on the
+    # path up from self.
+    _parent: Optional[_SimpleNode]
+    # _value: the value of self if self has no parent.
+    _value: Any
+    # _top: the (-weight, _order, value) of each of the leaves of self that
+    # autocomplete returns first, in that order, at most _top_k of them, or
+    # None if self is a leaf or its tree does not keep them.
+    _top: Optional[List[Tuple[float, int, Any]]]
     # === Private Representation invariants ===
-    # All trees have the same _weight_type as their subtrees.
     # _len >= 0
     # _len is always the number of leaf nodes(i.e. values) in the tree.
-
-    def __init__(self, weight_type: str) -> None:
-        """Initialize an empty simple prefix tree.
-
-        Precondition: weight_type == 'sum' or weight_type == 'average'.
-
-        The given <weight_type> value specifies how the aggregate weight
-        of non-leaf trees should be calculated (see the assignment handout
-        for details).
-        """
-        self.value = []
+    # _children and _leaves only contain trees that are in self.subtrees, and
+    # every non-leaf subtree is in _children.
+    # If self._parent is not None, then self._parent.value + [self._symbol]
+    # == self.value, so the value is the same for every copy of the tree
+    # that holds self.
+    # If self is a non-leaf subtree of a tree t reached from the root of a
+    # SimplePrefixTree, then self._parent is t. A tree that was removed, or
+    # replaced by a copy, keeps its _parent even if that tree no longer holds
+    # it, so older copies of the tree can still build its value.
+    __slots__ = ('_value', '_symbol', '_parent', 'weight', 'subtrees', '_len',
+                 '_summed_weight', '_max_weight', '_order', '_children',
+                 '_leaves', '_top')
+
+    def __init__(self) -> None:
+        """Initialize an empty tree with no parent."""
+        self._value = None
+        self._symbol = None
+        self._parent = None
         self.subtrees = []
         self.weight = 0.0
-        self._summed_weight = 0.0
-        self._weight_type = weight_type
+        self._summed_weight = 0
+        self._max_weight = 0.0
+        self._order = 0
         self._len = 0
+        self._children = None
+        self._leaves = None
+        self._top = None
+
+    @property
+    def value(self) -> Any:
+        """The value stored at the root of this prefix tree.
+
+        For a non-leaf tree below the root this is a new list built from the
+        symbols on the path down to it.
+        """
+        if self._parent is None:
+            return self._value
+
+        prefix = []
+        tree = self
+        while tree._parent is not None:
+            prefix.append(tree._symbol)
+            tree = tree._parent
+        prefix.reverse()
+        return prefix
+
+    @value.setter
+    def value(self, value: Any) -> None:
+        """Store <value> at the root of this prefix tree."""
+        self._value = value
+        self._parent = None
 
     def is_empty(self) -> bool:
         """Return whether this simple prefix tree is empty."""
@@ -173,11 +227,16 @@ class SimplePrefixTree(Autocompleter):
         """
         if self.is_empty():
             return ''
-        else:
-            s = '  ' * depth + f'{self.value} ({self.weight})\n'
-            for subtree in self.subtrees:
-                s += subtree._str_indented(depth + 1)
-            return s
+
+        lines = []
+        # Trees are pushed in reverse so they are popped in subtrees order.
+        stack = [(self, depth)]
+        while stack:
+            tree, depth = stack.pop()
+            lines.append('  ' * depth + f'{tree.value} ({tree.weight})\n')
+            for subtree in reversed(tree.subtrees):
+                stack.append((subtree, depth + 1))
+        return ''.join(lines)
 
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter.
@@ -191,222 +250,124 @@ class SimplePrefixTree(Autocompleter):
         # This only counts leaf nodes
         return self._len
 
-    def insert(self, value: Any, weight: float, prefix: List) -> None:
-        """Insert the given value into this Autocompleter.
-
-        The value is inserted with the given weight, and is associated with
-        the prefix sequence <prefix>.
-
-        If the value has already been inserted into this prefix tree
-        (compare values using ==), then the given weight should be *added* to
-        the existing weight of this value.
-
-        Preconditions:
-            weight > 0
-            The given value is either:
-                1) not in this Autocompleter
-                2) was previously inserted with the SAME prefix sequence
-
-        >>> spt = SimplePrefixTree('sum')
-        >>> spt.insert('hello', 20, ['h','e','l','l','o'])
-        >>> spt.insert('hello', 7, ['h','e','l','l','o'])
-        >>> print(spt)
-        [] (27)
-          ['h'] (27)
-            ['h', 'e'] (27)
-              ['h', 'e', 'l'] (27)
-                ['h', 'e', 'l', 'l'] (27)
-                  ['h', 'e', 'l', 'l', 'o'] (27)
-                    hello (27)
-        <BLANKLINE>
-        """
-        self._insert_helper(value, weight, prefix)
-
-    def _insert_helper(self, value: Any, weight: float, prefix: List) -> bool:
-        """This helps to insert the given value into this Autocompleter.
-
-        A helper was necessary since we needed to recursively edit the length
-        attributes of each tree, but needed to return a boolean that determines
-        whether we are adding a new_leaf. If True, this means the length
-        of each tree it falls under must be increased. If False, we know an
-        attempt was made to insert a previously added value. Consequently, only
-        weights are increased.
+    def _add_subtree(self, subtree: _SimpleNode) -> None:
+        """ Place a subtree into self.subtrees in the correct position base on
+        weight, and index it in self._children or self._leaves.
         """
-
-        depth = len(self.value)
-
-        new_leaf = False
-
-        if depth == len(prefix):
-            # We have reached the end of the prefix and will add a leaf or
-            # add our weight to an existing one.
-            leaf_index = self._find_leaf_with_value(value)
-            if leaf_index is not None:
-                self.subtrees[leaf_index].weight += weight
-                self.subtrees[leaf_index]._summed_weight += weight
-                self._fix_subtree_at_index(leaf_index)
-                new_leaf = False
-            else:
-                subtree = SimplePrefixTree(self._weight_type)
-                subtree.value = value
-                subtree.weight = weight
-                subtree._summed_weight = weight
-                subtree._len = 1
-                self._add_subtree(subtree)
-                new_leaf = True
-
+        if subtree.is_leaf():
+            self._add_leaf_index(subtree)
         else:
-            path_index = self._find_non_leaf_with_value(prefix[:(depth + 1)])
-
-            if path_index is None:  # depth < len(prefix)
-                # No prefix exists in the subtree so we add a new subtree.
-                subtree = SimplePrefixTree(self._weight_type)
-                subtree.value = prefix[:(depth + 1)]
-                new_leaf = subtree._insert_helper(value, weight, prefix)
-                self._add_subtree(subtree)
+            self._children[subtree._symbol] = subtree
 
-            else:
-                # A subtree already exists so we go down it.
-                new_leaf = self.subtrees[path_index]._insert_helper(value,
-                                                                    weight,
-                                                                    prefix)
-                self._fix_subtree_at_index(path_index)
-
-        if new_leaf:
-            self._len += 1
+        # It goes before any subtrees with the same weight.
+        i = _weight_index(self.subtrees, subtree.weight, False, 0,
+                          len(self.subtrees))
+        self.subtrees.insert(i, subtree)
 
-        self._calculate_weight()
+    def _add_weight(self, num_added: int, weight: float, leaf: _SimpleNode,
+                    weight_type: str) -> None:
+        """Update the length and weights of this tree, which has the given
+        <weight_type>, after <weight> was added to the weight of <leaf>.
 
-        return new_leaf
-
-    def _add_subtree(self, subtree: SimplePrefixTree) -> None:
-        """ Place a subtree into self.subtrees in the correct position base on
-        weight.
+        <num_added> is 1 if <leaf> is a new leaf of this tree, and 0 if it
+        was already in it. This takes constant time, however many subtrees
+        this tree has.
+        Note: This method is not recursive.
         """
-        if self.subtrees:
-            # This should only run the first time we fail to find a subtree.
-            i = 0
-            while i in range(0, len(self.subtrees)):
-                if subtree.weight >= self.subtrees[i].weight:
-                    # We are mutating the list and then breaking the
-                    # loop so this is okay.
-                    break
-                i += 1
-
-            self.subtrees.insert(i, subtree)
-        else:  # self.subtrees == []
-            self.subtrees.append(subtree)
-
-    def remove(self, prefix: List) -> None:
-        """Remove all values that match the given prefix.
+        self._len += num_added
+        self._summed_weight += weight
+        if _heaviest_first(leaf) < _heaviest_first(self):
+            self._max_weight = leaf._max_weight
+            self._order = leaf._order
+        self._update_weight(weight_type)
+
+    def _remove_weight(self, num_removed: int, weight: float, order: int,
+                       weight_type: str) -> None:
+        """Update the length and weights of this tree, which has the given
+        <weight_type>, after a subtree below it that held <num_removed>
+        values with a summed weight of <weight> was removed.
+
+        <order> is the _order the removed subtree had. Only when it held the
+        heaviest leaf of this tree are the subtrees of this tree looked at.
+        Note: This method is not recursive.
         """
-        self._remove_helper(prefix)
-
-    def _remove_helper(self, prefix: List) -> int:
-        """Just like remove but returns number of leaves deleted.
+        self._len -= num_removed
+        self._summed_weight -= weight
+        if self._order == order:
+            self._calculate_max_weight()
+        self._update_weight(weight_type)
+
+    def _update_weight(self, weight_type: str) -> None:
+        """Set the weight of this tree from its summed weight and length,
+        for a tree with the given <weight_type>.
         """
-        depth = len(self.value)
-
-        if prefix == self.value:
-            # make self empty and return its length
-            self.subtrees = []
-            self.weight = 0.0
-            self._summed_weight = 0.0
-            length = len(self)
-            self._len = 0
-            return length
-        else:
-            subtree_index = self._find_non_leaf_with_value(prefix[:(depth + 1)])
-
-            if subtree_index is not None:
-                subtree = self.subtrees[subtree_index]
-                num_removed = subtree._remove_helper(prefix)
-
-                self._len -= num_removed
-
-                self._calculate_weight()
-
-                if subtree.is_empty():
-                    self.subtrees.remove(subtree)
-
-                    if self.is_empty():
-                        self.value = []
-
-                    # Since removing a subtree will never make the list unsorted
-                    return num_removed
-                else:
-                    if num_removed != 0:
-                        # We found prefix but all subtrees still needed
-                        self._fix_subtree_at_index(subtree_index)
-                    else:
-                        # Prefix was not found
-                        pass
-
-                    return num_removed
-            else:
-                return 0
-
-    def _calculate_weight(self) -> None:
-        """This recalculates the weight for this tree based on the weight of its
-        subtrees
+        if self._len == 0:
+            self.weight = 0
+            self._summed_weight = 0
+        elif weight_type == 'sum':
+            self.weight = self._summed_weight
+        else:  # weight_type == 'average'
+            self.weight = self._summed_weight / self._len
+
+    def _add_leaf_index(self, leaf: _SimpleNode) -> None:
+        """Index the leaf subtree <leaf> of self in self._leaves."""
+        if self._leaves is None:
+            self._leaves = {}
+        try:
+            self._leaves[leaf.value] = leaf
+        except TypeError:
+            # Unhashable values are found by scanning self.subtrees.
+            pass
+
+    def _calculate_max_weight(self) -> None:
+        """This recalculates _max_weight and _order for this tree based on
+        its subtrees.
         Note: This method is not recursive.
         """
-        self._summed_weight = sum([subtree._summed_weight
-                                   for subtree in self.subtrees])
-        if self._weight_type == 'sum':
-            self.weight = self._summed_weight
-
-        else:  # self._weight_type == 'average'
-            if len(self) == 0:
-                self.weight = 0
-                self._summed_weight = 0
-                return
-
-            self.weight = self._summed_weight / len(self)
+        if self.subtrees:
+            heaviest = min(self.subtrees, key=_heaviest_first)
+            self._max_weight = heaviest._max_weight
+            self._order = heaviest._order
+        else:
+            self._max_weight = 0.0
 
-    def _find_non_leaf_with_value(self, value: Any) -> Optional[int]:
-        """ Finds a none leaf subtree with <value> and returns its index.
+    def _find_leaf_with_value(self, value: Any) -> Optional[_SimpleNode]:
+        """ Finds a leaf subtree with <value> and returns it.
         If no subtree can be found it returns None"""
-        for i in range(0, len(self.subtrees)):
-            subtree = self.subtrees[i]
-            if subtree.value == value and not subtree.is_leaf():
-                return i
-        return None
-
-    def _find_leaf_with_value(self, value: Any) -> Optional[int]:
-        """ Finds a leaf subtree with <value> and returns its index.
-        If no subtree can be found it returns None"""
-        for i in range(0, len(self.subtrees)):
-            subtree = self.subtrees[i]
-            if subtree.value == value and subtree.is_leaf():
-                return i
-        return None
+        try:
+            if self._leaves is None:
+                # Only unhashable values can be stored below self.
+                hash(value)
+                return None
+            return self._leaves.get(value)
+        except TypeError:
+            # Unhashable values are never indexed, so we look for them.
+            for subtree in self.subtrees:
+                if subtree.value == value and subtree.is_leaf():
+                    return subtree
+            return None
 
-    def _fix_subtree_at_index(self, index: int) -> None:
-        """If subtree at index is out of order it fixes that by shifting it
-        left or right
+    def _fix_subtree(self, subtree: _SimpleNode, old_weight: float) -> None:
+        """If <subtree> is out of order it fixes that by moving it left past
+        the lighter subtrees or right past the heavier ones, which are found
+        by binary search.
 
         Precondition:
-        index in range(0, len(self.subtrees))
-        self.subtrees is all sorted except for subtree at index
+        subtree in self.subtrees
+        self.subtrees is all sorted except for subtree, which was in order
+        when its weight was <old_weight>
         """
-        subtree = self.subtrees[index]
-
-        while True:
-            if index > 0 and subtree.weight > self.subtrees[index - 1].weight:
-                # Switch with index to left
-                self.subtrees[index - 1], self.subtrees[index] = \
-                    subtree, self.subtrees[index - 1]
-                index -= 1
-            elif (index < len(self.subtrees) - 1
-                  and subtree.weight < self.subtrees[index + 1].weight):
-                # Switch with index to right
-                self.subtrees[index + 1], self.subtrees[index] = \
-                    subtree, self.subtrees[index + 1]
-                index += 1
-            else:
-                # Current position ok
-                return
+        if subtree.weight == old_weight:
+            return
+        index = _subtree_index(self.subtrees, subtree, old_weight)
+        del self.subtrees[index]
+        if subtree.weight > old_weight:
+            index = _weight_index(self.subtrees, subtree.weight, True, 0,
+                                  index)
+        else:
+            index = _weight_index(self.subtrees, subtree.weight, False,
+                                  index, len(self.subtrees))
+        self.subtrees.insert(index, subtree)
 
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
@@ -425,64 +386,101 @@ class SimplePrefixTree(Autocompleter):
         >>> spt.autocomplete(['h', 'e', 'l'])
         [('hello', 80), ('help', 10)]
         """
-        depth = len(self.value)
-
-        if len(prefix) == depth:
-            return self._get_leaves_greedy(limit)
-        else:
+        tree = self
+        for depth in range(len(self.value), len(prefix)):
             # If we find an existing subtree go done it else non exist
             # and we return an empty list.
-            for subtree in self.subtrees:
-                if prefix[:(depth + 1)] == subtree.value:
-                    return subtree.autocomplete(prefix, limit)
-            return []
+            tree = tree._children.get(prefix[depth])
+            if tree is None:
+                return []
+        return tree._get_leaves_greedy(limit)
 
     def _get_leaves_greedy(self, limit: Optional[int]) -> \
             (List[Tuple[Any, float]]):
         """ The return value is a list with a tuple (value, weight)
          for each leaf. This is ordered by non-increasing weight.
-         The list will contain all the leafs found in a greedy search up to
-         limit or all the leafs if limit is None.
+         The list will contain the <limit> leaves with the largest weights,
+         or all the leafs if limit is None.
         """
+        return _best_first_leaves(self, limit)
 
-        if self.is_empty():
-            return []
-        elif self.is_leaf():
-            # Reached leaf node
-            return [(self.value, self.weight)]
-        else:
-            if limit is None:
-                limit = len(self)
-
-            leaves = []
+    def _advance(self, depth: int, symbol: Any) -> Optional[_SimpleNode]:
+        """Return the tree holding the values whose prefixes continue a
+        prefix of length <depth> matched by self with <symbol>, or None if
+        there are no such values.
 
-            # non empty non-leaf case
-            # Here we want to collect up to limit number of leafs
-            for subtree in self.subtrees:
+        Precondition: self is not a leaf, and len(self.value) == depth.
+        """
+        return self._children.get(symbol)
 
-                if limit <= 0:
-                    break
+    def _label(self, depth: int) -> List:
+        """Return the symbols that self.value has after the first <depth>,
+        which are the value of its parent.
 
-                new_leaves = subtree._get_leaves_greedy(limit)
-                leaves = _merge_leafs(leaves, new_leaves)
-                # Reduce limit by number of leaves collected
-                limit -= len(new_leaves)
+        Precondition: self has a parent and is not a leaf.
+        """
+        return [self._symbol]
 
-            return leaves
+    def _cow_copy(self) -> _SimpleNode:
+        """Return a copy of this tree that shares its subtrees but not the
+        list and dicts holding them, so the copy can be changed without
+        changing this tree.
 
+        The non-leaf subtrees are given the copy as their parent. The copy
+        has the same symbols on the path up from it, so their values are the
+        same for anything still reading this tree.
+        """
+        copy = type(self).__new__(type(self))
+        copy._value = self._value
+        copy._symbol = self._symbol
+        copy._parent = self._parent
+        copy.weight = self.weight
+        copy._len = self._len
+        copy._summed_weight = self._summed_weight
+        copy._max_weight = self._max_weight
+        copy._order = self._order
+        copy.subtrees = list(self.subtrees)
+        copy._children = None
+        copy._leaves = None
+        if self._children is not None:
+            copy._children = dict(self._children)
+            for subtree in copy._children.values():
+                subtree._parent = copy
+        if self._leaves is not None:
+            copy._leaves = dict(self._leaves)
+        copy._top = None if self._top is None else list(self._top)
+        return copy
+
+    def _replace_subtree(self, subtree: _SimpleNode,
+                         copy: _SimpleNode) -> None:
+        """Put <copy>, which was made by subtree._cow_copy(), in the place of
+        <subtree> in self.subtrees and in the index holding it.
+
+        Precondition: subtree in self.subtrees
+        """
+        self.subtrees[_subtree_index(self.subtrees, subtree,
+                                     subtree.weight)] = copy
+        if subtree.is_leaf():
+            self._add_leaf_index(copy)
+        else:
+            self._children[copy._symbol] = copy
+            copy._parent = self
 
-################################################################################
-# CompressedPrefixTree (Task 6)
-################################################################################
+    def _copy_leaf(self, value: Any) -> None:
+        """Replace the leaf subtree of self storing <value>, if there is one,
+        by a copy of it.
+        """
+        leaf = self._find_leaf_with_value(value)
+        if leaf is not None:
+            self._replace_subtree(leaf, leaf._cow_copy())
 
 
-class CompressedPrefixTree(Autocompleter):
-    """A compressed prefix tree implementation.
+class SimplePrefixTree(_SimpleNode, Autocompleter):
+    """A simple prefix tree.
 
-    While this class has the same public interface as SimplePrefixTree,
-    (including the initializer!) this version follows the implementation
-    described on Task 6 of the assignment handout, which reduces the number of
-    tree objects used to store values in the tree.
+    This class follows the implementation described on the assignment handout.
+    Note that we've made the attributes public because we will be accessing them
+    directly for testing purposes.
 
     === Attributes ===
     value:
@@ -509,9 +507,11 @@ class CompressedPrefixTree(Autocompleter):
         If len(self.subtrees) > 0, then self.value is a list (*common prefix*),
         and self.weight > 0 (*aggregate weight*).
 
-    - **NEW**
-      This tree does not contain any compressible internal values.
-      (See the assignment handout for a definition of "compressible".)
+    - ("prefixes grow by 1")
+      If len(self.subtrees) > 0, and subtree in self.subtrees, and subtree
+      is non-empty and not a leaf, then
+
+          subtree.value == self.value + [x], for some element x
 
     - self.subtrees does not contain any empty prefix trees.
     - self.subtrees is *sorted* in non-increasing order of their weights.
@@ -520,27 +520,28 @@ class CompressedPrefixTree(Autocompleter):
       both can appear in the same self.subtrees list, and both have a `weight`
       attribute.
     """
-    value: Optional[Any]
+    value: Any
     weight: float
-    subtrees: List[CompressedPrefixTree]
+    subtrees: List[_SimpleNode]
 
     # === Private Instance Attributes ===
     # _weight_type: A string that specifies whether the weight of the
     # tree will be calculated as the 'sum' or the 'average' of the weights of
-    # each leaf value in the tree.
-    _weight_type: bool
-    # _len: is the number of values currently stored in the tree
-    _len: int
-    # _summed_weight: this is the sum of the weights inserted into self
-    # regardless of the value of _weight_type.
-    _summed_weight: float
-    # === Private Representation invariants ===
-    # All trees have the same _weight_type as their subtrees.
-    # _len >= 0
-    # _len is always the number of leaf nodes(i.e. values) in the tree.
+    # each leaf value in the tree. It is only stored here, at the root; the
+    # trees below it are _SimpleNodes, which are given the weight type by
+    # the methods that change them.
+    _weight_type: str
+    # _version: the number of times values have been inserted into or
+    # removed from this tree. A PrefixCursor uses it to tell when the trees
+    # on its path may have changed.
+    _version: int
+    # _top_k: the most leaves kept in the _top of each non-leaf tree, or 0
+    # if they are not kept.
+    _top_k: int
+    __slots__ = ('_weight_type', '_version', '_top_k')
 
     def __init__(self, weight_type: str) -> None:
-        """Initialize an empty compressed prefix tree.
+        """Initialize an empty simple prefix tree.
 
         Precondition: weight_type == 'sum' or weight_type == 'average'.
 
@@ -548,52 +549,139 @@ class CompressedPrefixTree(Autocompleter):
         of non-leaf trees should be calculated (see the assignment handout
         for details).
         """
+        _SimpleNode.__init__(self)
         self.value = []
-        self.subtrees = []
-        self.weight = 0.0
-        self._summed_weight = 0.0
+        self._children = {}
         self._weight_type = weight_type
-        self._len = 0
+        self._version = 0
+        self._top_k = 0
 
-    def is_empty(self) -> bool:
-        """Return whether this compressed prefix tree is empty."""
-        return self.weight == 0.0
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a snapshot of this tree that SimplePrefixTree.from_snapshot
+        turns back into an equal tree.
 
-    def is_leaf(self) -> bool:
-        """Return whether this compressed prefix tree is a leaf."""
-        return self.weight > 0 and self.subtrees == []
+        The snapshot is a dict of flat lists and arrays, which can be pickled
+        without walking down the tree.
+        """
+        with _gc_paused():
+            return _snapshot(self, 'simple')
 
-    def __str__(self) -> str:
-        """Return a string representation of this tree.
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any]) -> SimplePrefixTree:
+        """Return the tree that <snapshot> was taken of, without inserting
+        any of its values.
 
-        You may find this method helpful for debugging.
+        Precondition: <snapshot> was returned by SimplePrefixTree.snapshot.
+
+        >>> spt = SimplePrefixTree('sum')
+        >>> spt.insert('help', 10.0, ['h', 'e', 'l', 'p'])
+        >>> spt.insert('hi', 20.0, ['h', 'i'])
+        >>> copy = SimplePrefixTree.from_snapshot(spt.snapshot())
+        >>> str(copy) == str(spt)
+        True
         """
-        return self._str_indented()
+        with _gc_paused():
+            return _from_snapshot(cls(snapshot['weight_type']), snapshot)
 
-    def _str_indented(self, depth: int = 0) -> str:
-        """Return an indented string representation of this tree.
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete with <limit> for each of the
+        given prefixes, in the same order as <prefixes>.
 
-        The indentation level is specified by the <depth> parameter.
+        The prefixes are visited in sorted order, so the trees on the path
+        shared by neighbouring prefixes are only found once.
+
+        Precondition: limit is None or limit > 0.
+
+        >>> tree = SimplePrefixTree('sum')
+        >>> tree.insert('swap', 76, ['s', 'w', 'a', 'p'])
+        >>> tree.insert('swat', 51, ['s', 'w', 'a', 't'])
+        >>> tree.insert('cat', 80, ['c', 'a', 't'])
+        >>> tree.autocomplete_many([['s', 'w', 'a', 't'], [], ['s']], 2)
+        [[('swat', 51)], [('cat', 80), ('swap', 76)], [('swap', 76), \
+('swat', 51)]]
         """
-        if self.is_empty():
-            return ''
-        else:
-            s = '  ' * depth + f'{self.value} ({self.weight})\n'
-            for subtree in self.subtrees:
-                s += subtree._str_indented(depth + 1)
-            return s
+        return _autocomplete_many(self, prefixes, limit)
 
-    def __len__(self) -> int:
-        """Return the number of values stored in this Autocompleter.
+    def fuzzy_autocomplete(self, prefix: List, max_edits: int,
+                           limit: Optional[int] = None) \
+            -> List[Tuple[Any, float, int]]:
+        """Return up to <limit> values whose prefix sequences start with a
+        sequence at most <max_edits> edits away from <prefix>, where an edit
+        inserts, deletes or replaces one symbol.
 
-        >>> spt = CompressedPrefixTree('sum')
-        >>> spt.insert('hello', 20, ['h','e','l','l','o'])
-        >>> spt.insert('help', 10, ['h','e','l','p'])
-        >>> len(spt)
-        2
+        The return value is a list of tuples (value, weight, edits), ordered
+        by the fewest edits needed, and then by non-increasing weight.
+
+        If limit is None, return *every* match.
+
+        Preconditions:
+            max_edits >= 0
+            limit is None or limit > 0
+
+        >>> tree = SimplePrefixTree('sum')
+        >>> tree.insert('hello', 20, list('hello'))
+        >>> tree.insert('help', 10, list('help'))
+        >>> tree.insert('jello', 5, list('jello'))
+        >>> tree.fuzzy_autocomplete(list('hwl'), 1)
+        [('hello', 20, 1), ('help', 10, 1)]
+        >>> tree.fuzzy_autocomplete(list('hwl'), 2, 3)
+        [('hello', 20, 1), ('help', 10, 1), ('jello', 5, 2)]
         """
-        # This only counts leaf nodes
-        return self._len
+        return _fuzzy_autocomplete(self, prefix, max_edits, limit)
+
+    def keep_top(self, k: int) -> None:
+        """Keep the top <k> matches of every non-leaf tree in this tree, and
+        keep them up to date as values are inserted and removed. If k is 0,
+        stop keeping them.
+
+        Autocomplete with a limit of at most <k> then only has to find the
+        tree matching its prefix, at the cost of a list of up to <k> matches
+        at every non-leaf tree.
+
+        Precondition: k >= 0
+
+        >>> tree = SimplePrefixTree('sum')
+        >>> tree.insert('swap', 76, ['s', 'w', 'a', 'p'])
+        >>> tree.insert('swat', 51, ['s', 'w', 'a', 't'])
+        >>> tree.keep_top(1)
+        >>> tree.insert('swan', 90, ['s', 'w', 'a', 'n'])
+        >>> tree.autocomplete(['s', 'w'], 1)
+        [('swan', 90)]
+        """
+        _keep_top(self, k)
+
+    def _cow_copy(self) -> SimplePrefixTree:
+        """Return a copy of this tree that shares its subtrees but not the
+        list and dicts holding them, so the copy can be changed without
+        changing this tree.
+        """
+        copy = _SimpleNode._cow_copy(self)
+        copy._weight_type = self._weight_type
+        copy._version = self._version
+        copy._top_k = self._top_k
+        return copy
+
+    def _copy_path(self, prefix: List) -> \
+            Tuple[SimplePrefixTree, Optional[_SimpleNode]]:
+        """Return a copy of this tree in which each tree on the path down to
+        <prefix> is a copy too, and the copy of the tree whose value is
+        <prefix>, or None if there is no such tree.
+
+        Inserting into or removing <prefix> from the copy only changes the
+        trees on that path, so this tree is left as it was.
+        """
+        root = self._cow_copy()
+        tree = root
+        for symbol in prefix:
+            subtree = tree._children.get(symbol)
+            if subtree is None:
+                return root, None
+            copy = subtree._cow_copy()
+            tree._replace_subtree(subtree, copy)
+            tree = copy
+        return root, tree
 
     def insert(self, value: Any, weight: float, prefix: List) -> None:
         """Insert the given value into this Autocompleter.
@@ -610,195 +698,454 @@ class CompressedPrefixTree(Autocompleter):
             The given value is either:
                 1) not in this Autocompleter
                 2) was previously inserted with the SAME prefix sequence
-        """
-        # The empty prefix case
-        self._insert_helper(value, weight, prefix, -1)
-
-    def _insert_helper(self, value: Any, weight: float, prefix: List,
-                       len_parent: int) -> bool:
-        """This helps to insert the given value into this Autocompleter.
-
-        Same as insert but len parent is the leangth of the parent of this
-        subtree.
-
-        Return true if value and prefix can be inserted with len_parent.
-        """
-
-        if self.value == prefix:  # Same prefix cases
-            # We know that a leaf already exists or a leaf should exist here
-            # with value <value>.
-
-            for i in range(len(self.subtrees)):
-                subtree = self.subtrees[i]
-                if subtree.is_leaf() and subtree.value == value:
-
-                    subtree.weight += weight
-                    subtree._summed_weight += weight
-                    self._calculate_len_weight()
-                    # do not need to increase len since nothing was added
-                    self._fix_subtree_at_index(i)
-                    return True
-
-            # We did not find a subtree to add weight to so we can add a leaf
-
-            self._add_leaf(value, weight)
-            self._calculate_len_weight()
-            return True
-
-        elif self.is_empty():  # Empty Tree case
-            self.value = prefix
-            # Goes to same prefix case
-            return self._insert_helper(value, weight, prefix, len(self.value))
-
-        elif _is_prefix(self.value, prefix):  # value is prefix case
-            # This is the ['a', 'b'] in the tree is prefix of
-            # ['a', 'b', 'c'] prefix.
-            for i in range(len(self.subtrees)):
-                subtree = self.subtrees[i]
-                # We call insert helper on non-leaf subtrees and clean up if
-                # we find one
-                if (not subtree.is_leaf() and
-                        subtree._insert_helper(value, weight, prefix,
-                                               len(self.value))):
-
-                    self._fix_subtree_at_index(i)
-                    self._calculate_len_weight()
-                    return True
-
-            # We have failed to find a subtree to go down so we dump the leaf
-            # here
-            self._add_depth_2_subtree(value, prefix,
-                                      weight)
-            self._calculate_len_weight()
-            return True
-        else:
-            shared_prefix = _share_prefix(prefix, self.value)
-
-            if len(shared_prefix) > len_parent: # novel prefix case:
-                # create a copy of self.
-                copy_self = self._copy()
 
-                # Give self correct value
-                self.subtrees = []
-                self.value = shared_prefix
+        >>> spt = SimplePrefixTree('sum')
+        >>> spt.insert('hello', 20, ['h','e','l','l','o'])
+        >>> spt.insert('hello', 7, ['h','e','l','l','o'])
+        >>> print(spt)
+        [] (27)
+          ['h'] (27)
+            ['h', 'e'] (27)
+              ['h', 'e', 'l'] (27)
+                ['h', 'e', 'l', 'l'] (27)
+                  ['h', 'e', 'l', 'l', 'o'] (27)
+                    hello (27)
+        <BLANKLINE>
+        """
+        self._version += 1
+        # path[i] is the tree whose value is prefix[:i]. The trees after
+        # path[first_new - 1] were made by this insert and are not yet in
+        # their parent's subtrees.
+        path = [self]
+        tree = self
+        first_new = len(prefix) + 1
+        for depth in range(len(prefix)):
+            subtree = tree._children.get(prefix[depth])
+            if subtree is None:
+                first_new = min(first_new, depth + 1)
+                subtree = _SimpleNode()
+                subtree._symbol = prefix[depth]
+                subtree._parent = tree
+                subtree._children = {}
+                if self._top_k:
+                    subtree._top = []
+            path.append(subtree)
+            tree = subtree
+
+        # We have reached the end of the prefix and will add a leaf or
+        # add our weight to an existing one.
+        leaf = tree._find_leaf_with_value(value)
+        if leaf is not None:
+            leaf.weight += weight
+            leaf._summed_weight += weight
+            leaf._max_weight += weight
+            tree._fix_subtree(leaf, leaf.weight - weight)
+            num_added = 0
+        else:
+            leaf = _SimpleNode()
+            leaf.value = value
+            leaf.weight = weight
+            leaf._summed_weight = weight
+            leaf._max_weight = weight
+            leaf._order = next(_insertion_order)
+            leaf._len = 1
+            tree._add_subtree(leaf)
+            num_added = 1
+
+        # Walk back up the path, fixing each tree's weight and then its
+        # position in its parent's subtrees.
+        for depth in range(len(prefix), -1, -1):
+            tree = path[depth]
+            old_weight = tree.weight
+            tree._add_weight(num_added, weight, leaf, self._weight_type)
+            if self._top_k:
+                _add_top(tree, leaf, self._top_k)
+            if depth >= first_new:
+                path[depth - 1]._add_subtree(tree)
+            elif depth > 0:
+                path[depth - 1]._fix_subtree(tree, old_weight)
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+        """
+        self._version += 1
+        # path[i] is the tree whose value is prefix[:i].
+        path = [self]
+        tree = self
+        for symbol in prefix:
+            tree = tree._children.get(symbol)
+            if tree is None:
+                # Prefix was not found
+                return
+            path.append(tree)
+
+        # make tree empty and remember what it held
+        num_removed = len(tree)
+        removed_weight = tree._summed_weight
+        removed_order = tree._order
+        removed_key = _heaviest_first(tree)
+        old_weight = tree.weight
+        tree.subtrees = []
+        tree._children = {}
+        tree._leaves = None
+        if self._top_k:
+            tree._top = []
+        tree.weight = 0.0
+        tree._summed_weight = 0.0
+        tree._max_weight = 0.0
+        tree._len = 0
+
+        for depth in range(len(prefix) - 1, -1, -1):
+            tree = path[depth]
+            subtree = path[depth + 1]
+            if subtree.is_empty():
+                del tree.subtrees[_subtree_index(tree.subtrees, subtree,
+                                                 old_weight)]
+                del tree._children[subtree._symbol]
+            subtree_old_weight = old_weight
+            old_weight = tree.weight
+            tree._remove_weight(num_removed, removed_weight, removed_order,
+                                self._weight_type)
+            if self._top_k:
+                _remove_top(tree, removed_key, self._top_k)
+
+            # A tree left empty keeps its parent, since the trees below it
+            # may still be read through an older copy of this tree.
+            if not tree.is_empty() and not subtree.is_empty():
+                # We found prefix but all subtrees still needed. Since
+                # removing a subtree never makes the list unsorted, this is
+                # the only case that needs fixing.
+                tree._fix_subtree(subtree, subtree_old_weight)
+
+################################################################################
+# CompressedPrefixTree (Task 6)
+################################################################################
+
+
+class _CompressedNode:
+    """A tree in a CompressedPrefixTree.
+
+    The root of a CompressedPrefixTree is the CompressedPrefixTree itself, and
+    every other tree in it is a _CompressedNode. They have the same public
+    attributes and representation invariants as CompressedPrefixTree, but
+    only the root can be inserted into or removed from.
+
+    The value of a non-leaf tree is a new list each time it is read, so
+    changing that list doesn't change the tree. Only leaves can be given a
+    new value.
+    """
+    value: Optional[Any]
+    weight: float
+    subtrees: List[_CompressedNode]
 
-                self.subtrees.append(copy_self)
+    # === Private Instance Attributes ===
+    # _len: is the number of values currently stored in the tree
+    _len: int
+    # _summed_weight: this is the sum of the weights inserted into self
+    # regardless of the weight type of the tree.
+    _summed_weight: float
+    # _max_weight: the largest weight of a leaf in self, or 0.0 if self is
+    # empty. Autocomplete uses it to visit the trees that can hold the
+    # heaviest values first.
+    _max_weight: float
+    # _order: when self is a leaf, the position of its value in the order
+    # values were first inserted into any prefix tree. Otherwise, the smallest
+    # _order of a leaf in self with weight _max_weight. Autocomplete breaks
+    # ties between equal weights with it.
+    _order: int
+    # _children: maps the symbol that follows self.value in a prefix to the
+    # non-leaf subtree whose value continues with that symbol, or None if
+    # self is a leaf.
+    _children: Optional[Dict[Any, _CompressedNode]]
+    # _top: the (-weight, _order, value) of each of the leaves of self that
+    # autocomplete returns first, in that order, at most _top_k of them, or
+    # None if self is a leaf or its tree does not keep them.
+    _top: Optional[List[Tuple[float, int, Any]]]
+    # _value: the value of self if self is a leaf. Otherwise, a prefix that
+    # was inserted below self, whose first _end elements are self.value.
+    # Non-leaf trees do not store their own copy of their prefix; the trees
+    # on the path to an inserted prefix share that one list.
+    _value: Any
+    # _end: the length of self.value, or None if self is a leaf.
+    _end: Optional[int]
+    # === Private Representation invariants ===
+    # _len >= 0
+    # _len is always the number of leaf nodes(i.e. values) in the tree.
+    # _children only contains trees that are in self.subtrees, and every
+    # non-leaf subtree is in _children.
+    # If _end is not None, then _end <= len(_value), and the first _end
+    # elements of _value never change.
+    __slots__ = ('_value', '_end', 'weight', 'subtrees', '_len',
+                 '_summed_weight', '_max_weight', '_order', '_children',
+                 '_top')
+
+    def __init__(self) -> None:
+        """Initialize an empty tree."""
+        self._value = []
+        self._end = 0
+        self.subtrees = []
+        self.weight = 0.0
+        self._summed_weight = 0
+        self._max_weight = 0.0
+        self._order = 0
+        self._len = 0
+        self._children = None
+        self._top = None
+
+    @property
+    def value(self) -> Any:
+        """The value stored at the root of this prefix tree.
+
+        For a non-leaf tree this is a new list (or whatever sequence its
+        prefixes were inserted as) of the elements of its common prefix.
+        """
+        if self._end is None:
+            return self._value
+        return self._value[:self._end]
 
-                self._insert_helper(value, weight, prefix, len(self.value))
+    @value.setter
+    def value(self, value: Any) -> None:
+        """Store <value> at the root of this prefix tree, which is a leaf.
 
-                return True
-            else:  # We can't insert here
-                return False
+        Precondition: self has no subtrees.
+        """
+        # A tree with subtrees has a prefix whose length is in _end, and its
+        # value can only be changed by inserting into or removing from it.
+        assert not self.subtrees, 'only a leaf can be given a value'
+        self._value = value
+        self._end = None
+
+    def is_empty(self) -> bool:
+        """Return whether this compressed prefix tree is empty."""
+        return self.weight == 0.0
+
+    def is_leaf(self) -> bool:
+        """Return whether this compressed prefix tree is a leaf."""
+        return self.weight > 0 and self.subtrees == []
 
-    def _copy(self) -> CompressedPrefixTree:
+    def __str__(self) -> str:
+        """Return a string representation of this tree.
+
+        You may find this method helpful for debugging.
+        """
+        return self._str_indented()
+
+    def _str_indented(self, depth: int = 0) -> str:
+        """Return an indented string representation of this tree.
+
+        The indentation level is specified by the <depth> parameter.
+        """
+        if self.is_empty():
+            return ''
+
+        lines = []
+        # Trees are pushed in reverse so they are popped in subtrees order.
+        stack = [(self, depth)]
+        while stack:
+            tree, depth = stack.pop()
+            lines.append('  ' * depth + f'{tree.value} ({tree.weight})\n')
+            for subtree in reversed(tree.subtrees):
+                stack.append((subtree, depth + 1))
+        return ''.join(lines)
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter.
+
+        >>> spt = CompressedPrefixTree('sum')
+        >>> spt.insert('hello', 20, ['h','e','l','l','o'])
+        >>> spt.insert('help', 10, ['h','e','l','p'])
+        >>> len(spt)
+        2
+        """
+        # This only counts leaf nodes
+        return self._len
+
+    def _copy(self) -> _CompressedNode:
         """Make a copy of self"""
 
-        copy_self = CompressedPrefixTree(self._weight_type)
-        copy_self.value = self.value
+        copy_self = _CompressedNode()
+        copy_self._value = self._value
+        copy_self._end = self._end
         copy_self.weight = self.weight
         copy_self._len = self._len
         copy_self._summed_weight = self._summed_weight
+        copy_self._max_weight = self._max_weight
+        copy_self._order = self._order
         copy_self.subtrees = self.subtrees
+        copy_self._children = self._children
+        copy_self._top = self._top
         return copy_self
 
-    def _add_leaf(self, value: any, weight: float) -> None:
+    def _split(self, end: int) -> None:
+        """Move the contents of self into a new subtree, and make the first
+        <end> elements of self.value the value of self.
+
+        The weight and length of self do not change, so neither does its
+        position in its parent's subtrees. Both trees share the prefix self
+        already had, so nothing is copied.
+
+        Precondition: self is not a leaf, and end < len(self.value).
+        """
+        # create a copy of self.
+        copy_self = self._copy()
+
+        # Give self correct value
+        self._end = end
+        self.subtrees = [copy_self]
+        self._children = {self._value[end]: copy_self}
+        if self._top is not None:
+            self._top = list(self._top)
+
+    def _add_leaf(self, value: any, weight: float) -> _CompressedNode:
         """Creates a leaf and inserts it in the correct position in subtrees
         By weight
 
         DOSE NOT RECOMPUTE self._len, self.weight, and self._sumed_weight
+        Returns the new leaf.
         """
-        leaf = CompressedPrefixTree(self._weight_type)
+        leaf = _CompressedNode()
         leaf.value = value
         leaf._len = 1
         leaf.weight = weight
         leaf._summed_weight = weight
+        leaf._max_weight = weight
+        leaf._order = next(_insertion_order)
         self._add_subtree(leaf)
+        return leaf
 
-    def _add_depth_2_subtree(self, value: Any, prefix: list, weight: float)\
-            -> None:
+    def _add_depth_2_subtree(self, value: Any, prefix: list, weight: float,
+                             weight_type: str) -> _CompressedNode:
         """Adds a subtree with only the prefix and the leaf in correct position
-        by weight.
+        by weight, for a tree with the given <weight_type>.
 
         DOSE NOT RECOMPUTE self._len, self.weight, and self._sumed_weight
+        Returns the new leaf.
         """
-        leaf = CompressedPrefixTree(self)
+        leaf = _CompressedNode()
         leaf._len = 1
         leaf.value = value
         leaf._summed_weight = weight
+        leaf._max_weight = weight
+        leaf._order = next(_insertion_order)
         # no need to use _calculate_weight() if len == 1
         leaf.weight = weight
-        prefix_tree = CompressedPrefixTree(self._weight_type)
-        prefix_tree.value = prefix
+        prefix_tree = _CompressedNode()
+        prefix_tree._value = prefix
+        prefix_tree._end = len(prefix)
         prefix_tree.subtrees.append(leaf)
+        prefix_tree._children = {}
         prefix_tree._len = 1
         prefix_tree._summed_weight += weight
-        prefix_tree._calculate_len_weight()
+        prefix_tree._calculate_len_weight(weight_type)
+        if self._top is not None:
+            prefix_tree._top = [_top_entry(leaf)]
         self._add_subtree(prefix_tree)
+        return leaf
 
-    def _add_subtree(self, subtree: CompressedPrefixTree) -> None:
+    def _add_subtree(self, subtree: _CompressedNode) -> None:
         """ Place a subtree into self.subtrees in the correct position base on
         weight.
 
         DOSE NOT RECOMPUTE self._len, self.weight, and self._sumed_weight
         """
-        if self.subtrees:
-            # This should only run the first time we fail to find a subtree.
-            i = 0
-            while i in range(0, len(self.subtrees)):
-                if subtree.weight >= self.subtrees[i].weight:
-                    # We are mutating the list and then breaking the
-                    # loop so this is okay.
-                    break
-                i += 1
-
-            self.subtrees.insert(i, subtree)
-        else:  # self.subtrees == []
-            self.subtrees.append(subtree)
+        if not subtree.is_leaf():
+            self._children[subtree._value[self._end]] = subtree
+
+        # It goes before any subtrees with the same weight.
+        i = _weight_index(self.subtrees, subtree.weight, False, 0,
+                          len(self.subtrees))
+        self.subtrees.insert(i, subtree)
+
+    def _add_weight(self, num_added: int, weight: float, leaf: _CompressedNode,
+                    weight_type: str) -> None:
+        """Update the length and weights of this tree, which has the given
+        <weight_type>, after <weight> was added to the weight of <leaf>.
+
+        <num_added> is 1 if <leaf> is a new leaf of this tree, and 0 if it
+        was already in it. This takes constant time, however many subtrees
+        this tree has.
+        Note: This method is not recursive.
+        """
+        self._len += num_added
+        self._summed_weight += weight
+        if _heaviest_first(leaf) < _heaviest_first(self):
+            self._max_weight = leaf._max_weight
+            self._order = leaf._order
+        self._update_weight(weight_type)
+
+    def _remove_weight(self, num_removed: int, weight: float, order: int,
+                       weight_type: str) -> None:
+        """Update the length and weights of this tree, which has the given
+        <weight_type>, after a subtree below it that held <num_removed>
+        values with a summed weight of <weight> was removed.
+
+        <order> is the _order the removed subtree had. Only when it held the
+        heaviest leaf of this tree are the subtrees of this tree looked at.
+        Note: This method is not recursive.
+        """
+        self._len -= num_removed
+        self._summed_weight -= weight
+        if self._order == order:
+            self._calculate_max_weight()
+        self._update_weight(weight_type)
+
+    def _update_weight(self, weight_type: str) -> None:
+        """Set the weight of this tree from its summed weight and length,
+        for a tree with the given <weight_type>.
+        """
+        if self._len == 0:
+            self.weight = 0
+            self._summed_weight = 0
+        elif weight_type == 'sum':
+            self.weight = self._summed_weight
+        else:  # weight_type == 'average'
+            self.weight = self._summed_weight / self._len
 
-    def _calculate_len_weight(self) -> None:
+    def _calculate_len_weight(self, weight_type: str) -> None:
         """This recalculates the weight and len for this tree based on the
-        weight of its and lens of its subtrees.
+        weight of its and lens of its subtrees, for a tree with the given
+        <weight_type>.
         Note: This method is not recursive.
         """
         self._len = sum([len(subtree) for subtree in self.subtrees])
         self._summed_weight = sum([subtree._summed_weight
                                    for subtree in self.subtrees])
-        if self._weight_type == 'sum':
-            self.weight = self._summed_weight
+        self._calculate_max_weight()
+        self._update_weight(weight_type)
 
-        else:  # self._weight_type == 'average'
-            if len(self) == 0:
-                self.weight = 0
-                self._summed_weight = 0
-                return
-
-            self.weight = self._summed_weight / len(self)
+    def _calculate_max_weight(self) -> None:
+        """This recalculates _max_weight and _order for this tree based on
+        its subtrees.
+        Note: This method is not recursive.
+        """
+        if self.subtrees:
+            heaviest = min(self.subtrees, key=_heaviest_first)
+            self._max_weight = heaviest._max_weight
+            self._order = heaviest._order
+        else:
+            self._max_weight = 0.0
 
-    def _fix_subtree_at_index(self, index: int) -> None:
-        """If subtree at index is out of order it fixes that by shifting it
-        left or right
+    def _fix_subtree(self, subtree: _CompressedNode, old_weight: float) -> None:
+        """If <subtree> is out of order it fixes that by moving it left past
+        the lighter subtrees or right past the heavier ones, which are found
+        by binary search.
 
         Precondition:
-        index in range(0, len(self.subtrees))
-        self.subtrees is all sorted except for subtree at index
+        subtree in self.subtrees
+        self.subtrees is all sorted except for subtree, which was in order
+        when its weight was <old_weight>
         """
-        subtree = self.subtrees[index]
-
-        while True:
-            if index > 0 and subtree.weight > self.subtrees[index - 1].weight:
-                # Switch with index to left
-                self.subtrees[index - 1], self.subtrees[index] = \
-                    subtree, self.subtrees[index - 1]
-                index -= 1
-            elif (index < len(self.subtrees) - 1
-                  and subtree.weight < self.subtrees[index + 1].weight):
-                # Switch with index to right
-                self.subtrees[index + 1], self.subtrees[index] = \
-                    subtree, self.subtrees[index + 1]
-                index += 1
-            else:
-                # Current position ok
-                return
+        if subtree.weight == old_weight:
+            return
+        index = _subtree_index(self.subtrees, subtree, old_weight)
+        del self.subtrees[index]
+        if subtree.weight > old_weight:
+            index = _weight_index(self.subtrees, subtree.weight, True, 0,
+                                  index)
+        else:
+            index = _weight_index(self.subtrees, subtree.weight, False,
+                                  index, len(self.subtrees))
+        self.subtrees.insert(index, subtree)
 
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
@@ -835,158 +1182,1596 @@ class CompressedPrefixTree(Autocompleter):
 
         if self.is_leaf():
             return []
-        elif _is_prefix(prefix, self.value):
 
-            return self._get_leaves_greedy(limit)
+        tree = self
+        depth = 0
+        while not _is_prefix(prefix, tree._value, depth, None, tree._end):
+            if not _is_prefix(tree._value, prefix, depth, tree._end):
+                return []
+            depth = tree._end
+            tree = tree._children.get(prefix[depth])
+            if tree is None:
+                return []
 
-        elif _is_prefix(self.value, prefix):
-            for subtree in self.subtrees:
-                if not subtree.is_leaf():
-                    auto = subtree.autocomplete(prefix, limit)
-                    if auto != []:
-                        return auto
-            return []
-        else:
-            return []
+        return tree._get_leaves_greedy(limit)
 
     def _get_leaves_greedy(self, limit: Optional[int]) -> \
             (List[Tuple[Any, float]]):
         """ The return value is a list with a tuple (value, weight)
          for each leaf. This is ordered by non-increasing weight.
-         The list will contain all the leafs found in a greedy search up to
-         limit or all the leafs if limit is None.
+         The list will contain the <limit> leaves with the largest weights,
+         or all the leafs if limit is None.
+        """
+        return _best_first_leaves(self, limit)
+
+    def _advance(self, depth: int, symbol: Any) -> Optional[_CompressedNode]:
+        """Return the tree holding the values whose prefixes continue a
+        prefix of length <depth> matched by self with <symbol>, or None if
+        there are no such values.
+
+        The prefix may end inside self.value, in which case self is returned
+        for as long as <symbol> is the next symbol of self.value.
+
+        Precondition: self is not a leaf, and len(self.value) >= depth.
+        """
+        if depth < self._end:
+            return self if self._value[depth] == symbol else None
+        return self._children.get(symbol)
+
+    def _make_empty(self) -> None:
+        """Make the self an empty subtree"""
+        self.weight = 0
+        self._summed_weight = 0
+        self._max_weight = 0
+        self._len = 0
+        self.subtrees = []
+        self._children = {}
+        self._value = []
+        self._end = 0
+        if self._top is not None:
+            self._top = []
+
+    def _label(self, depth: int) -> List:
+        """Return the symbols that self.value has after the first <depth>,
+        which are the value of its parent.
+
+        Precondition: self has a parent and is not a leaf.
+        """
+        return self._value[depth:self._end]
+
+    def _cow_copy(self) -> _CompressedNode:
+        """Return a copy of this tree that shares its subtrees but not the
+        list and dict holding them, so the copy can be changed without
+        changing this tree.
+        """
+        copy = type(self).__new__(type(self))
+        copy._value = self._value
+        copy._end = self._end
+        copy.weight = self.weight
+        copy._len = self._len
+        copy._summed_weight = self._summed_weight
+        copy._max_weight = self._max_weight
+        copy._order = self._order
+        copy.subtrees = list(self.subtrees)
+        copy._children = None
+        if self._children is not None:
+            copy._children = dict(self._children)
+        copy._top = None if self._top is None else list(self._top)
+        return copy
+
+    def _replace_subtree(self, subtree: _CompressedNode,
+                         copy: _CompressedNode) -> None:
+        """Put <copy>, which was made by subtree._cow_copy(), in the place of
+        <subtree> in self.subtrees and in self._children.
+
+        Precondition: subtree in self.subtrees
+        """
+        self.subtrees[_subtree_index(self.subtrees, subtree,
+                                     subtree.weight)] = copy
+        if not subtree.is_leaf():
+            self._children[copy._value[self._end]] = copy
+
+    def _copy_leaf(self, value: Any) -> None:
+        """Replace the leaf subtree of self storing <value>, if there is one,
+        by a copy of it.
+        """
+        for subtree in self.subtrees:
+            if subtree.is_leaf() and subtree.value == value:
+                self._replace_subtree(subtree, subtree._cow_copy())
+                return
+
+
+class CompressedPrefixTree(_CompressedNode, Autocompleter):
+    """A compressed prefix tree implementation.
+
+    While this class has the same public interface as SimplePrefixTree,
+    (including the initializer!) this version follows the implementation
+    described on Task 6 of the assignment handout, which reduces the number of
+    tree objects used to store values in the tree.
+
+    === Attributes ===
+    value:
+        The value stored at the root of this prefix tree, or [] if this
+        prefix tree is empty. The value of a non-leaf tree is a new list
+        each time it is read, so changing that list in place doesn't
+        change the tree.
+    weight:
+        The weight of this prefix tree. If this tree is a leaf, this attribute
+        stores the weight of the value stored in the leaf. If this tree is
+        not a leaf and non-empty, this attribute stores the *aggregate weight*
+        of the leaf weights in this tree.
+    subtrees:
+        A list of subtrees of this prefix tree.
+
+    === Representation invariants ===
+    - self.weight >= 0
+
+    - (EMPTY TREE):
+        If self.weight == 0, then self.value == [] and self.subtrees == [].
+        This represents an empty simple prefix tree.
+    - (LEAF):
+        If self.subtrees == [] and self.weight > 0, this tree is a leaf.
+        (self.value is a value that was inserted into this tree.)
+    - (NON-EMPTY, NON-LEAF):
+        If len(self.subtrees) > 0, then self.value is a list (*common prefix*),
+        and self.weight > 0 (*aggregate weight*).
+
+    - **NEW**
+      This tree does not contain any compressible internal values.
+      (See the assignment handout for a definition of "compressible".)
+
+    - self.subtrees does not contain any empty prefix trees.
+    - self.subtrees is *sorted* in non-increasing order of their weights.
+      (You can break ties any way you like.)
+      Note that this applies to both leaves and non-leaf subtrees:
+      both can appear in the same self.subtrees list, and both have a `weight`
+      attribute.
+    """
+    value: Optional[Any]
+    weight: float
+    subtrees: List[_CompressedNode]
+
+    # === Private Instance Attributes ===
+    # _weight_type: A string that specifies whether the weight of the
+    # tree will be calculated as the 'sum' or the 'average' of the weights of
+    # each leaf value in the tree. It is only stored here, at the root; the
+    # trees below it are _CompressedNodes, which are given the weight type by
+    # the methods that change them.
+    _weight_type: str
+    # _version: the number of times values have been inserted into or
+    # removed from this tree. A PrefixCursor uses it to tell when the trees
+    # on its path may have changed.
+    _version: int
+    # _top_k: the most leaves kept in the _top of each non-leaf tree, or 0
+    # if they are not kept.
+    _top_k: int
+    __slots__ = ('_weight_type', '_version', '_top_k')
+
+    def __init__(self, weight_type: str) -> None:
+        """Initialize an empty compressed prefix tree.
+
+        Precondition: weight_type == 'sum' or weight_type == 'average'.
+
+        The given <weight_type> value specifies how the aggregate weight
+        of non-leaf trees should be calculated (see the assignment handout
+        for details).
         """
+        _CompressedNode.__init__(self)
+        self._children = {}
+        self._weight_type = weight_type
+        self._version = 0
+        self._top_k = 0
 
+    def merge(self, other: CompressedPrefixTree) -> None:
+        """Add every value in <other> to this tree, with its weight added to
+        the weight of the same value (compare values using ==) if it is
+        already in this tree.
+
+        The trees of <other> are moved into this tree instead of being
+        copied, so <other> must not be used afterwards. Only the trees whose
+        values are a prefix of values in both trees are visited.
+
+        Precondition: every value in both trees has the SAME prefix in both.
+
+        >>> cpt = CompressedPrefixTree('sum')
+        >>> cpt.insert('swell', 75, ['s', 'w', 'e', 'l', 'l'])
+        >>> cpt.insert('swap', 6, ['s', 'w', 'a', 'p'])
+        >>> other = CompressedPrefixTree('sum')
+        >>> other.insert('swap', 70, ['s', 'w', 'a', 'p'])
+        >>> other.insert('cat', 10, ['c', 'a', 't'])
+        >>> cpt.merge(other)
+        >>> print(cpt)
+        [] (161)
+          ['s', 'w'] (151)
+            ['s', 'w', 'a', 'p'] (76)
+              swap (76)
+            ['s', 'w', 'e', 'l', 'l'] (75)
+              swell (75)
+          ['c', 'a', 't'] (10)
+            cat (10)
+        <BLANKLINE>
+        """
+        self._version += 1
+        if other.is_empty():
+            return
         if self.is_empty():
-            return []
-        elif self.is_leaf():
-            # Reached leaf node
-            return [(self.value, self.weight)]
-        else:
-            if limit is None:
-                limit = len(self)
+            self._value = other._value
+            self._end = other._end
+            self.subtrees = other.subtrees
+            self._children = other._children
+            self._calculate_len_weight(self._weight_type)
+            if self._top_k:
+                _keep_top(self, self._top_k)
+            return
+
+        # Each pair is a tree of self and a non-leaf tree of other whose
+        # value starts with the value of the tree of self. touched has the
+        # trees of self whose subtrees change, each before its subtrees.
+        touched = []
+        stack = [(self, other)]
+        while stack:
+            tree, other_tree = stack.pop()
+            touched.append(tree)
+            if not _is_prefix(tree._value, other_tree._value, 0, tree._end,
+                              other_tree._end):
+                tree._split(_share_prefix(tree._value, other_tree._value, 0,
+                                          tree._end, other_tree._end))
+
+            if tree._end < other_tree._end:
+                others = [other_tree]
+            else:  # tree.value == other_tree.value
+                others = other_tree.subtrees
+
+            for subtree in others:
+                if subtree.is_leaf():
+                    for leaf in tree.subtrees:
+                        if leaf.is_leaf() and leaf.value == subtree.value:
+                            leaf.weight += subtree.weight
+                            leaf._summed_weight += subtree._summed_weight
+                            leaf._max_weight += subtree._max_weight
+                            leaf._order = min(leaf._order, subtree._order)
+                            break
+                    else:
+                        tree.subtrees.append(subtree)
+                    continue
+
+                symbol = subtree._value[tree._end]
+                child = tree._children.get(symbol)
+                if child is None:
+                    tree.subtrees.append(subtree)
+                    tree._children[symbol] = subtree
+                else:
+                    stack.append((child, subtree))
+
+        for tree in reversed(touched):
+            tree.subtrees.sort(key=lambda subtree: -subtree.weight)
+            tree._calculate_len_weight(self._weight_type)
+        if self._top_k:
+            # Merged leaves can take a smaller _order, so every _top is
+            # found again rather than updated.
+            _keep_top(self, self._top_k)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a snapshot of this tree that
+        CompressedPrefixTree.from_snapshot turns back into an equal tree.
+
+        The snapshot is a dict of flat lists and arrays, which can be pickled
+        without walking down the tree.
+        """
+        with _gc_paused():
+            return _snapshot(self, 'compressed')
 
-            leaves = []
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any]) -> CompressedPrefixTree:
+        """Return the tree that <snapshot> was taken of, without inserting
+        any of its values.
 
-            # non empty non-leaf case
-            # Here we want to collect up to limit number of leafs
-            for subtree in self.subtrees:
+        Precondition: <snapshot> was returned by CompressedPrefixTree.snapshot.
 
-                if limit <= 0:
-                    break
+        >>> cpt = CompressedPrefixTree('sum')
+        >>> cpt.insert('help', 10.0, ['h', 'e', 'l', 'p'])
+        >>> cpt.insert('hi', 20.0, ['h', 'i'])
+        >>> copy = CompressedPrefixTree.from_snapshot(cpt.snapshot())
+        >>> str(copy) == str(cpt)
+        True
+        """
+        with _gc_paused():
+            return _from_snapshot(cls(snapshot['weight_type']), snapshot)
+
+    @classmethod
+    def bulk_build(cls, weight_type: str,
+                   entries: Iterable[Tuple[Any, float, List]]) \
+            -> CompressedPrefixTree:
+        """Return a new compressed prefix tree with the given <weight_type>
+        that stores every (value, weight, prefix) tuple in <entries>.
+
+        The tree is the same as the one made by inserting each tuple in order
+        into an empty tree, except that subtrees with equal weights may be in
+        a different order. Rather than inserting each value, the values are
+        sorted by prefix and every tree is built once, from the bottom up.
+
+        Preconditions:
+            weight_type == 'sum' or weight_type == 'average'
+            Every weight in <entries> is > 0
+            A value that appears more than once always has the SAME prefix.
+            The elements of the prefixes can be compared with <.
+
+        >>> cpt = CompressedPrefixTree.bulk_build('sum', [
+        ...     ('swell', 75, ['s', 'w', 'e', 'l', 'l']),
+        ...     ('swap', 70, ['s', 'w', 'a', 'p']),
+        ...     ('swap', 6, ['s', 'w', 'a', 'p'])])
+        >>> print(cpt)
+        ['s', 'w'] (151)
+          ['s', 'w', 'a', 'p'] (76)
+            swap (76)
+          ['s', 'w', 'e', 'l', 'l'] (75)
+            swell (75)
+        <BLANKLINE>
+        """
+        tree = cls(weight_type)
+        groups = _group_by_prefix(entries)
+        if not groups:
+            return tree
+
+        # Each tree is built from the groups in groups[start:end], which are
+        # exactly the groups whose prefixes start with its value.
+        trees = []
+        stack = [(tree, 0, len(groups))]
+        while stack:
+            tree, start, end = stack.pop()
+            trees.append(tree)
+            # Every tree on the path to the prefix of its first group shares
+            # that prefix, rather than a copy of it.
+            tree._value = groups[start][0]
+            tree._end = _share_prefix(groups[start][0], groups[end - 1][0])
+            tree._children = {}
+            depth = tree._end
+            if len(groups[start][0]) == depth:
+                for value, weight, order in groups[start][1]:
+                    leaf = _CompressedNode()
+                    leaf.value = value
+                    leaf._len = 1
+                    leaf.weight = weight
+                    leaf._summed_weight = weight
+                    leaf._max_weight = weight
+                    leaf._order = order
+                    tree.subtrees.append(leaf)
+                start += 1
+            while start < end:
+                symbol = groups[start][0][depth]
+                child_end = start + 1
+                while child_end < end and \
+                        groups[child_end][0][depth] == symbol:
+                    child_end += 1
+                subtree = _CompressedNode()
+                tree.subtrees.append(subtree)
+                tree._children[symbol] = subtree
+                stack.append((subtree, start, child_end))
+                start = child_end
+
+        # Every subtree of a tree comes after it in trees.
+        for tree in reversed(trees):
+            tree.subtrees.sort(key=lambda subtree: -subtree.weight)
+            tree._calculate_len_weight(weight_type)
+        return trees[0]
+
+    def freeze(self) -> FrozenPrefixTree:
+        """Return a read-only copy of this tree that gives the same results
+        for autocomplete, but uses far less memory.
+
+        Later changes to this tree do not change the copy.
+
+        >>> cpt = CompressedPrefixTree('sum')
+        >>> cpt.insert('swell', 75.0, ['s', 'w', 'e', 'l', 'l'])
+        >>> cpt.insert('swap', 76.0, ['s', 'w', 'a', 'p'])
+        >>> frozen = cpt.freeze()
+        >>> frozen.autocomplete(['s', 'w'])
+        [('swap', 76.0), ('swell', 75.0)]
+        >>> len(frozen)
+        2
+        """
+        return FrozenPrefixTree(self)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete with <limit> for each of the
+        given prefixes, in the same order as <prefixes>.
+
+        The prefixes are visited in sorted order, so the trees on the path
+        shared by neighbouring prefixes are only found once.
+
+        Precondition: limit is None or limit > 0.
+
+        >>> tree = CompressedPrefixTree('sum')
+        >>> tree.insert('swap', 76, ['s', 'w', 'a', 'p'])
+        >>> tree.insert('swat', 51, ['s', 'w', 'a', 't'])
+        >>> tree.insert('cat', 80, ['c', 'a', 't'])
+        >>> tree.autocomplete_many([['s', 'w', 'a', 't'], [], ['s']], 2)
+        [[('swat', 51)], [('cat', 80), ('swap', 76)], [('swap', 76), \
+('swat', 51)]]
+        """
+        return _autocomplete_many(self, prefixes, limit)
+
+    def fuzzy_autocomplete(self, prefix: List, max_edits: int,
+                           limit: Optional[int] = None) \
+            -> List[Tuple[Any, float, int]]:
+        """Return up to <limit> values whose prefix sequences start with a
+        sequence at most <max_edits> edits away from <prefix>, where an edit
+        inserts, deletes or replaces one symbol.
+
+        The return value is a list of tuples (value, weight, edits), ordered
+        by the fewest edits needed, and then by non-increasing weight.
+
+        If limit is None, return *every* match.
+
+        Preconditions:
+            max_edits >= 0
+            limit is None or limit > 0
+
+        >>> tree = CompressedPrefixTree('sum')
+        >>> tree.insert('hello', 20, list('hello'))
+        >>> tree.insert('help', 10, list('help'))
+        >>> tree.insert('jello', 5, list('jello'))
+        >>> tree.fuzzy_autocomplete(list('hwl'), 1)
+        [('hello', 20, 1), ('help', 10, 1)]
+        >>> tree.fuzzy_autocomplete(list('hwl'), 2, 3)
+        [('hello', 20, 1), ('help', 10, 1), ('jello', 5, 2)]
+        """
+        return _fuzzy_autocomplete(self, prefix, max_edits, limit)
+
+    def keep_top(self, k: int) -> None:
+        """Keep the top <k> matches of every non-leaf tree in this tree, and
+        keep them up to date as values are inserted and removed. If k is 0,
+        stop keeping them.
+
+        Autocomplete with a limit of at most <k> then only has to find the
+        tree matching its prefix, at the cost of a list of up to <k> matches
+        at every non-leaf tree.
+
+        Precondition: k >= 0
+
+        >>> tree = CompressedPrefixTree('sum')
+        >>> tree.insert('swap', 76, ['s', 'w', 'a', 'p'])
+        >>> tree.insert('swat', 51, ['s', 'w', 'a', 't'])
+        >>> tree.keep_top(1)
+        >>> tree.insert('swan', 90, ['s', 'w', 'a', 'n'])
+        >>> tree.autocomplete(['s', 'w'], 1)
+        [('swan', 90)]
+        """
+        _keep_top(self, k)
+
+    def _cow_copy(self) -> CompressedPrefixTree:
+        """Return a copy of this tree that shares its subtrees but not the
+        list and dict holding them, so the copy can be changed without
+        changing this tree.
+        """
+        copy = _CompressedNode._cow_copy(self)
+        copy._weight_type = self._weight_type
+        copy._version = self._version
+        copy._top_k = self._top_k
+        return copy
+
+    def _copy_path(self, prefix: List) -> \
+            Tuple[CompressedPrefixTree, Optional[_CompressedNode]]:
+        """Return a copy of this tree in which each tree on the path down to
+        <prefix> is a copy too, and the copy of the tree whose value is
+        <prefix>, or None if there is no such tree.
+
+        The path ends at the first tree whose value is not a proper prefix
+        of <prefix>, which is the tree that inserting <prefix> would split
+        or removing it would empty. Inserting into or removing <prefix> from
+        the copy only changes the trees on the path, so this tree is left as
+        it was.
+        """
+        root = self._cow_copy()
+        tree = root
+        depth = 0
+        while tree._end < len(prefix) \
+                and _is_prefix(tree._value, prefix, depth, tree._end):
+            depth = tree._end
+            subtree = tree._children.get(prefix[depth])
+            if subtree is None:
+                break
+            copy = subtree._cow_copy()
+            tree._replace_subtree(subtree, copy)
+            tree = copy
+        if tree._end == len(prefix) \
+                and _is_prefix(tree._value, prefix, 0, tree._end):
+            return root, tree
+        return root, None
 
-                new_leaves = subtree._get_leaves_greedy(limit)
-                leaves = _merge_leafs(leaves, new_leaves)
-                # Reduce limit by number of leaves collected
-                limit -= len(new_leaves)
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
 
-            return leaves
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
+        """
+        self._version += 1
+        if self.is_empty():  # Empty Tree case
+            self._value = prefix
+            self._end = len(prefix)
+            leaf = self._add_leaf(value, weight)
+            self._add_weight(1, weight, leaf, self._weight_type)
+            if self._top_k:
+                _add_top(self, leaf, self._top_k)
+            return
+
+        if not _is_prefix(self._value, prefix, 0, self._end):
+            # novel prefix case: the root becomes the shared prefix.
+            self._split(_share_prefix(prefix, self._value, 0, None,
+                                      self._end))
+
+        # Every tree in path has a value that is a prefix of <prefix>.
+        path = [self]
+        tree = self
+        num_added = 1
+        while tree._end < len(prefix):
+            depth = tree._end
+            subtree = tree._children.get(prefix[depth])
+            if subtree is None:
+                # We have failed to find a subtree to go down so we dump the
+                # leaf here
+                leaf = tree._add_depth_2_subtree(value, prefix, weight,
+                                                 self._weight_type)
+                break
+
+            if not _is_prefix(subtree._value, prefix, depth + 1,
+                              subtree._end):
+                # novel prefix case: the subtree shares more than its
+                # parent's value with <prefix>, so it is split there.
+                subtree._split(_share_prefix(prefix, subtree._value,
+                                             depth + 1, None, subtree._end))
+            path.append(subtree)
+            tree = subtree
+        else:
+            # Same prefix case. We know that a leaf already exists or a leaf
+            # should exist here with value <value>.
+            for leaf in tree.subtrees:
+                if leaf.is_leaf() and leaf.value == value:
+                    leaf.weight += weight
+                    leaf._summed_weight += weight
+                    leaf._max_weight += weight
+                    # do not need to increase len since nothing was added
+                    num_added = 0
+                    tree._fix_subtree(leaf, leaf.weight - weight)
+                    break
+            else:
+                # We did not find a subtree to add weight to so we can add a
+                # leaf
+                leaf = tree._add_leaf(value, weight)
+
+        # Walk back up the path, fixing each tree's weight and then its
+        # position in its parent's subtrees.
+        for i in range(len(path) - 1, -1, -1):
+            old_weight = path[i].weight
+            path[i]._add_weight(num_added, weight, leaf, self._weight_type)
+            if self._top_k:
+                _add_top(path[i], leaf, self._top_k)
+            if i > 0:
+                path[i - 1]._fix_subtree(path[i], old_weight)
 
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix."""
-        self._remove_helper(prefix)
+        self._version += 1
+        # Every tree in path has a value that is a proper prefix of <prefix>.
+        path = []
+        tree = self
+        depth = 0
+        while not _is_prefix(prefix, tree._value, depth, None, tree._end):
+            if not _is_prefix(tree._value, prefix, depth, tree._end):
+                return
+            depth = tree._end
+            path.append(tree)
+            tree = tree._children.get(prefix[depth])
+            if tree is None:
+                return
 
-    def _remove_helper(self, prefix: List) -> bool:
-        """Remove all values that match the given prefix. Returns true if
-        successfully removed prefix.
-        """
-        if prefix == []:
-            self._make_empty()
-            return True
-        elif self.is_leaf():
-            return False
-        elif _is_prefix(prefix, self.value):
-            self._make_empty()
-            return True
-        elif _is_prefix(self.value, prefix):
-            for i in range(len(self.subtrees)):
-                subtree = self.subtrees[i]
-                if subtree._remove_helper(prefix):
-                    if subtree.is_empty():
-                        self.subtrees.remove(subtree)
-                        break
-
-            self._calculate_len_weight()
-            if self.is_empty():
-                self._make_empty()
-                return True
-
-            elif len(self.subtrees) == 1 \
-                and not self.subtrees[0].is_leaf():
+        num_removed = len(tree)
+        removed_weight = tree._summed_weight
+        removed_order = tree._order
+        removed_key = _heaviest_first(tree)
+        old_weight = tree.weight
+        tree._make_empty()
+
+        # Walk back up the path, removing the empty subtree and compressing
+        # any tree that is left with a single non-leaf subtree.
+        subtree = tree
+        for tree in reversed(path):
+            if subtree.is_empty():
+                del tree.subtrees[_subtree_index(tree.subtrees, subtree,
+                                                 old_weight)]
+                del tree._children[prefix[tree._end]]
+            else:
+                tree._fix_subtree(subtree, old_weight)
+
+            old_weight = tree.weight
+            tree._remove_weight(num_removed, removed_weight, removed_order,
+                                self._weight_type)
+            if self._top_k:
+                _remove_top(tree, removed_key, self._top_k)
+            if tree.is_empty():
+                tree._make_empty()
+
+            elif len(tree.subtrees) == 1 \
+                    and not tree.subtrees[0].is_leaf():
                 # Promote good z_subtree to replace subtree
-                z_subtree = self.subtrees[0]
-                self.value = z_subtree.value
-                self._len = z_subtree._len
-                self.weight = z_subtree.weight
-                self._summed_weight = z_subtree._summed_weight
-                self.subtrees = z_subtree.subtrees
-                return True
-
-            # self is an incompressible subtree
-            return True
-        return False
+                z_subtree = tree.subtrees[0]
+                tree._value = z_subtree._value
+                tree._end = z_subtree._end
+                tree._len = z_subtree._len
+                tree.weight = z_subtree.weight
+                tree._summed_weight = z_subtree._summed_weight
+                tree._max_weight = z_subtree._max_weight
+                tree._order = z_subtree._order
+                tree.subtrees = z_subtree.subtrees
+                tree._children = z_subtree._children
+                tree._top = z_subtree._top
+            subtree = tree
 
-    def _make_empty(self) -> None:
-        """Make the self an empty subtree"""
-        self.weight = 0
-        self._summed_weight = 0
-        self._len = 0
-        self.subtrees = []
-        self.value = []
+################################################################################
+# PrefixCursor
+################################################################################
 
 
-def _merge_leafs(old_leaves: List, new_leaves: List) -> List:
-    """ Merges two list of already sorted leaves together and returns a new
-    sorted list of leafs contaning all of the
-    elements of old and new_leaves.
+class PrefixCursor:
+    """A prefix of a SimplePrefixTree or CompressedPrefixTree that is typed
+    one symbol at a time. The tree matching each step of it is kept, so
+    that each symbol only moves one step down the tree.
+
+    >>> cpt = CompressedPrefixTree('sum')
+    >>> cpt.insert('swell', 75, ['s', 'w', 'e', 'l', 'l'])
+    >>> cpt.insert('swap', 76, ['s', 'w', 'a', 'p'])
+    >>> cursor = PrefixCursor(cpt)
+    >>> cursor.advance('s')
+    >>> cursor.advance('w')
+    >>> cursor.top()
+    [('swap', 76), ('swell', 75)]
+    >>> cursor.advance('e')
+    >>> cursor.top()
+    [('swell', 75)]
+    >>> cursor.advance('x')
+    >>> cursor.top()
+    []
+    >>> cursor.backspace()
+    >>> cursor.prefix
+    ['s', 'w', 'e']
+
+    === Private Attributes ===
+    _tree:
+        The prefix tree this cursor moves down.
+    _prefix:
+        The symbols typed so far.
+    _path:
+        _path[i] is the tree that holds every value matching _prefix[:i], or
+        None if no value matches it.
+    _version:
+        The _version of _tree when _path was last found.
+
+    === Representation Invariants ===
+    - len(self._path) == len(self._prefix) + 1
+    - If self._path[i] is None, then self._path[j] is None for all j > i.
     """
-    # Based of a portion of merge sort. Algorithm putting two sorted
-    # list together.
-    a = 0
-    b = 0
-    merged_leaves = []
-    while a < len(old_leaves) and b < len(new_leaves):
-        if old_leaves[a][1] >= new_leaves[b][1]:
-            merged_leaves.append(old_leaves[a])
-            a += 1
+    _tree: Any
+    _prefix: List
+    _path: List[Any]
+    _version: int
+
+    def __init__(self, tree: Any) -> None:
+        """Initialize a cursor at the empty prefix of <tree>, which is a
+        SimplePrefixTree or a CompressedPrefixTree.
+        """
+        self._tree = tree
+        self._prefix = []
+        self._path = [None if tree.is_leaf() else tree]
+        self._version = tree._version
+
+    @property
+    def prefix(self) -> List:
+        """Return a copy of the symbols typed so far."""
+        return list(self._prefix)
+
+    def advance(self, symbol: Any) -> None:
+        """Add <symbol> to the end of the prefix typed so far."""
+        self._sync()
+        tree = self._path[-1]
+        if tree is not None:
+            tree = tree._advance(len(self._prefix), symbol)
+        self._prefix.append(symbol)
+        self._path.append(tree)
+
+    def backspace(self) -> None:
+        """Remove the last symbol of the prefix typed so far, if there is
+        one.
+        """
+        if self._prefix:
+            self._prefix.pop()
+            self._path.pop()
+
+    def top(self, limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the prefix typed so far, in the
+        same order as autocomplete on the tree.
+
+        If limit is None, return *every* match for the prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        self._sync()
+        tree = self._path[-1]
+        if tree is None:
+            return []
+        return tree._get_leaves_greedy(limit)
+
+    def _sync(self) -> None:
+        """Find the trees on the path of the prefix again, if values have
+        been inserted into or removed from the tree since they were found.
+        """
+        if self._version == self._tree._version:
+            return
+        prefix = self._prefix
+        self._prefix = []
+        self._path = [None if self._tree.is_leaf() else self._tree]
+        self._version = self._tree._version
+        for symbol in prefix:
+            self.advance(symbol)
+
+
+################################################################################
+# ConcurrentAutocompleter
+################################################################################
+
+
+class ConcurrentAutocompleter(Autocompleter):
+    """A SimplePrefixTree or CompressedPrefixTree that can be read by any
+    number of threads while another thread inserts into or removes from it.
+
+    Each insert or remove copies the trees it would change, changes the
+    copies, and then publishes the new version of the tree by assigning it
+    to self.tree. A read takes self.tree once and reads it without locking,
+    so it sees the tree as it was either before or after each write, never
+    part way through one. Writes take turns.
+
+    >>> ca = ConcurrentAutocompleter(CompressedPrefixTree('sum'))
+    >>> ca.insert('swap', 76, ['s', 'w', 'a', 'p'])
+    >>> before = ca.tree
+    >>> ca.insert('swat', 51, ['s', 'w', 'a', 't'])
+    >>> ca.autocomplete(['s', 'w'])
+    [('swap', 76), ('swat', 51)]
+    >>> before.autocomplete(['s', 'w'])
+    [('swap', 76)]
+
+    === Attributes ===
+    tree:
+        The latest version of the prefix tree. A version is never changed
+        once it has been published here.
+
+    === Private Attributes ===
+    _write_lock:
+        Held while a version is built, so that writes happen one at a time.
+    """
+    tree: Any
+    _write_lock: threading.Lock
+
+    def __init__(self, tree: Any) -> None:
+        """Initialize an autocompleter whose first version is <tree>, which
+        is a SimplePrefixTree or a CompressedPrefixTree.
+
+        <tree> must not be changed directly afterwards.
+        """
+        self.tree = tree
+        self._write_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return len(self.tree)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter, by publishing a
+        new version of the tree with it inserted.
+
+        The value is inserted with the given weight, and is associated with
+        the prefix sequence <prefix>.
+
+        If the value has already been inserted into this prefix tree
+        (compare values using ==), then the given weight should be *added* to
+        the existing weight of this value.
+
+        Preconditions:
+            weight > 0
+            The given value is either:
+                1) not in this Autocompleter
+                2) was previously inserted with the SAME prefix sequence
+        """
+        with self._write_lock:
+            tree, end = self.tree._copy_path(prefix)
+            if end is not None:
+                end._copy_leaf(value)
+            tree.insert(value, weight, prefix)
+            self.tree = tree
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix, from the latest
+        version of the tree.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self.tree.autocomplete(prefix, limit)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the result of autocomplete with <limit> for each of the
+        given prefixes, in the same order as <prefixes>, all from the same
+        version of the tree.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self.tree.autocomplete_many(prefixes, limit)
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix, by publishing a
+        new version of the tree without them.
+        """
+        with self._write_lock:
+            tree, _ = self.tree._copy_path(prefix)
+            tree.remove(prefix)
+            self.tree = tree
+
+
+################################################################################
+# FrozenPrefixTree
+################################################################################
+
+
+class FrozenPrefixTree(Autocompleter):
+    """A read-only compressed prefix tree, stored in flat arrays.
+
+    The trees of a CompressedPrefixTree are numbered in breadth-first order,
+    so the subtrees of each tree get consecutive numbers. Every tree is then
+    described by a few numbers at its position in each array instead of by an
+    object, and autocomplete returns the same results as the tree it was
+    frozen from, with each weight as a float.
+
+    Values can't be inserted into or removed from a FrozenPrefixTree.
+    """
+    # === Private Instance Attributes ===
+    # _len: the number of values stored in the tree.
+    _len: int
+    # _labels: the edge label of every tree, one after the other. The edge
+    # label of a non-leaf tree is the part of its value that its parent's
+    # value doesn't have; the root's edge label is its whole value, and
+    # leaves have empty edge labels.
+    _labels: List
+    # _label_starts: the edge label of tree i is
+    # _labels[_label_starts[i]:_label_starts[i + 1]].
+    _label_starts: array
+    # _child_starts: the subtrees of tree i are the trees numbered
+    # _child_starts[i] up to but not including _child_starts[i + 1], ordered
+    # by _heaviest_first rather than by weight.
+    _child_starts: array
+    # _first_symbols, _first_children: the first symbol of the edge label of
+    # each non-leaf subtree, and its number. Those of the subtrees of tree i
+    # are at _first_starts[i] up to but not including _first_starts[i + 1],
+    # sorted by symbol, so the subtree for a symbol is found by binary
+    # search. _first_sorted is False if the symbols couldn't be compared,
+    # in which case they are in the order of the subtrees.
+    _first_symbols: List
+    _first_children: array
+    _first_starts: array
+    _first_sorted: bool
+    # _max_weights, _orders: the _max_weight and _order of each tree.
+    _max_weights: array
+    _orders: array
+    # _value_ids: the index in _values of the value of each leaf, or -1 for
+    # trees that aren't leaves.
+    _value_ids: array
+    # _values, _weights: the value and weight of each leaf.
+    _values: List
+    _weights: array
+    __slots__ = ('_len', '_labels', '_label_starts', '_child_starts',
+                 '_first_symbols', '_first_children', '_first_starts',
+                 '_first_sorted', '_max_weights', '_orders', '_value_ids',
+                 '_values', '_weights')
+
+    def __init__(self, tree: CompressedPrefixTree) -> None:
+        """Initialize a frozen copy of the compressed prefix tree <tree>."""
+        self._len = len(tree)
+        self._labels = []
+        self._label_starts = array('q', [0])
+        self._child_starts = array('q')
+        self._first_symbols = []
+        self._first_children = array('q')
+        self._first_starts = array('q', [0])
+        self._first_sorted = True
+        self._max_weights = array('d')
+        self._orders = array('q')
+        self._value_ids = array('q')
+        self._values = []
+        self._weights = array('d')
+
+        # trees[i] is tree number i, and parent_lens[i] is the length of its
+        # parent's value.
+        trees = [tree]
+        parent_lens = [0]
+        i = 0
+        while i < len(trees):
+            tree = trees[i]
+            self._child_starts.append(len(trees))
+            if tree.is_leaf():
+                self._value_ids.append(len(self._values))
+                self._values.append(tree.value)
+                self._weights.append(tree.weight)
+            else:
+                self._value_ids.append(-1)
+                self._labels.extend(tree._value[parent_lens[i]:tree._end])
+                firsts = []
+                for subtree in sorted(tree.subtrees, key=_heaviest_first):
+                    if not subtree.is_leaf():
+                        firsts.append((subtree._value[tree._end], len(trees)))
+                    trees.append(subtree)
+                    parent_lens.append(tree._end)
+                self._add_first_symbols(firsts)
+            self._first_starts.append(len(self._first_symbols))
+            self._label_starts.append(len(self._labels))
+            self._max_weights.append(tree._max_weight)
+            self._orders.append(tree._order)
+            i += 1
+        self._child_starts.append(len(trees))
+
+    def _add_first_symbols(self, firsts: List[Tuple[Any, int]]) -> None:
+        """Add the (first symbol, subtree number) pairs <firsts> of the
+        non-leaf subtrees of one tree to _first_symbols and _first_children,
+        sorted by symbol if the symbols can be compared.
+        """
+        if self._first_sorted:
+            try:
+                # The first symbols of siblings are distinct, so the subtree
+                # numbers are never compared.
+                firsts.sort()
+            except TypeError:
+                # The earlier trees' symbols were sorted, but they're only
+                # searched once _first_sorted is known for the whole tree.
+                self._first_sorted = False
+        for symbol, child in firsts:
+            self._first_symbols.append(symbol)
+            self._first_children.append(child)
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return self._len
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Raise a TypeError, since a FrozenPrefixTree is read-only."""
+        raise TypeError('a FrozenPrefixTree is read-only')
+
+    def remove(self, prefix: List) -> None:
+        """Raise a TypeError, since a FrozenPrefixTree is read-only."""
+        raise TypeError('a FrozenPrefixTree is read-only')
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        if self._len == 0:
+            return []
+        if not isinstance(prefix, list):
+            # _labels is a list, and a slice of it is only equal to a slice
+            # of another list, even if the prefixes were arrays or tuples.
+            prefix = list(prefix)
+
+        tree = 0
+        depth = 0
+        while True:
+            start = self._label_starts[tree]
+            end = self._label_starts[tree + 1]
+            length = min(end - start, len(prefix) - depth)
+            if self._labels[start:start + length] != \
+                    prefix[depth:depth + length]:
+                return []
+            depth += end - start
+            if depth >= len(prefix):
+                return self._best_first_leaves(tree, limit)
+            tree = self._find_child(tree, prefix[depth])
+            if tree == -1:
+                return []
+
+    def _find_child(self, tree: int, symbol: Any) -> int:
+        """Return the number of the non-leaf subtree of tree number <tree>
+        whose edge label starts with <symbol>, or -1 if there is none.
+        """
+        symbols = self._first_symbols
+        lo = self._first_starts[tree]
+        hi = self._first_starts[tree + 1]
+        if self._first_sorted:
+            try:
+                i = bisect.bisect_left(symbols, symbol, lo, hi)
+            except TypeError:
+                # <symbol> can't be compared with the first symbols, so it
+                # isn't equal to any of them.
+                return -1
+            if i < hi and symbols[i] == symbol:
+                return self._first_children[i]
+            return -1
+        for i in range(lo, hi):
+            if symbols[i] == symbol:
+                return self._first_children[i]
+        return -1
+
+    def _best_first_leaves(self, tree: int, limit: Optional[int]) -> \
+            List[Tuple[Any, float]]:
+        """Return a (value, weight) tuple for each of the <limit> leaves of
+        tree number <tree> with the largest weights, ordered by non-increasing
+        weight. Return every leaf if limit is None.
+
+        This visits trees in the same order as the module-level
+        _best_first_leaves, so the leaves are found in the same order. Since
+        subtrees are already ordered by _heaviest_first, a tree is only pushed
+        onto the heap once the sibling before it has been visited, so each
+        visit pushes at most two trees however many subtrees there are.
+        """
+        max_weights = self._max_weights
+        orders = self._orders
+        child_starts = self._child_starts
+        value_ids = self._value_ids
+        leaves = []
+        # Each entry holds a tree and the number after its last sibling. Tree
+        # numbers are unique, so they break ties between a tree and its
+        # heaviest leaf.
+        heap = [(-max_weights[tree], orders[tree], tree, tree + 1)]
+        while heap and (limit is None or len(leaves) < limit):
+            _, _, tree, siblings_end = heapq.heappop(heap)
+            sibling = tree + 1
+            if sibling < siblings_end:
+                heapq.heappush(heap, (-max_weights[sibling], orders[sibling],
+                                      sibling, siblings_end))
+            value_id = value_ids[tree]
+            if value_id != -1:
+                leaves.append((self._values[value_id],
+                               self._weights[value_id]))
+            else:
+                child = child_starts[tree]
+                heapq.heappush(heap, (-max_weights[child], orders[child],
+                                      child, child_starts[tree + 1]))
+        return leaves
+
+
+def _best_first_leaves(tree: Any, limit: Optional[int]) -> \
+        List[Tuple[Any, float]]:
+    """Return a (value, weight) tuple for each of the <limit> leaves of <tree>
+    with the largest weights, ordered by non-increasing weight. Return every
+    leaf if limit is None.
+
+    Trees are visited in non-increasing order of their _max_weight, so a leaf
+    is only reached once every heavier leaf has been found, and the search
+    stops as soon as it has <limit> leaves. Leaves with equal weights are
+    returned in the order their values were first inserted, which does not
+    depend on the shape of <tree>.
+
+    If <tree> keeps its top matches and they are enough for <limit>, they
+    are returned without searching.
+    """
+    top = tree._top
+    if top is not None and \
+            (limit is not None and limit <= len(top) or len(top) == len(tree)):
+        return [(value, -weight) for weight, _, value in top[:limit]]
+    if tree.is_empty():
+        return []
+    if limit is None:
+        limit = len(tree)
+
+    leaves = []
+    # A tree and its heaviest leaf have the same key, so the counter breaks
+    # those ties and trees are never compared with each other.
+    heap = [(-tree._max_weight, tree._order, 0, tree)]
+    count = 1
+    while heap and len(leaves) < limit:
+        tree = heapq.heappop(heap)[3]
+        if tree.is_leaf():
+            leaves.append((tree.value, tree.weight))
         else:
-            merged_leaves.append(new_leaves[b])
-            b += 1
-    while a < len(old_leaves):
-        merged_leaves.append(old_leaves[a])
-        a += 1
-    while b < len(new_leaves):
-        merged_leaves.append(new_leaves[b])
-        b += 1
+            for subtree in tree.subtrees:
+                heapq.heappush(heap, (-subtree._max_weight, subtree._order,
+                                      count, subtree))
+                count += 1
+
+    return leaves
+
 
-    return merged_leaves
+def _autocomplete_many(tree: Any, prefixes: List[List],
+                       limit: Optional[int]) -> List[List[Tuple[Any, float]]]:
+    """Return the result of autocomplete with <limit> for each of the
+    <prefixes> of the SimplePrefixTree or CompressedPrefixTree <tree>, in
+    the same order as <prefixes>.
+
+    A PrefixCursor visits the prefixes in sorted order, only backing up to
+    the symbols each prefix shares with the one before it. Prefixes that end
+    at the same tree, such as those ending inside the value of one tree in a
+    CompressedPrefixTree, share one search for their matches.
+    """
+    try:
+        order = sorted(range(len(prefixes)), key=prefixes.__getitem__)
+    except TypeError:
+        # The symbols can't be compared, so there is no order that groups
+        # prefixes by the symbols they start with.
+        order = range(len(prefixes))
+
+    results = [None] * len(prefixes)
+    cursor = PrefixCursor(tree)
+    current = []
+    last_tree = None
+    last_results = []
+    for i in order:
+        prefix = prefixes[i]
+        shared = 0
+        while shared < len(current) and shared < len(prefix) \
+                and current[shared] == prefix[shared]:
+            shared += 1
+        for _ in range(len(current) - shared):
+            cursor.backspace()
+        for symbol in prefix[shared:]:
+            cursor.advance(symbol)
+        current = prefix
+
+        if cursor._path[-1] is not last_tree or last_tree is None:
+            last_tree = cursor._path[-1]
+            last_results = cursor.top(limit)
+        # Each prefix gets its own list, so changing one result doesn't
+        # change the others.
+        results[i] = list(last_results)
+    return results
+
+
+def _fuzzy_autocomplete(tree: Any, prefix: List, max_edits: int,
+                        limit: Optional[int]) -> List[Tuple[Any, float, int]]:
+    """Return the result of fuzzy_autocomplete with <prefix>, <max_edits> and
+    <limit> on the SimplePrefixTree or CompressedPrefixTree <tree>.
+
+    The trees are walked with the row of edit distances from each prefix of
+    <prefix> to the symbols on the path down to them, which is updated once
+    per symbol. A tree is matched with the fewest edits from <prefix> to a
+    prefix of its value, and its subtrees are only walked while they could
+    be matched with fewer edits than that, so the walk stops as soon as a
+    tree is more than <max_edits> edits away from every prefix of <prefix>.
+    The leaves below the matched trees are then found best-first, for each
+    number of edits in turn.
+    """
+    if tree.is_empty():
+        return []
+
+    # matched has each matched tree and its edits, if a tree above it isn't
+    # matched with as few edits. Its leaves that aren't below a tree matched
+    # with fewer edits have those edits.
+    matched = {}
+    # Each tree on the stack is walked with the length of its parent's value,
+    # the row for that value, and the edits its parent was matched with, or
+    # max_edits + 1 if it wasn't.
+    stack = [(tree, 0, list(range(len(prefix) + 1)), max_edits + 1)]
+    while stack:
+        tree, depth, row, best = stack.pop()
+        label = tree.value if depth == 0 else tree._label(depth)
+        edits = min(best, row[-1])
+        for symbol in label:
+            next_row = [row[0] + 1]
+            for j in range(1, len(row)):
+                next_row.append(min(row[j] + 1, next_row[j - 1] + 1,
+                                    row[j - 1] + (prefix[j - 1] != symbol)))
+            row = next_row
+            edits = min(edits, row[-1])
+            if min(row) >= edits:
+                break
+        if edits < best:
+            matched[tree] = edits
+        if min(row) < edits:
+            depth += len(label)
+            for subtree in tree.subtrees:
+                if not subtree.is_leaf():
+                    stack.append((subtree, depth, row, edits))
+
+    roots = [[] for _ in range(max_edits + 1)]
+    for tree, edits in matched.items():
+        roots[edits].append(tree)
+    results = []
+    for edits in range(max_edits + 1):
+        # The same order as _best_first_leaves, from every tree matched
+        # with <edits> at once.
+        heap = [(-tree._max_weight, tree._order, i, tree)
+                for i, tree in enumerate(roots[edits])]
+        heapq.heapify(heap)
+        count = len(heap)
+        while heap and (limit is None or len(results) < limit):
+            tree = heapq.heappop(heap)[3]
+            if tree.is_leaf():
+                results.append((tree.value, tree.weight, edits))
+                continue
+            for subtree in tree.subtrees:
+                if subtree not in matched:
+                    heapq.heappush(heap, (-subtree._max_weight,
+                                          subtree._order, count, subtree))
+                    count += 1
+    return results
+
+
+def _group_by_prefix(entries: Iterable[Tuple[Any, float, List]]) \
+        -> List[Tuple[List, List[Tuple[Any, float, int]]]]:
+    """Return a (prefix, values) tuple for each distinct prefix in the
+    (value, weight, prefix) tuples <entries>, sorted by prefix.
+
+    values is a list of (value, weight, order) tuples, one for each distinct
+    value with that prefix. weight is the sum of the weights the value
+    appears with, and order is the _order its leaf is given, in the order
+    the values first appear in <entries>.
+    """
+    # The prefix, value, total weight and order of each distinct value, and
+    # the index in found of each hashable value. Equal values have equal
+    # prefixes, so each unhashable value is only compared with the
+    # unhashable values that have the same prefix.
+    found = []
+    positions = {}
+    unhashable = {}
+    for value, weight, prefix in entries:
+        try:
+            i = positions.setdefault(value, len(found))
+        except TypeError:
+            same_prefix = unhashable.setdefault(tuple(prefix), [])
+            i = len(found)
+            for j in same_prefix:
+                if found[j][1] == value:
+                    i = j
+                    break
+            else:
+                same_prefix.append(i)
+
+        if i == len(found):
+            found.append([prefix, value, weight, next(_insertion_order)])
+        else:
+            found[i][2] += weight
+
+    groups = []
+    for prefix, value, weight, order in sorted(found,
+                                               key=lambda item: item[0]):
+        entry = (value, weight, order)
+        if groups and groups[-1][0] == prefix:
+            groups[-1][1].append(entry)
+        else:
+            groups.append((prefix, [entry]))
+    return groups
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """Pause the cyclic garbage collector while the with block runs.
+
+    Taking or restoring a snapshot allocates an object or more for every
+    tree, which would otherwise start a collection over and over even
+    though none of them are garbage.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _snapshot(root: Any, kind: str) -> Dict[str, Any]:
+    """Return a snapshot of the prefix tree <root>, which is a SimplePrefixTree
+    if <kind> is 'simple', and a CompressedPrefixTree if it is 'compressed'.
+
+    The trees are numbered in breadth-first order, so the subtrees of tree i
+    are the next child_counts[i] trees that haven't been given a parent yet.
+    Each tree has the part of its value that its parent's value doesn't have
+    in labels, and each leaf has its value in values. Each _order is stored
+    as its rank among the _orders of the leaves.
+    """
+    child_counts = array('I')
+    label_lens = array('I')
+    labels = []
+    lens = array('I')
+    weights = array('d')
+    summed_weights = array('d')
+    max_weights = array('d')
+    leaf_orders = []
+    values = []
+    # trees[i] is tree number i, and parent_lens[i] is the length of its
+    # parent's value. The trees of a simple prefix tree don't store their
+    # values, so their labels are their symbols.
+    trees = [root]
+    parent_lens = [0]
+    for i, tree in enumerate(trees):
+        subtrees = tree.subtrees
+        if not subtrees and i > 0:
+            label_lens.append(0)
+            values.append(tree.value)
+            leaf_orders.append(tree._order)
+        elif i == 0 and kind == 'simple':
+            label_lens.append(0)
+        elif kind == 'simple':
+            labels.append(tree._symbol)
+            label_lens.append(1)
+        else:  # kind == 'compressed'
+            labels.extend(tree._value[parent_lens[i]:tree._end])
+            label_lens.append(tree._end - parent_lens[i])
+            parent_lens.extend([tree._end] * len(subtrees))
+        child_counts.append(len(subtrees))
+        lens.append(tree._len)
+        weights.append(tree.weight)
+        summed_weights.append(tree._summed_weight)
+        max_weights.append(tree._max_weight)
+        trees.extend(subtrees)
+
+    leaf_orders.sort()
+    ranks = dict(zip(leaf_orders, range(len(leaf_orders))))
+    # The _order of an empty root is not the _order of any leaf.
+    orders = array('I', [ranks.get(tree._order, 0) for tree in trees])
+    return {
+        'kind': kind,
+        'weight_type': root._weight_type,
+        'top_k': root._top_k,
+        'child_counts': child_counts,
+        'label_lens': label_lens,
+        'labels': labels,
+        'lens': lens,
+        'weights': weights,
+        'summed_weights': summed_weights,
+        'max_weights': max_weights,
+        'orders': orders,
+        'values': values
+    }
+
+
+def _from_snapshot(root: Any, snapshot: Dict[str, Any]) -> Any:
+    """Rebuild the tree that <snapshot> was taken of in the empty prefix tree
+    <root>, and return <root>.
+
+    Every tree is made once, directly in its place in its parent's subtrees,
+    with the lengths and weights in the snapshot. The leaves get new _orders
+    in the same relative order as the ones they had when the snapshot was
+    taken.
+    """
+    global _insertion_order
+    simple = snapshot['kind'] == 'simple'
+    node_class = _SimpleNode if simple else _CompressedNode
+    labels = snapshot['labels']
+    child_counts = snapshot['child_counts']
+    label_lens = snapshot['label_lens']
+    lens = snapshot['lens']
+    weights = snapshot['weights']
+    summed_weights = snapshot['summed_weights']
+    max_weights = snapshot['max_weights']
+    orders = snapshot['orders']
+    values = iter(snapshot['values'])
+    # Leaf ranks go from 0 to len(values) - 1, so this reserves an _order
+    # for each of them.
+    first_order = next(_insertion_order)
+    _insertion_order = itertools.count(first_order +
+                                       len(snapshot['values']))
+
+    # trees[i] is tree number i, and parents[i] is its parent.
+    trees = [root]
+    parents = [None]
+    label_start = 0
+    for i, tree in enumerate(trees):
+        parent = parents[i]
+        child_count = child_counts[i]
+        label_end = label_start + label_lens[i]
+        if i == 0:
+            if not simple:
+                tree._value = labels[:label_end]
+                tree._end = label_end
+        elif child_count == 0:
+            tree.value = next(values)
+            if simple:
+                parent._add_leaf_index(tree)
+        elif simple:
+            tree._symbol = labels[label_start]
+            tree._parent = parent
+            tree._children = {}
+            parent._children[tree._symbol] = tree
+        else:
+            # The first non-leaf subtree of each tree extends the prefix of
+            # its parent, which only uses its first _end elements, and the
+            # others copy the part of it they share.
+            key = parent._value
+            if len(key) == parent._end:
+                key.extend(labels[label_start:label_end])
+            else:
+                key = key[:parent._end] + labels[label_start:label_end]
+            tree._value = key
+            tree._end = len(key)
+            tree._children = {}
+            parent._children[labels[label_start]] = tree
+        label_start = label_end
+        tree._len = lens[i]
+        tree.weight = weights[i]
+        tree._summed_weight = summed_weights[i]
+        tree._max_weight = max_weights[i]
+        tree._order = first_order + orders[i]
+
+        if child_count > 0:
+            subtrees = [node_class() for _ in range(child_count)]
+            tree.subtrees = subtrees
+            trees.extend(subtrees)
+            parents.extend([tree] * child_count)
+    if snapshot.get('top_k', 0) > 0:
+        _keep_top(root, snapshot['top_k'])
+    return root
+
+
+def _subtree_index(subtrees: List, subtree: Any, weight: float) -> int:
+    """Return the index of <subtree> in <subtrees>.
+
+    Precondition: <subtrees> would be sorted in non-increasing order of weight
+    if the weight of <subtree> were <weight>.
+
+    A binary search narrows <subtrees> down to the trees with the same weight
+    as <subtree>, and only those are compared with <subtree>.
+    """
+    lo = 0
+    hi = len(subtrees)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if subtrees[mid] is subtree:
+            return mid
+        elif subtrees[mid].weight > weight:
+            lo = mid + 1
+        elif subtrees[mid].weight < weight:
+            hi = mid
+        else:
+            break
+    # Subtrees do not define __eq__, so this compares by identity.
+    return subtrees.index(subtree, lo, hi)
 
 
-def _share_prefix(a: list, b: list) -> List:
-    """ If there is a common prefix amongst <a> and <b>,.
+def _weight_index(subtrees: List, weight: float, after_equal: bool,
+                  lo: int, hi: int) -> int:
+    """Return the index in <subtrees>[lo:hi], which is sorted in
+    non-increasing order of weight, at which a tree with <weight> belongs.
+
+    The index is after every tree with the same weight if <after_equal>, and
+    before them otherwise.
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if subtrees[mid].weight > weight or \
+                (after_equal and subtrees[mid].weight == weight):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _heaviest_first(tree: Any) -> Tuple[float, int]:
+    """Return the key that orders trees the way autocomplete visits them:
+    by non-increasing _max_weight, then by _order.
+    """
+    return -tree._max_weight, tree._order
+
+
+def _top_entry(leaf: Any) -> Tuple[float, int, Any]:
+    """Return the entry for <leaf> in the _top of the trees above it, which
+    sorts the way autocomplete orders leaves.
+    """
+    return -leaf.weight, leaf._order, leaf.value
+
+
+def _keep_top(root: Any, k: int) -> None:
+    """Find the _top of every non-leaf tree in the prefix tree <root>, with
+    at most <k> leaves in each, or remove them if k is 0.
+    """
+    if k == 0 and root._top_k == 0:
+        return
+    root._top_k = k
+    trees = [root]
+    for tree in trees:
+        trees.extend(subtree for subtree in tree.subtrees
+                     if not subtree.is_leaf())
+    # Every subtree of a tree comes after it in trees.
+    for tree in reversed(trees):
+        if k > 0:
+            _calculate_top(tree, k)
+        else:
+            tree._top = None
+
+
+def _calculate_top(tree: Any, k: int) -> None:
+    """Find the _top of the non-leaf <tree> from the _tops of its subtrees,
+    with at most <k> leaves in it.
+    """
+    tops = [[_top_entry(subtree)] if subtree.is_leaf() else subtree._top
+            for subtree in tree.subtrees]
+    tree._top = list(itertools.islice(heapq.merge(*tops), k))
+
+
+def _add_top(tree: Any, leaf: Any, k: int) -> None:
+    """Update the _top of <tree>, which has at most <k> leaves in it, after
+    <leaf> was added below <tree> or had its weight increased.
+    """
+    top = tree._top
+    for i in range(len(top)):
+        if top[i][1] == leaf._order:
+            del top[i]
+            break
+    entry = _top_entry(leaf)
+    if len(top) < k or entry < top[-1]:
+        bisect.insort(top, entry)
+        del top[k:]
+
+
+def _remove_top(tree: Any, removed: Tuple[float, int], k: int) -> None:
+    """Update the _top of <tree>, which has at most <k> leaves in it, after
+    leaves were removed from below it, the first of which in autocomplete
+    order had the _heaviest_first key <removed>.
+
+    The _top is only found again if it held one of the removed leaves.
+    """
+    top = tree._top
+    if len(top) == k and removed > top[-1][:2]:
+        return
+    _calculate_top(tree, k)
+
+
+def _share_prefix(a: list, b: list, start: int = 0,
+                  a_end: Optional[int] = None,
+                  b_end: Optional[int] = None) -> int:
+    """ Return the length of the longest common prefix of <a> and <b>.
+
+    Only the first <a_end> elements of <a> and the first <b_end> elements of
+    <b> are looked at, or all of them if that is None. The first <start>
+    elements of <a> and <b> are assumed to be equal.
 
     >>> _share_prefix([0, 1, 2, 3], [0, 1, 2, 5, 7, 9])
-    [0, 1, 2]
+    3
     >>> _share_prefix([0, 1, 2, 5, 7, 9], [0, 1, 2, 3])
-    [0, 1, 2]
+    3
+    >>> _share_prefix([0, 1, 2, 5, 7, 9], [0, 1, 2, 5], 0, 3)
+    3
     """
-    if len(a) >= len(b):
-        long = a
-        short = b
-    else:
-        long = b
-        short = a
+    end = min(len(a) if a_end is None else a_end,
+              len(b) if b_end is None else b_end)
+    if a is b or type(a) is type(b) and a[start:end] == b[start:end]:
+        return end
+    for i in range(start, end):
+        if a[i] != b[i]:
+            return i
 
-    for i in range(len(short)):
-        if short[i] != long[i]:
-            return short[:i]
+    return end
 
-    return short[:]
 
-
-def _is_prefix(prefix: Any, items: Any) -> bool:
+def _is_prefix(prefix: Any, items: Any, start: int = 0,
+               prefix_end: Optional[int] = None,
+               items_end: Optional[int] = None) -> bool:
     """ If <prefix> is a prefix of <items>, return True.
     Otherwise, return False.
+
+    Only the first <prefix_end> elements of <prefix> and the first
+    <items_end> elements of <items> are looked at, or all of them if that is
+    None, so the prefix of a compressed tree can be compared without a copy.
+    The first <start> elements of <prefix> and <items> are assumed to be
+    equal, so only the elements after them are compared.
     Pre-condition: <prefix> and <items> are iterable
     >>> _is_prefix(['b', 'l', 'a'], ['b', 'l', 'a'])
     True
@@ -994,12 +2779,22 @@ def _is_prefix(prefix: Any, items: Any) -> bool:
     True
     >>> _is_prefix(['b', 'l', 'a'], ['b', 'l', 'd'])
     False
+    >>> _is_prefix(['b', 'l', 'a', 'c', 'k'], ['b', 'l', 'd'], 0, 2)
+    True
     """
-    if len(prefix) > len(items):
+    if prefix_end is None:
+        prefix_end = len(prefix)
+    if prefix_end > (len(items) if items_end is None else items_end):
         return False
 
-    for p, i in zip(prefix, items):
-        if p != i:
+    if prefix is items:
+        return True
+    if type(prefix) is type(items):
+        # Slices of two lists are compared in one step. A list slice is never
+        # equal to a tuple slice, so this needs both to be the same type.
+        return prefix[start:prefix_end] == items[start:prefix_end]
+    for i in range(start, prefix_end):
+        if prefix[i] != items[i]:
             return False
     return True
 
@@ -26,8 +26,8 @@ def test_get_leafs_greedy():
                                          ('heart', 50), ('heat', 47),
                                          ('heap', 46), ('heal', 45),
                                          ('hell', 20), ('help', 10)]
-    assert spt._get_leaves_greedy(3) == [('heart', 50), ('heat', 47),
-                                         ('heap', 46)]
+    assert spt._get_leaves_greedy(3) == [('he', 109), ('hello', 80),
+                                         ('heart', 50)]
     assert spt.subtrees[0].subtrees[0].subtrees[1]._get_leaves_greedy(None) == \
            [('hello', 80), ('hell', 20), ('help', 10)]
 
@@ -220,6 +220,36 @@ def test_melody() -> None:
                     assert m1[i][0].notes == m2[i][0].notes
                     assert m1[i][1] == m2[i][1]
 
+def test_melody_notes_are_packed() -> None:
+    from array import array
+    engine = MelodyAutocompleteEngine({'file': 'data/songbook.csv',
+                                       'autocompleter': 'compressed',
+                                       'weight_type': 'sum'})
+    with open('data/songbook.csv', encoding='utf8') as f:
+        rows = {line.split(',')[0]: line.strip().split(',')[1:]
+                for line in f}
+    melodies = engine.autocomplete([])
+    assert len(melodies) == len(rows)
+    for melody, weight in melodies:
+        assert isinstance(melody, Melody)
+        assert weight == 1
+        numbers = [int(x) for x in rows[melody.name] if x != '']
+        assert melody.notes == list(zip(numbers[0::2], numbers[1::2]))
+        intervals = [b[0] - a[0] for a, b in zip(melody.notes,
+                                                   melody.notes[1:])]
+        assert (melody, 1) in engine.autocomplete(intervals)
+        # The notes are kept as one array of pitches and one of durations,
+        # not as a tuple for each note.
+        assert set(vars(melody)) == {'name', '_pitches', '_durations'}
+        assert isinstance(melody._pitches, array)
+        assert melody._pitches.typecode == 'B'
+        assert isinstance(melody._durations, array)
+        assert melody._durations.typecode in 'BH'
+    melody.notes = [(60, 70000), (61, 10)]
+    assert melody.notes == [(60, 70000), (61, 10)]
+    assert (melody._pitches.typecode, melody._durations.typecode) == \
+        ('B', 'I')
+
 def test_autocomplete() -> None:
     spt = SimplePrefixTree("sum")
     spt.insert('hello', 80, ['h', 'e', 'l', 'l', 'o'])
@@ -242,6 +272,638 @@ def test_autocomplete() -> None:
                                                  ('heap', 46), ('heal', 45)]
     assert spt.autocomplete(['n', 'o', 'n', 'e']) == []
 
+def test_average_autocomplete_is_exact() -> None:
+    for tree in [SimplePrefixTree('average'), CompressedPrefixTree('average')]:
+        tree.insert('cat', 1, ['c', 'a', 't'])
+        tree.insert('car', 1, ['c', 'a', 'r'])
+        tree.insert('cab', 1, ['c', 'a', 'b'])
+        tree.insert('cow', 9, ['c', 'o', 'w'])
+        tree.insert('dog', 4, ['d', 'o', 'g'])
+        tree.insert('dot', 6, ['d', 'o', 't'])
+        assert tree.subtrees[0].value[0] == 'd'
+        assert tree.autocomplete([], 2) == [('cow', 9), ('dot', 6)]
+        assert tree.autocomplete(['c'], 2) == [('cow', 9), ('cat', 1)]
+
+def test_frozen_autocomplete() -> None:
+    cpt = CompressedPrefixTree('sum')
+    for word, weight in [('swell', 75), ('sweet', 50), ('swat', 51),
+                         ('swap', 76), ('cat', 5), ('car', 5), ('s', 1)]:
+        cpt.insert(word, weight, list(word))
+    cpt.remove(['c', 'a', 'r'])
+    frozen = cpt.freeze()
+    assert len(frozen) == len(cpt)
+    for prefix in [[], ['s'], ['s', 'w'], ['s', 'w', 'e'], ['s', 'w', 'a', 'p'],
+                   ['c', 'a', 'r'], ['x'], ['s', 'w', 'e', 'l', 'l', 's']]:
+        for limit in [None, 1, 2, 3]:
+            assert frozen.autocomplete(prefix, limit) == \
+                cpt.autocomplete(prefix, limit)
+    cpt.insert('cart', 1, ['c', 'a', 'r', 't'])
+    assert frozen.autocomplete(['c', 'a', 'r']) == []
+    assert CompressedPrefixTree('sum').freeze().autocomplete([]) == []
+    with pytest.raises(TypeError):
+        frozen.insert('x', 1, ['x'])
+    with pytest.raises(TypeError):
+        frozen.remove(['s'])
+
+def test_frozen_find_child() -> None:
+    cpt = CompressedPrefixTree('sum')
+    words = [''.join(r.choice('abcdefghij') for _ in range(r.randint(1, 4)))
+             for _ in range(200)]
+    for word in words:
+        cpt.insert(word, r.randint(1, 9), list(word))
+    frozen = cpt.freeze()
+    # The first symbols of each tree's subtrees are sorted for bisect.
+    for tree in range(len(frozen._first_starts) - 1):
+        symbols = frozen._first_symbols[frozen._first_starts[tree]:
+                                        frozen._first_starts[tree + 1]]
+        assert symbols == sorted(symbols)
+    for word in words + ['k', 'ak', 'abcdefghij']:
+        for end in range(len(word) + 1):
+            assert frozen.autocomplete(list(word[:end])) == \
+                cpt.autocomplete(list(word[:end]))
+    assert frozen.autocomplete([1]) == []
+    mixed = CompressedPrefixTree('sum')
+    for prefix in [[1, 2], ['a', 'b'], [1, 3], [(0,), 'c']]:
+        mixed.insert(str(prefix), 1.0, prefix)
+    frozen = mixed.freeze()
+    assert not frozen._first_sorted
+    for prefix in [[1], ['a'], [(0,)], [1, 3], ['x']]:
+        assert frozen.autocomplete(prefix) == mixed.autocomplete(prefix)
+
+def test_bulk_build() -> None:
+    entries = [('swell', 75, list('swell')), ('sweet', 50, list('sweet')),
+               ('swat', 51, list('swat')), ('swap', 76, list('swap')),
+               ('sweet', 30, list('sweet')), ('sw', 2, list('sw')),
+               ('cat', 80, list('cat'))]
+    for weight_type in ['sum', 'average']:
+        cpt = CompressedPrefixTree(weight_type)
+        for entry in entries:
+            cpt.insert(*entry)
+        bulk = CompressedPrefixTree.bulk_build(weight_type, entries)
+        assert str(bulk) == str(cpt)
+        assert len(bulk) == len(cpt)
+        for prefix in [[], ['s'], ['s', 'w'], ['s', 'w', 'e'], ['c', 'a']]:
+            assert bulk.autocomplete(prefix) == cpt.autocomplete(prefix)
+        bulk.remove(['s', 'w', 'e'])
+        cpt.remove(['s', 'w', 'e'])
+        assert str(bulk) == str(cpt)
+    assert len(CompressedPrefixTree.bulk_build('sum', [])) == 0
+
+def test_cpt_values_share_prefixes() -> None:
+    entries = [('swell', 75.0, list('swell')), ('sweet', 50.0, list('sweet')),
+               ('swat', 51.0, list('swat')), ('swap', 76.0, list('swap')),
+               ('sw', 2.0, list('sw')), ('cat', 80.0, list('cat')),
+               ('catch', 3.0, list('catch'))]
+    prefixes = {id(prefix) for _, _, prefix in entries}
+    cpt = CompressedPrefixTree('sum')
+    for entry in entries:
+        cpt.insert(*entry)
+    bulk = CompressedPrefixTree.bulk_build('sum', entries)
+    copy = CompressedPrefixTree.from_snapshot(bulk.snapshot())
+    assert str(copy) == str(bulk)
+    for tree in [cpt, bulk, copy]:
+        keys = set()
+        non_leaves = [tree]
+        for subtree in non_leaves:
+            assert isinstance(subtree.value, list)
+            assert subtree._value[:len(subtree.value)] == subtree.value
+            keys.add(id(subtree._value))
+            non_leaves.extend(s for s in subtree.subtrees if s.subtrees)
+        # The 10 non-leaf trees hold at most one list for each of the 7
+        # prefixes.
+        assert len(non_leaves) == 10
+        assert len(keys) <= 7
+        if tree is not copy:
+            assert keys <= prefixes
+    swa = bulk.subtrees[0]._children['a']
+    assert swa.value == ['s', 'w', 'a']
+    # value is a new list each time, so changing it changes no prefix.
+    swa.value.append('x')
+    assert swa.value == ['s', 'w', 'a']
+    assert ['x'] + swa.value == ['x', 's', 'w', 'a']
+    # Only leaves can be given a new value.
+    with pytest.raises(AssertionError):
+        swa.value = ['s', 'w', 'o']
+    assert swa.value == ['s', 'w', 'a']
+    assert bulk.autocomplete(['s', 'w', 'a']) == [('swap', 76), ('swat', 51)]
+
+def test_subtrees_stay_sorted() -> None:
+    for tree in [SimplePrefixTree('sum'), CompressedPrefixTree('sum')]:
+        for i in range(200):
+            tree.insert(i, 1 + i % 7, [0, i])
+        tree.insert(150, 1000, [0, 150])
+        tree.insert(3, 500, [0, 3])
+        tree.remove([0, 150])
+        tree.insert(40, 2, [0, 40])
+        weights = [subtree.weight for subtree in tree.subtrees[0].subtrees]
+        if isinstance(tree, CompressedPrefixTree):
+            weights = [subtree.weight for subtree in tree.subtrees]
+        assert weights == sorted(weights, reverse=True)
+        assert weights[0] == 504
+        assert tree.autocomplete([0], 2) == [(3, 504), (40, 8)]
+
+def test_engine_save_load(tmp_path) -> None:
+    path = str(tmp_path / 'engine.snapshot')
+    for autocompleter in ['simple', 'compressed']:
+        engine = SentenceAutocompleteEngine({
+            'file': 'data/google_searches.csv',
+            'autocompleter': autocompleter,
+            'weight_type': 'average'
+        })
+        engine.save(path)
+        loaded = SentenceAutocompleteEngine.load(path)
+        assert isinstance(loaded.autocompleter, type(engine.autocompleter))
+        assert len(loaded.autocompleter) == len(engine.autocompleter)
+        for prefix in ['', 'how', 'how to', 'what is', 'x']:
+            assert loaded.autocomplete(prefix, 10) == \
+                engine.autocomplete(prefix, 10)
+        loaded.remove('how')
+        assert loaded.autocomplete('how') == []
+        with pytest.raises(ValueError):
+            LetterAutocompleteEngine.load(path)
+    with pytest.raises(ValueError):
+        LetterAutocompleteEngine.load('data/lotr.txt')
+
+def test_letter_engine_chunked_ingestion() -> None:
+    config = {'file': 'data/google_no_swears.txt',
+              'autocompleter': 'compressed', 'weight_type': 'sum'}
+    engine = LetterAutocompleteEngine(config)
+    progress = []
+    reads = []
+
+    def record(stats) -> None:
+        progress.append(stats)
+        reads.append(stats.counts['read'])
+    chunked = LetterAutocompleteEngine(dict(config, chunk_size=100,
+                                            progress=record))
+    assert len(chunked.autocompleter) == len(engine.autocompleter)
+    for prefix in ['', 'h', 'ho', 'how to', 'zz']:
+        assert chunked.autocomplete(prefix, 10) == \
+            engine.autocomplete(prefix, 10)
+    stats = progress[-1]
+    assert len(progress) > 100
+    assert stats.counts['aggregate'] == stats.counts['filter']
+    # Each chunk is inserted as soon as it is read, and a line is inserted
+    # at most once for each chunk it is in.
+    assert reads[0] < reads[-1] == stats.counts['read']
+    assert len(chunked.autocompleter) <= stats.counts['insert'] <= \
+        stats.counts['filter']
+    assert stats.counts['sanitize'] == stats.counts['split']
+
+def test_split_lines_across_chunks() -> None:
+    from autocomplete_engines import IngestionStats, _split_lines
+    text = 'ab\n' + 'x' * 1000 + '\nc\n\nd'
+    for size in [1, 3, 7, 2000]:
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        stats = IngestionStats()
+        blocks = list(_split_lines(iter(chunks), stats))
+        assert '\n'.join(blocks).split('\n') == text.split('\n')
+        assert stats.counts['split'] == 5
+
+def test_sentence_entries_match_sanitizing_each_word() -> None:
+    import csv
+    import io
+    from autocomplete_engines import _sanitize, _sentence_entries
+    rows = [['Hello, World!', '2'], ['a\tb\u3000c', '1'], ['?!', '3'],
+            ['ΟΔΟΣ\xa0ΟΔΟΣ.', '1.5'], ['snake_case  x ', '4'],
+            ['line\nbreak', '1'], ['x\x00Σ', '2'], ['Hello World', '1']]
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    expected = {}
+    for dirty_string, weight in rows:
+        words = [_sanitize(word) for word in dirty_string.split()]
+        words = [word for word in words if word != '']
+        if words != []:
+            key = (_sanitize(dirty_string), tuple(words))
+            expected[key] = expected.get(key, 0) + float(weight)
+    entries = _sentence_entries(io.StringIO(text.getvalue(), newline=''))
+    assert [((string, tuple(words)), weight)
+            for string, weight, words in entries] == list(expected.items())
+
+def test_sentence_engine_word_prefixes() -> None:
+    from autocomplete_engines import _sentence_entries
+    config = {'file': 'data/google_searches.csv', 'weight_type': 'sum'}
+    with open(config['file'], encoding='utf8') as f:
+        words_tree = CompressedPrefixTree.bulk_build('sum', _sentence_entries(f))
+    for autocompleter in ['simple', 'compressed']:
+        engine = SentenceAutocompleteEngine(dict(config,
+                                                 autocompleter=autocompleter))
+        for prefix in ['', 'how', 'how to', 'what is the']:
+            assert engine.autocomplete(prefix, 5) == \
+                words_tree.autocomplete(prefix.split(), 5)
+        assert engine.autocomplete('how xyzzy') == []
+        assert engine.autocomplete_many(['xyzzy', 'how'], 2) == \
+            [[], words_tree.autocomplete(['how'], 2)]
+        # The Autocompleter itself still takes lists of words.
+        assert engine.autocompleter.autocomplete(['how', 'to'], 5) == \
+            words_tree.autocomplete(['how', 'to'], 5)
+        assert all(isinstance(value, str) for value, _ in
+                   engine.autocompleter.autocomplete([]))
+        num_values = len(engine.autocompleter)
+        engine.remove('xyzzy')
+        assert len(engine.autocompleter) == num_values
+    frozen = engine.autocompleter.freeze()
+    assert frozen.autocomplete(['how', 'to'], 5) == \
+        words_tree.autocomplete(['how', 'to'], 5)
+
+def test_sentence_engine_interns_words() -> None:
+    config = {'file': 'data/google_searches.csv', 'weight_type': 'sum',
+              'autocompleter': 'compressed'}
+    for processes in [1, 2]:
+        engine = SentenceAutocompleteEngine(dict(config, processes=processes))
+        # Equal words in different prefixes are the same string.
+        words = {}
+        stack = [engine.autocompleter]
+        while stack:
+            tree = stack.pop()
+            if not tree.is_leaf():
+                for word in tree.value:
+                    assert words.setdefault(word, word) is word
+                stack.extend(tree.subtrees)
+        assert 'how' in words
+
+def test_freeze_prefix_sequence_types() -> None:
+    from array import array
+    cpt = CompressedPrefixTree('sum')
+    cpt.insert('abc', 1.0, array('I', [1, 2, 3]))
+    cpt.insert('abd', 2.0, array('I', [1, 2, 4]))
+    frozen = cpt.freeze()
+    for prefix in [array('I', [1, 2]), [1, 2], (1, 2)]:
+        assert frozen.autocomplete(prefix) == [('abd', 2.0), ('abc', 1.0)]
+    assert frozen.autocomplete(array('I', [1, 3])) == []
+
+def test_engines_aggregate_duplicates(tmp_path) -> None:
+    letter_file = tmp_path / 'letters.txt'
+    letter_file.write_text('Cat\nca!t\ncar\n\ncat\ncar?\ncan\n')
+    sentence_file = tmp_path / 'sentences.csv'
+    sentence_file.write_text('a b,2\nab,1\na b!,0.5\ncat,4\n')
+    for autocompleter in ['simple', 'compressed']:
+        for weight_type in ['sum', 'average']:
+            config = {'autocompleter': autocompleter,
+                      'weight_type': weight_type}
+            for chunk_size in [2 ** 20, 8]:
+                # Small chunks put copies of a line in different chunks.
+                engine = LetterAutocompleteEngine(
+                    dict(config, file=str(letter_file), chunk_size=chunk_size))
+                assert engine.autocomplete('ca') == \
+                    [('cat', 3.0), ('car', 2.0), ('can', 1.0)]
+                assert len(engine.autocompleter) == 3
+            engine = SentenceAutocompleteEngine(
+                dict(config, file=str(sentence_file)))
+            # 'a b' and 'ab' are different words, so they are stored apart.
+            assert engine.autocomplete('a') == [('a b', 2.5)]
+            assert engine.autocomplete('ab') == [('ab', 1.0)]
+            assert len(engine.autocompleter) == 3
+
+def test_sanitize_matches_filter_conditions() -> None:
+    from autocomplete_engines import _sanitize, _sanitize_text, \
+        _filter_conditions
+    lines = ["Or '///!sout23hwa32rd to strike the Entwash?'", 'snake_case',
+             'ΑΣ ΟΔΟΣ.', 'Ⅻ ½ ٣ ² İstanbul ﬁ', 'tab\there\r', '', '  ']
+    lines.append(''.join(chr(i) for i in range(0x3000) if chr(i) != '\n'))
+    for line in lines:
+        expected = ''.join(filter(_filter_conditions, line.lower()))
+        assert _sanitize(line) == expected
+    assert _sanitize_text('\n'.join(lines)) == \
+        [_sanitize(line) for line in lines]
+
+def test_engine_cache() -> None:
+    config = {'file': 'data/google_no_swears.txt',
+              'autocompleter': 'compressed', 'weight_type': 'sum'}
+    engine = LetterAutocompleteEngine(config)
+    cached = LetterAutocompleteEngine(dict(config, cache_size=2))
+    assert engine.cache_info()['maxsize'] == 0
+    for prefix in ['how', 'how', 'what', 'how', 'wh', 'how', 'what']:
+        assert cached.autocomplete(prefix, 5) == engine.autocomplete(prefix, 5)
+    # 'what' was evicted by 'wh', since 'how' was used more recently.
+    assert cached.cache_info() == {'hits': 3, 'misses': 4, 'size': 2,
+                                   'maxsize': 2}
+    result = cached.autocomplete('how', 5)
+    result.clear()
+    assert cached.autocomplete('how', 5) == engine.autocomplete('how', 5)
+
+    for e in [engine, cached]:
+        e.remove('howa')
+        e.remove('zzzz')
+    assert cached.autocomplete('how', 5) == engine.autocomplete('how', 5)
+    assert cached.autocomplete('what', 5) == engine.autocomplete('what', 5)
+    # Only the result for 'how' was forgotten.
+    assert cached.cache_info()['hits'] == 6
+    assert cached.cache_info()['misses'] == 5
+
+    melodies = MelodyAutocompleteEngine({'file': 'data/songbook.csv',
+                                         'autocompleter': 'simple',
+                                         'weight_type': 'sum',
+                                         'cache_size': 10})
+    before = melodies.autocomplete([0, 0])
+    melodies.remove([0, 0, 0])
+    assert len(melodies.autocomplete([0, 0])) == len(before) - 2
+
+def test_prefix_cursor() -> None:
+    from prefix_tree import PrefixCursor
+    for autocompleter in ['simple', 'compressed']:
+        engine = LetterAutocompleteEngine({'file': 'data/google_no_swears.txt',
+                                           'autocompleter': autocompleter,
+                                           'weight_type': 'sum'})
+        cursor = engine.cursor()
+        assert cursor.top(5) == engine.autocomplete('', 5)
+        for letter in 'howx':
+            cursor.advance(letter)
+            assert cursor.top(5) == engine.autocomplete(cursor.prefix, 5)
+        assert cursor.top() == []
+        cursor.backspace()
+        assert cursor.top(5) == engine.autocomplete('how', 5)
+        engine.remove('howa')
+        assert cursor.top() == engine.autocomplete('how')
+        cursor.backspace()
+        cursor.backspace()
+        cursor.backspace()
+        cursor.backspace()
+        assert cursor.prefix == []
+
+    cpt = CompressedPrefixTree('average')
+    cursor = PrefixCursor(cpt)
+    cursor.advance('s')
+    assert cursor.top() == []
+    # The cursor is inside the compressed value ['s', 'w', 'a'].
+    cpt.insert('swap', 76, list('swap'))
+    cpt.insert('swat', 51, list('swat'))
+    assert cursor.top() == [('swap', 76), ('swat', 51)]
+    cursor.advance('w')
+    cursor.advance('a')
+    cursor.advance('t')
+    assert cursor.top() == [('swat', 51)]
+
+def test_autocomplete_many() -> None:
+    for autocompleter in ['simple', 'compressed']:
+        for cache_size in [0, 3]:
+            config = {'file': 'data/google_searches.csv',
+                      'autocompleter': autocompleter, 'weight_type': 'sum',
+                      'cache_size': cache_size}
+            engine = SentenceAutocompleteEngine(config)
+            prefixes = ['how to', '', 'how', 'what is', 'how to', 'zzz',
+                        'how to make', 'what']
+            expected = [engine.autocomplete(prefix, 3) for prefix in prefixes]
+            assert engine.autocomplete_many(prefixes, 3) == expected
+            assert engine.autocomplete_many([]) == []
+        engine = LetterAutocompleteEngine(dict(config, file='data/google_no_swears.txt'))
+        prefixes = ['h', 'ho', 'how', 'x', '', 'hox', 'ho']
+        results = engine.autocomplete_many(prefixes, 5)
+        assert results == [engine.autocomplete(p, 5) for p in prefixes]
+        results[1].clear()
+        assert results[6] == engine.autocomplete('ho', 5)
+        engine = MelodyAutocompleteEngine(dict(config, file='data/songbook.csv'))
+        prefixes = [[0, 0], [], [2, 2], [0]]
+        assert engine.autocomplete_many(prefixes) == \
+            [engine.autocomplete(p) for p in prefixes]
+
+def test_autocomplete_server() -> None:
+    import asyncio
+    import json
+    from autocomplete_server import AutocompleteServer, generate_load
+    engine = LetterAutocompleteEngine({'file': 'data/google_no_swears.txt',
+                                       'autocompleter': 'compressed',
+                                       'weight_type': 'sum'})
+
+    async def run() -> None:
+        server = AutocompleteServer(engine)
+        listener = await server.start(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for request in [{'prefix': 'how', 'limit': 3}, {'prefix': 'zzz'}]:
+            writer.write(json.dumps(request).encode() + b'\n')
+            response = json.loads(await reader.readline())
+            assert response['results'] == \
+                [list(result) for result in
+                 engine.autocomplete(request['prefix'], request.get('limit'))]
+        for bad in [b'{"prefix": 3}', b'{"prefix": ["h"]}',
+                    b'{"prefix": "h", "limit": true}']:
+            writer.write(bad + b'\n')
+            assert 'error' in json.loads(await reader.readline())
+
+        # Identical prefixes asked for at once share one lookup.
+        futures = [server.lookup('h', 5) for _ in range(3)]
+        futures.append(server.lookup('a', 5))
+        assert futures[0] is futures[2]
+        results = await asyncio.gather(*futures)
+        assert results[0] == engine.autocomplete('h', 5)
+        assert results[3] == engine.autocomplete('a', 5)
+        assert server.stats.coalesced == 2
+
+        load = await generate_load('127.0.0.1', port, ['a', 'b', 'how'],
+                                   clients=4, requests=50)
+        assert load['requests'] == 50
+        writer.write(b'{"stats": true}\n')
+        stats = json.loads(await reader.readline())
+        assert stats['requests'] == 52
+        assert 0 < stats['p50_ms'] <= stats['p99_ms']
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+
+    asyncio.run(run())
+
+def test_autocomplete_server_isolates_errors() -> None:
+    import asyncio
+    from autocomplete_server import AutocompleteServer
+    engine = LetterAutocompleteEngine({'file': 'data/google_no_swears.txt',
+                                       'autocompleter': 'compressed',
+                                       'weight_type': 'sum'})
+
+    class FailingEngine:
+        """Fail to autocomplete the prefix 'bad'."""
+        def autocomplete(self, prefix, limit=None):
+            if prefix == 'bad':
+                raise RuntimeError('bad prefix')
+            return engine.autocomplete(prefix, limit)
+
+        def autocomplete_many(self, prefixes, limit=None):
+            return [self.autocomplete(prefix, limit) for prefix in prefixes]
+
+    async def run() -> None:
+        server = AutocompleteServer(FailingEngine())
+        futures = [server.lookup(prefix, 3) for prefix in ['h', 'bad', 'a']]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        assert results[0] == engine.autocomplete('h', 3)
+        assert isinstance(results[1], RuntimeError)
+        assert results[2] == engine.autocomplete('a', 3)
+
+        # Cancelling one pending lookup doesn't stop the others from being
+        # answered, in the batch or one at a time.
+        for prefixes in [['h', 'a'], ['bad', 'h', 'a']]:
+            futures = [server.lookup(prefix, 3) for prefix in prefixes]
+            futures[-2].cancel()
+            assert await futures[-1] == engine.autocomplete('a', 3)
+        with pytest.raises(RuntimeError):
+            await futures[0]
+
+        # A coalesced request that is cancelled doesn't cancel the lookup
+        # the other requests share.
+        requests = [asyncio.ensure_future(server._respond(
+            b'{"prefix": "h", "limit": 3}')) for _ in range(2)]
+        await asyncio.sleep(0)
+        requests[0].cancel()
+        assert (await requests[1])['results'] == \
+            [list(result) for result in engine.autocomplete('h', 3)]
+
+        melodies = AutocompleteServer(MelodyAutocompleteEngine(
+            {'file': 'data/songbook.csv', 'autocompleter': 'simple',
+             'weight_type': 'sum'}))
+        for bad in [b'{"prefix": "ab"}', b'{"prefix": [1, "a"]}',
+                    b'{"prefix": [1.5]}']:
+            assert 'error' in await melodies._respond(bad)
+        assert 'results' in await melodies._respond(b'{"prefix": [2, -2]}')
+
+    asyncio.run(run())
+
+def test_fuzzy_autocomplete() -> None:
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        tree = tree_class('sum')
+        for word, weight in [('hello', 20), ('help', 10), ('jello', 5),
+                             ('hi', 30), ('yellow', 7)]:
+            tree.insert(word, weight, list(word))
+        assert tree.fuzzy_autocomplete(list('hel'), 0) == \
+            [('hello', 20, 0), ('help', 10, 0)]
+        assert tree.fuzzy_autocomplete(list('jwll'), 1) == [('jello', 5, 1)]
+        assert tree.fuzzy_autocomplete(list('jwll'), 2) == \
+            [('jello', 5, 1), ('hello', 20, 2), ('yellow', 7, 2)]
+        assert tree.fuzzy_autocomplete(list('jwll'), 2, 2) == \
+            [('jello', 5, 1), ('hello', 20, 2)]
+        assert tree.fuzzy_autocomplete(list('xyz'), 1) == []
+        assert tree.fuzzy_autocomplete(list('xq'), 2, 1) == [('hi', 30, 2)]
+    engine = LetterAutocompleteEngine({'file': 'data/google_no_swears.txt',
+                                       'autocompleter': 'compressed',
+                                       'weight_type': 'sum'})
+    exact = engine.autocomplete('how', 3)
+    assert engine.fuzzy_autocomplete('how', 2, 3) == \
+        [(value, weight, 0) for value, weight in exact]
+    assert all(edits <= 1 for _, _, edits in
+               engine.fuzzy_autocomplete('hpw', 1))
+
+
+def test_keep_top() -> None:
+    words = [''.join(r.choice('abc') for _ in range(r.randint(1, 6)))
+             for _ in range(300)]
+    prefixes = [[], ['a'], ['a', 'b'], ['b', 'c', 'a'], ['c', 'c']]
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        expected = tree_class('sum')
+        tree = tree_class('sum')
+        tree.keep_top(3)
+        for word in words:
+            weight = r.randint(1, 5)
+            expected.insert(word, weight, list(word))
+            tree.insert(word, weight, list(word))
+            if word.endswith('c'):
+                expected.remove(list(word[:2]))
+                tree.remove(list(word[:2]))
+            for prefix in prefixes:
+                for limit in [1, 3, 4, None]:
+                    assert tree.autocomplete(prefix, limit) == \
+                        expected.autocomplete(prefix, limit)
+    config = {'file': 'data/google_no_swears.txt',
+              'autocompleter': 'compressed', 'weight_type': 'sum'}
+    engine = LetterAutocompleteEngine(config)
+    top_engine = LetterAutocompleteEngine(dict(config, top_k=5))
+    for prefix in ['', 'h', 'how', 'zzz']:
+        assert top_engine.autocomplete(prefix, 5) == \
+            engine.autocomplete(prefix, 5)
+
+
+def test_concurrent_autocompleter() -> None:
+    import threading
+    from prefix_tree import ConcurrentAutocompleter
+    words = [''.join(r.choice('abc') for _ in range(r.randint(1, 6)))
+             for _ in range(300)]
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        expected = tree_class('sum')
+        autocompleter = ConcurrentAutocompleter(tree_class('sum'))
+        old = autocompleter.tree
+        done = threading.Event()
+        errors = []
+
+        def read() -> None:
+            while not done.is_set():
+                tree = autocompleter.tree
+                results = tree.autocomplete([])
+                if len(results) != len(tree) or \
+                        sum(weight for _, weight in results) != tree.weight:
+                    errors.append(str(tree))
+
+        readers = [threading.Thread(target=read) for _ in range(2)]
+        for reader in readers:
+            reader.start()
+        for word in words:
+            expected.insert(word, 1, list(word))
+            autocompleter.insert(word, 1, list(word))
+            if word.endswith('c'):
+                expected.remove(list(word[:2]))
+                autocompleter.remove(list(word[:2]))
+        done.set()
+        for reader in readers:
+            reader.join()
+        assert errors == []
+        assert str(autocompleter.tree) == str(expected)
+        assert len(old) == 0
+
+
+def test_cpt_merge() -> None:
+    entries = [('swell', 75, list('swell')), ('sweet', 50, list('sweet')),
+               ('swat', 51, list('swat')), ('swap', 76, list('swap')),
+               ('sweet', 30, list('sweet')), ('sw', 2, list('sw')),
+               ('cat', 80, list('cat')), ('swat', 1, list('swat'))]
+    for weight_type in ['sum', 'average']:
+        cpt = CompressedPrefixTree(weight_type)
+        for entry in entries:
+            cpt.insert(*entry)
+        merged = CompressedPrefixTree.bulk_build(weight_type, entries[:3])
+        merged.merge(CompressedPrefixTree.bulk_build(weight_type,
+                                                     entries[3:6]))
+        merged.merge(CompressedPrefixTree.bulk_build(weight_type,
+                                                     entries[6:]))
+        assert len(merged) == len(cpt)
+        assert merged.weight == cpt.weight
+        for prefix in [[], ['s'], ['s', 'w'], ['s', 'w', 'e'], ['c']]:
+            assert merged.autocomplete(prefix) == cpt.autocomplete(prefix)
+
+def test_parallel_engines() -> None:
+    for engine_class, file in [
+            (LetterAutocompleteEngine, 'data/google_no_swears.txt'),
+            (SentenceAutocompleteEngine, 'data/google_searches.csv')]:
+        config = {'file': file, 'autocompleter': 'compressed',
+                  'weight_type': 'sum'}
+        engine = engine_class(config)
+        parallel = engine_class(dict(config, processes=3))
+        assert len(parallel.autocompleter) == len(engine.autocompleter)
+        for prefix in ['', 'h', 'how', 'what is']:
+            assert parallel.autocomplete(prefix, 10) == \
+                engine.autocomplete(prefix, 10)
+
+def test_long_prefix() -> None:
+    prefix = [i % 10 for i in range(100000)]
+    for tree in [SimplePrefixTree('sum'), CompressedPrefixTree('sum')]:
+        tree.insert('long', 1, prefix)
+        tree.insert('longer', 2, prefix + [0])
+        tree.insert('short', 3, prefix[:10])
+        assert tree.autocomplete(prefix) == [('longer', 2), ('long', 1)]
+        tree.remove(prefix[:50000])
+        assert tree.autocomplete([]) == [('short', 3)]
+
+def test_spt_child_index() -> None:
+    spt = SimplePrefixTree('sum')
+    for c in s.ascii_lowercase:
+        spt.insert(c + 'x', 1, [c, 'x'])
+    spt.insert(['q', 'x'], 5, ['q', 'x'])
+    spt.insert(['q', 'x'], 2, ['q', 'x'])
+    spt.insert('qx', 3, ['q', 'x'])
+    assert len(spt) == 27
+    assert spt.subtrees[0].value == ['q']
+    assert spt.autocomplete(['q']) == [(['q', 'x'], 7), ('qx', 4)]
+    spt.remove(['q', 'x'])
+    assert spt.autocomplete(['q']) == []
+    assert len(spt) == 25
+    spt.insert('qx', 1, ['q', 'x'])
+    assert spt.autocomplete(['q', 'x']) == [('qx', 1)]
+
 def test_cpt_insert() -> None:
     """
     >>> cpt = CompressedPrefixTree('sum')
@@ -571,8 +1233,10 @@ def test_sentence_autocomplete() -> None:
             assert n1[i][0] == n2[i][0]
             assert n1[i][1] == n2[i][1]
 """
-"""
+
+
 def test_large_cpt_insert() -> None:
+    """
     >>> cpt = CompressedPrefixTree('sum')
     >>> prefix = ['a', 'l', 'l', ' ', 'i', ' ', 'w', 'a', 'n', 't', ' ', \
         'i', 's', ' ', 'n', 'o', 't', 'h', 'i', 'n', 'g', ' ',\
@@ -710,6 +1374,7 @@ def check_rep_vars_spt(spt: SimplePrefixTree) -> None:
             # Subtree value should be prefix of tree value
             if not subtree.is_leaf():
                 assert _is_prefix(spt.value, subtree.value)
+                assert subtree._parent is spt
             check_rep_vars_spt(subtree)
 
 